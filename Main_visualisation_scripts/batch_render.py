@@ -0,0 +1,256 @@
+"""
+Headless batch rendering of freeze-frame figures and animations for many runs.
+
+Run from the repository root, e.g.
+
+    python Main_visualisation_scripts/batch_render.py model=Brinkman N0=2000 --frames 200 --video mp4 --workers 8
+
+Runs are selected with the same name=v1,v2,... filters as batch_spread_analysis.py, and
+outliers are filtered out as in multi_frame_graphs.py. For each run, in --output-dir:
+
+- {stem}_freeze_frames.png: --freeze-frames frames spread over the run, overlaid in one tall
+  figure as in multi_frame_graphs.py,
+- {stem}/frame_00000.png, ...: an animation of --frames frames spread over the run (frames
+  left by an earlier render are removed first), and with --video, {stem}.mp4 (needs ffmpeg)
+  or {stem}.gif.
+
+Axis limits come from the data instead of hand-picked dictionaries, using the 1st and 99th
+percentiles of each frame's particles (particles outside the limits are not drawn). In the
+freeze-frame figure, each frame's z-limits are moved to the midpoint where neighbouring
+frames overlap (as z_limits does by hand), and the x and y limits are those of the median
+frame (as the fixed x_lim, y_lim). The animation keeps x and y fixed and follows the cloud
+in z with a window of constant height, so the scale does not change between frames; with
+--zoom, each frame is instead fitted to its own particles (as the zoomed frames of
+multi_frame_graphs.py), which shows the structure of the early, compact cloud.
+
+Frames are rendered in chunks by a process pool with matplotlib's Agg backend; each
+worker opens the run memory-mapped and reads only the frames of its chunk.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+import matplotlib.cm as cm
+import matplotlib.ticker as ticker
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Simulation_scripts"))
+from archive import load_trajectory
+from catalogue import Catalogue
+from sweep import parse_grid
+
+# Colour map of each model (as in multi_frame_graphs.py):
+COLOUR_MAPS = {"Brinkman": cm.winter, "Magnetic": cm.autumn, "Stokes": cm.cool, "Stickman": cm.summer}
+PERCENTILES = [1, 50, 99]  # Per-frame statistics used for the axis limits
+PADDING = 0.05  # Fraction of each axis range added on both sides
+
+
+## Evenly spaced frame indices over a run of T frames (the first frame only if first=True):
+def spread_frames(T, count, first=True):
+    if count <= 0:
+        return np.array([], dtype=int)
+    indices = np.linspace(0, T - 1, count if first else count + 1).round().astype(int)
+    return np.unique(indices if first else indices[1:])
+
+
+## Percentiles (PERCENTILES, per axis) of the filtered particles in each frame, shape (F, 3, 3):
+def frame_statistics(trajectory, indices, mask):
+    return np.array([np.percentile(trajectory.frames[k][mask], PERCENTILES, axis=0) for k in indices])
+
+
+## Pad a range by a fraction of its length:
+def padded(low, high):
+    pad = PADDING * (high - low) or 0.5
+    return (float(low - pad), float(high + pad))
+
+
+## z-limits of overlaid freeze frames from their statistics: each frame's 1st to 99th percentile
+## heights, split at the midpoint where a frame overlaps the next one down:
+def freeze_frame_z_limits(statistics):
+    lows, highs = statistics[:, 0, 2].copy(), statistics[:, 2, 2].copy()
+    order = np.argsort(-statistics[:, 1, 2])  # Highest frame first
+    for upper, lower in zip(order[:-1], order[1:]):
+        if highs[lower] > lows[upper]:
+            lows[upper] = highs[lower] = (lows[upper] + highs[lower]) / 2
+    return list(zip(lows.tolist(), highs.tolist()))
+
+
+## Axis limits of each animation frame: fixed x and y, and a z window of constant height centred on the
+## frame (or, with zoom, each frame's own limits):
+def animation_limits(statistics, zoom=False):
+    if zoom:
+        return [tuple(padded(low, high) for low, high in zip(frame[0], frame[2])) for frame in statistics]
+    x_lim = padded(statistics[:, 0, 0].min(), statistics[:, 2, 0].max())
+    y_lim = padded(statistics[:, 0, 1].min(), statistics[:, 2, 1].max())
+    height = (statistics[:, 2, 2] - statistics[:, 0, 2]).max()
+    centres = (statistics[:, 2, 2] + statistics[:, 0, 2]) / 2
+    return [(x_lim, y_lim, padded(c - height / 2, c + height / 2)) for c in centres]
+
+
+## Name of a run's outputs (Stokes stems carry no model name, as in spread_analysis_save_to_csv.py):
+def output_name(run):
+    return f"{'Stokes_' if run.model == 'Stokes' else ''}{run.stem}"
+
+
+## Title of a frame (simulated time when stored, otherwise the frame index):
+def frame_label(trajectory, k):
+    return f"Time {trajectory.times[k]:g}" if trajectory.times_known else f"Timestep {k}"
+
+
+def label_axes(ax):
+    ax.set_xlabel("X", fontsize=8)
+    ax.set_ylabel("Y", fontsize=8)
+    ax.set_zlabel("Z", fontsize=8)
+    ax.tick_params(labelsize=8)
+    ax.xaxis.set_major_locator(ticker.MaxNLocator(5))
+    ax.yaxis.set_major_locator(ticker.MaxNLocator(5))
+
+
+## Render a freeze-frame figure (in a worker process):
+def render_freeze_frames(path, mask, indices, statistics, colour_map, filename, dpi):
+    trajectory = load_trajectory(path)
+    time_colors = colour_map(np.linspace(0, 1, len(indices) + 1))
+    x_lim = padded(np.median(statistics[:, 0, 0]), np.median(statistics[:, 2, 0]))
+    y_lim = padded(np.median(statistics[:, 0, 1]), np.median(statistics[:, 2, 1]))
+    z_limits = freeze_frame_z_limits(statistics)
+
+    fig = plt.figure(figsize=(6, 12))
+    ax = fig.add_subplot(111, projection="3d")
+    for i, (k, (z_min, z_max)) in enumerate(zip(indices, z_limits)):
+        x, y, z = trajectory.frames[k][mask].T
+        valid_mask = (x >= x_lim[0]) & (x <= x_lim[1]) & \
+                     (y >= y_lim[0]) & (y <= y_lim[1]) & \
+                     (z >= z_min) & (z <= z_max)
+        ax.scatter(x[valid_mask], y[valid_mask], z[valid_mask], color=time_colors[-i-1], alpha=1, s=1)
+
+    ax.set_box_aspect([1, 1, 4])  # 4x stretch in vertical direction, as in multi_frame_graphs.py
+    ax.set_xlim(x_lim)
+    ax.set_ylim(y_lim)
+    ax.set_zlim(min(z for z, _ in z_limits), max(z for _, z in z_limits))
+    label_axes(ax)
+    ax.set_title(os.path.basename(filename)[:-len("_freeze_frames.png")], fontsize=10)
+    fig.savefig(filename, dpi=dpi)
+    plt.close(fig)
+    return 1
+
+
+## Render a chunk of animation frames (in a worker process), frame indices[i] to {directory}/frame_{positions[i]:05d}.png:
+def render_frames(path, mask, indices, positions, limits, colour, directory, dpi):
+    trajectory = load_trajectory(path)
+    fig = plt.figure(figsize=(6, 6))
+    ax = fig.add_subplot(111, projection="3d")
+    for k, position, (x_lim, y_lim, z_lim) in zip(indices, positions, limits):
+        x, y, z = trajectory.frames[k][mask].T
+        valid_mask = (x >= x_lim[0]) & (x <= x_lim[1]) & \
+                     (y >= y_lim[0]) & (y <= y_lim[1]) & \
+                     (z >= z_lim[0]) & (z <= z_lim[1])
+        ax.clear()
+        ax.scatter(x[valid_mask], y[valid_mask], z[valid_mask], color=colour, alpha=1, s=1)
+        ax.set_xlim(x_lim)
+        ax.set_ylim(y_lim)
+        ax.set_zlim(z_lim)
+        ax.set_box_aspect([x_lim[1] - x_lim[0], y_lim[1] - y_lim[0], z_lim[1] - z_lim[0]])
+        label_axes(ax)
+        ax.set_title(frame_label(trajectory, k), fontsize=10)
+        fig.savefig(os.path.join(directory, f"frame_{position:05d}.png"), dpi=dpi)
+    plt.close(fig)
+    return len(indices)
+
+
+## Create an animation's frame directory, removing the frames of any earlier (possibly longer) render:
+def clear_frames(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith("frame_") and name.endswith(".png"):
+            os.remove(os.path.join(directory, name))
+
+
+## Assemble a directory of frame_*.png images into {directory}.mp4 (with ffmpeg) or {directory}.gif:
+def make_video(directory, fps, kind):
+    filename = f"{directory}.{kind}"
+    if kind == "mp4":
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps),
+                        "-i", os.path.join(directory, "frame_%05d.png"),
+                        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", filename], check=True)
+    else:
+        from PIL import Image
+        names = sorted(name for name in os.listdir(directory) if name.startswith("frame_") and name.endswith(".png"))
+        images = [Image.open(os.path.join(directory, name)).convert("P", palette=Image.ADAPTIVE) for name in names]
+        images[0].save(filename, save_all=True, append_images=images[1:], duration=1000 / fps, loop=0)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render freeze-frame figures and animations of many runs without a display.")
+    parser.add_argument("filters", nargs="*", help="name=v1,v2,... for model, seed or a parameter, e.g. model=Brinkman alpha=1,5")
+    parser.add_argument("--directory", default="npy_output_files")
+    parser.add_argument("--output-dir", default="renders")
+    parser.add_argument("--freeze-frames", type=int, default=6, help="Frames overlaid in the freeze-frame figure (0 for none)")
+    parser.add_argument("--frames", type=int, default=0, help="Animation frames per run (0 for none)")
+    parser.add_argument("--zoom", action="store_true", help="Fit each animation frame to its own particles")
+    parser.add_argument("--video", choices=["mp4", "gif"], default=None, help="Also assemble each animation into a video")
+    parser.add_argument("--fps", type=float, default=20)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--velocity-percentile", type=float, default=90, help="Outlier filter on displacement")
+    parser.add_argument("--distance-percentile", type=float, default=90, help="Outlier filter on final distance")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--chunk", type=int, default=20, help="Animation frames per task")
+    args = parser.parse_args()
+    if args.video == "mp4" and shutil.which("ffmpeg") is None:
+        parser.error("--video mp4 needs ffmpeg; use --video gif")
+
+    catalogue = Catalogue(args.directory)
+    runs = catalogue.select(parse_grid(args.filters))  # One run per stem, archives preferred
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Frames, masks and axis limits (from a pass over the selected frames) of each run, split into tasks:
+    tasks, animations = [], []
+    for run in runs:
+        try:
+            mask = run.outlier_mask(args.velocity_percentile, args.distance_percentile)
+            T = run.trajectory.shape[0]
+        except ValueError as error:
+            print(f"  skip {run.stem}: {error}")  # Placeholder or unreadable files
+            continue
+        if not mask.any():
+            print(f"  skip {run.stem}: no particles left after filtering outliers")
+            continue
+        colour_map = COLOUR_MAPS.get(run.model, cm.viridis)
+
+        freeze = spread_frames(T, args.freeze_frames, first=False)
+        if len(freeze):
+            statistics = frame_statistics(run.trajectory, freeze, mask)
+            filename = os.path.join(args.output_dir, f"{output_name(run)}_freeze_frames.png")
+            tasks.append((render_freeze_frames, (run.path, mask, freeze, statistics, colour_map, filename, args.dpi)))
+
+        frames = spread_frames(T, args.frames)
+        if len(frames):
+            limits = animation_limits(frame_statistics(run.trajectory, frames, mask), args.zoom)
+            directory = os.path.join(args.output_dir, output_name(run))
+            clear_frames(directory)  # Otherwise stale frames would end up in the video
+            for start in range(0, len(frames), args.chunk):
+                chunk = slice(start, start + args.chunk)
+                positions = range(len(frames))[chunk]
+                tasks.append((render_frames, (run.path, mask, frames[chunk], positions, limits[chunk],
+                                              colour_map(0.5), directory, args.dpi)))
+            animations.append(directory)
+    print(f"{len(runs)} runs selected, {len(tasks)} rendering tasks ({args.workers} workers)")
+
+    rendered = 0
+    with ProcessPoolExecutor(args.workers, initializer=matplotlib.use, initargs=("Agg",)) as pool:
+        futures = [pool.submit(function, *arguments) for function, arguments in tasks]
+        for future in as_completed(futures):
+            rendered += future.result()
+    print(f"Rendered {rendered} images to {args.output_dir}")
+
+    if args.video:
+        for directory in animations:
+            print(f"  saved {make_video(directory, args.fps, args.video)}")
+
+
+if __name__ == "__main__":
+    main()
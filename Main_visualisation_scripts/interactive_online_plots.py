@@ -1,6 +1,12 @@
 import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
 from matplotlib import cm
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Simulation_scripts"))
+from catalogue import Catalogue
+from plotly_export import animation_layout, decimated_frames, lightweight_figure, write_html
 
 ####################################################################################
 """Parameters to determine which simulation to plot:"""
@@ -15,35 +21,32 @@ Magnetic = False # Set to True for magntised flow
 
 t = t_span[1]
 max_frames = 500 # Set maximum number of frames to include in animation
+
+lightweight_html = False # Set True for a compact HTML file (frames spread over the whole run, quantised coordinates, shared colours; see plotly_export.py)
+target_size_mb = 20 # Approximate size limit of the compact HTML file (fewer frames are kept to fit)
+quantise = True # Store compact coordinates as uint16 (no hover labels) rather than float32
 ####################################################################################
 
-## Load simulation results:
+## Look up the simulation in the catalogue of npy_output_files/ (an archive is preferred to the (N, 3, T) .npy file):
+catalogue = Catalogue("npy_output_files")
 if Brinkman:
-    reshaped = np.load(f"npy_output_files/BM_{alpha}_{N0}_{t}_output.npy")
+    run = catalogue.get("Brinkman", alpha=alpha, N0=N0, T=t)
 elif Magnetic:
-    reshaped = np.load(f"npy_output_files/Magnetic_{beta}_{alpha}_{N0}_{t}_output.npy")
+    run = catalogue.get("Magnetic", beta=beta, alpha=alpha, N0=N0, T=t)
 else:
-    reshaped = np.load(f"npy_output_files/{N0}_{t}_output.npy")
+    run = catalogue.get("Stokes", N0=N0, T=t)
+trajectory = run.trajectory
+reshaped = trajectory.positions  # (N, 3, T) view, memory-mapped
 
 N, _, T = reshaped.shape 
 
+n_frames = T # All frames, for the compact export
 T = min(T, max_frames) 
 
-## Filter out outlier particles:
-velocities = np.linalg.norm(reshaped[:, :, -1] - reshaped[:, :, 0], axis=1)
-
-final_positions = reshaped[:, :, -1]
-center_of_mass = np.mean(final_positions, axis=0)
-
-distances = np.linalg.norm(final_positions - center_of_mass, axis=1)
-
-velocity_threshold = np.percentile(velocities, 78)
-distance_threshold = np.percentile(distances, 85)
+## Filter out outlier particles (<78th percentile displacement, <85th percentile final distance, cached by the catalogue):
+mask = run.outlier_mask(78, 85)
 
-mask = (velocities < velocity_threshold) & (distances < distance_threshold)
-
-filtered_positions = reshaped[mask, :, :T]
-filtered_N = filtered_positions.shape[0]
+filtered_N = int(mask.sum())
 
 ## Generate random colour maps using consistent colour maps for each simulation type:
 if Brinkman:
@@ -61,18 +64,6 @@ else:
     hex_colors = ["rgba({},{},{},{})".format(
         int(c[0] * 255), int(c[1] * 255), int(c[2] * 255), c[3]) for c in rand_colors]
 
-## Create list of particle positions for each frame:
-frames = []
-for frame in range(T):
-    frame_data = go.Scatter3d(
-        x=filtered_positions[:, 0, frame],
-        y=filtered_positions[:, 1, frame],
-        z=filtered_positions[:, 2, frame],
-        mode="markers",
-        marker=dict(size=3, opacity=0.7, color=hex_colors),
-    )
-    frames.append(go.Frame(data=[frame_data], name=str(frame)))
-
 ## Define custom title based on simulation type and parameters:
 if Brinkman:
     custom_title=str(f"Brinkman flow simulation for α={alpha}, N0={N0}")
@@ -83,54 +74,7 @@ elif Magnetic:
 else:
     custom_title=str(f"Stokes flow simulation for N0={N0}")
 
-## Create interactive 3D plot:
-fig = go.Figure(
-    data=[go.Scatter3d(
-        x=filtered_positions[:, 0, 0],
-        y=filtered_positions[:, 1, 0],
-        z=filtered_positions[:, 2, 0],
-        mode="markers",
-        marker=dict(size=3, opacity=0.7, color=hex_colors),
-    )],
-    layout=go.Layout(
-        title=custom_title,      
-        updatemenus=[{
-            "buttons": [
-                {
-                    "args": [None, {"frame": {"duration": 50, "redraw": True}, "fromcurrent": True}],
-                    "label": "▶ Play",
-                    "method": "animate",
-                },
-                {
-                    "args": [[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate", "transition": {"duration": 0}}],
-                    "label": "❚❚ Pause",
-                    "method": "animate",
-                },
-            ],
-            "direction": "left",
-            "pad": {"r": 10, "t": 87},
-            "showactive": False,
-            "type": "buttons",
-            "x": 0.1,
-            "xanchor": "right",
-            "y": 0,
-            "yanchor": "top",
-        }],
-        sliders=[{
-            "active": 0,
-            "steps": [
-                {"args": [[str(k)], {"frame": {"duration": 0, "redraw": True}, "mode": "immediate"}], "label": str(k), "method": "animate"}
-                for k in range(T)
-            ],
-        }],
-    ),
-    frames=frames,
-)
-
-## Show interactive plot:
-fig.show()
-
-## Save interactive plot as a HTML file:
+## Name of the HTML file:
 if Brinkman:
     html_filename = f"BM_{alpha}_{N0}_{t}_particle_motion.html"
 elif Magnetic:
@@ -138,5 +82,49 @@ elif Magnetic:
 else:
     html_filename = f"Stokes_{N0}_{t}_particle_motion.html"
 
-fig.write_html(html_filename)
+if lightweight_html:
+    ## Compact export: frames spread evenly over the run, read from disk one selected frame at a time:
+    indices = decimated_frames(n_frames, filtered_N, max_frames, target_size_mb * 2**20, quantise)
+    positions = np.stack([trajectory.frames[k][mask] for k in indices])
+    labels = [f"{time:g}" for time in trajectory.times[indices]] if trajectory.times_known else indices
+    fig = lightweight_figure(positions, hex_colors, labels, custom_title, quantise)
+
+    ## Show and save interactive plot (plotly.js loaded from its CDN):
+    pio.show(fig, validate=False)
+    write_html(fig, html_filename)
+
+else:
+    filtered_positions = reshaped[mask, :, :T]
+
+    ## Create list of particle positions for each frame:
+    frames = []
+    for frame in range(T):
+        frame_data = go.Scatter3d(
+            x=filtered_positions[:, 0, frame],
+            y=filtered_positions[:, 1, frame],
+            z=filtered_positions[:, 2, frame],
+            mode="markers",
+            marker=dict(size=3, opacity=0.7, color=hex_colors),
+        )
+        frames.append(go.Frame(data=[frame_data], name=str(frame)))
+
+    ## Create interactive 3D plot:
+    fig = go.Figure(
+        data=[go.Scatter3d(
+            x=filtered_positions[:, 0, 0],
+            y=filtered_positions[:, 1, 0],
+            z=filtered_positions[:, 2, 0],
+            mode="markers",
+            marker=dict(size=3, opacity=0.7, color=hex_colors),
+        )],
+        layout=go.Layout(**animation_layout(custom_title, range(T))),
+        frames=frames,
+    )
+
+    ## Show interactive plot:
+    fig.show()
+
+    ## Save interactive plot as a HTML file:
+    fig.write_html(html_filename)
+
 print(f"Interactive plot saved as {html_filename}")
@@ -2,6 +2,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import matplotlib.ticker as ticker
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Simulation_scripts"))
+from catalogue import Catalogue
+from batch_render import PERCENTILES, freeze_frame_z_limits, padded
 
 ####################################################################################
 """Parameters to be adjusted to customise plot appearance:"""
@@ -19,6 +24,7 @@ T = 1000 # simulation duration
 
 ## Manually select time indices for holistic plot:
 timesteps = [5, 40, 87, 137, 176, 220] 
+timesteps_are_times = False # Set True if timesteps (and selected_timesteps) are simulated times rather than frame indices (needs an archive, which stores the frame times)
 
 ## (optional) Manually select time indices for zoomed-in plot (if Zoomed_frames = True):
 selected_timesteps = [56, 226, 438]
@@ -37,6 +43,8 @@ z_limits = {
 x_lim = (-10, 10)
 y_lim = (-10, 10)
 
+auto_limits = False # Set True to compute z_limits, x_lim and y_lim from the data instead (as batch_render.py does)
+
 ## Define custom axis limits for zoomed-in freeze frames:
 zoomed_x_limits = {
     56: (-2, 2),
@@ -57,27 +65,33 @@ zoomed_z_limits = {
 } 
 ####################################################################################
 
-## Load simulation results:
+## Look up the simulation in the catalogue of npy_output_files/ (an archive is preferred to the (N, 3, T) .npy file):
+catalogue = Catalogue("npy_output_files")
 if Brinkman:
-    reshaped = np.load(f"npy_output_files/BM_{alpha}_{N0}_{T}_output.npy")
+    run = catalogue.get("Brinkman", alpha=alpha, N0=N0, T=T)
 elif Magnetic:
-    reshaped = np.load(f"npy_output_files/Magnetic_{beta}_{alpha}_{N0}_{T}_output.npy")
+    run = catalogue.get("Magnetic", beta=beta, alpha=alpha, N0=N0, T=T)
 else:
-    reshaped = np.load(f"npy_output_files/{N0}_{T}_output.npy")
-
-## Filter for <95th percentile velocity + final position particles for visual clarity:
-velocities = np.linalg.norm(reshaped[:, :, -1] - reshaped[:, :, 0], axis=1)
-final_positions = reshaped[:, :, -1]
-center_of_mass = np.mean(final_positions, axis=0)
-distances = np.linalg.norm(final_positions - center_of_mass, axis=1)
-
-velocity_threshold = np.percentile(velocities, 90)
-distance_threshold = np.percentile(distances, 90)
-
-mask = (velocities < velocity_threshold) & (distances < distance_threshold)
-filtered_positions = reshaped[mask, :, :]
-filtered_N = filtered_positions.shape[0]
-
+    run = catalogue.get("Stokes", N0=N0, T=T)
+trajectory = run.trajectory
+
+## Filter for <90th percentile velocity + final position particles for visual clarity (cached by the catalogue):
+mask = run.outlier_mask(90, 90)
+filtered_N = np.count_nonzero(mask)
+
+## Filtered positions (filtered_N, 3) of a selected timestep (only that frame is read from disk):
+def filtered_frame(t):
+    if timesteps_are_times and not trajectory.times_known:
+        raise ValueError(f"{trajectory.path} has no stored times; use frame indices (timesteps_are_times = False)")
+    frame = trajectory.frame_index(t) if timesteps_are_times else t
+    return trajectory.frames[frame][mask]
+
+## Replace the hand-picked limits by limits computed from the selected frames:
+if auto_limits:
+    statistics = np.array([np.percentile(filtered_frame(t), PERCENTILES, axis=0) for t in timesteps])
+    z_limits = dict(zip(timesteps, freeze_frame_z_limits(statistics)))
+    x_lim = padded(np.median(statistics[:, 0, 0]), np.median(statistics[:, 2, 0]))
+    y_lim = padded(np.median(statistics[:, 0, 1]), np.median(statistics[:, 2, 1]))
 
 ## Define consistent colour maps for plotting:
 if Brinkman:
@@ -92,7 +106,7 @@ fig = plt.figure(figsize=(6, 12))
 ax = fig.add_subplot(111, projection='3d')
 
 for i, t in enumerate(timesteps):
-    x, y, z = filtered_positions[:, 0, t], filtered_positions[:, 1, t], filtered_positions[:, 2, t]
+    x, y, z = filtered_frame(t).T
 
     z_min, z_max = z_limits.get(t, (-np.inf, np.inf)) 
     valid_mask = (x >= x_lim[0]) & (x <= x_lim[1]) & \
@@ -123,7 +137,7 @@ if Zoomed_frames:
         color_idx = timesteps.index(t) 
         frame_color = time_colors[color_idx]
 
-        x, y, z = filtered_positions[:, 0, t], filtered_positions[:, 1, t], filtered_positions[:, 2, t]
+        x, y, z = filtered_frame(t).T
 
         z_min, z_max = zoomed_z_limits.get(t, (-np.inf, np.inf))
         x_min, x_max = zoomed_x_limits.get(t, (-np.inf, np.inf))
@@ -143,7 +157,7 @@ if Zoomed_frames:
         ax_freeze.set_xlabel("X", fontsize=8)
         ax_freeze.set_ylabel("Y", fontsize=8)
         ax_freeze.set_zlabel("Z", fontsize=8)
-        ax_freeze.set_title(f"Timestep {t}", fontsize=10)
+        ax_freeze.set_title(f"Time {t}" if timesteps_are_times else f"Timestep {t}", fontsize=10)
 
         plt.show()
 
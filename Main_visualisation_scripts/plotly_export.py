@@ -0,0 +1,133 @@
+"""
+Compact HTML export of particle animations (lightweight_html = True in interactive_online_plots.py).
+
+The default export builds a go.Frame per frame, each storing its coordinates as JSON text
+and its own copy of the marker colours, and embeds plotly.js (~4.5 MB) in the file. Here the
+figure is built directly as a dict (no per-frame validation):
+
+- frames are picked evenly over the whole run, at most max_frames of them and no more than
+  fit in a target file size,
+- coordinates are quantised to uint16 on a grid shared by all frames and axes (so the aspect
+  ratio is kept), with the axis ticks labelled in simulation units,
+- the marker colours are stored once, on the initial trace; frames only carry x, y and z,
+- arrays are embedded as base64 typed arrays ({"dtype": ..., "bdata": ...}), which plotly.js
+  (2.28 or later) reads directly,
+- plotly.js is loaded from its CDN when the page is opened, and the "/" characters of the
+  base64 data are not escaped (plotly writes each as the 6-byte "\\u002f").
+
+Quantised markers have no hover labels (they would show grid units); with quantise = False,
+coordinates are stored as float32 in simulation units and keep them.
+"""
+
+import base64
+import numpy as np
+import plotly.io as pio
+
+QUANTISED_LEVELS = 65535  # Largest uint16 grid value
+FRAME_OVERHEAD = 300  # Bytes per frame besides its coordinates (frame and slider step entries)
+FIXED_OVERHEAD = 20_000  # Bytes of page, layout and controls
+COLOUR_BYTES = 26  # Bytes per particle of the shared "rgba(r,g,b,a)" colour list
+MAX_TICKS = 2000  # Tick labels per axis
+
+
+## Encode an array as a plotly.js typed array:
+def typed_array(values):
+    values = np.ascontiguousarray(values)
+    return {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values).decode("ascii")}
+
+
+## Evenly spaced frame indices, at most max_frames and within an estimated file size (bytes):
+def decimated_frames(T, n, max_frames, target_bytes=None, quantise=True):
+    count = min(T, max_frames)
+    if target_bytes is not None:
+        itemsize = 2 if quantise else 4
+        frame_bytes = 3 * 4 * -(-n * itemsize // 3) + FRAME_OVERHEAD  # base64 of x, y and z
+        count = min(count, max(2, int(target_bytes - FIXED_OVERHEAD - COLOUR_BYTES * n) // frame_bytes))
+    return np.unique(np.linspace(0, T - 1, count).round().astype(int))
+
+
+## Quantise (F, n, 3) positions to uint16 on a common grid, returning the grid values, grid origin and step:
+def quantise_positions(positions):
+    origin = positions.min(axis=(0, 1))
+    step = (positions - origin).max() / QUANTISED_LEVELS or 1.0
+    return np.round((positions - origin) / step).astype(np.uint16), origin, step
+
+
+## Round up to 1, 2 or 5 times a power of ten:
+def nice_number(x):
+    power = 10.0 ** np.floor(np.log10(x))
+    return next(m * power for m in (1, 2, 5, 10) if m * power >= x * (1 - 1e-9))
+
+
+## Tick positions (grid units) and labels (simulation units) of one axis from its (F, n) coordinates,
+## spaced for about ticks_per_frame ticks across a typical frame and covering the whole run:
+def axis_ticks(values, origin, step, ticks_per_frame=5):
+    low, high = values.min(), values.max()
+    extent = np.median(values.max(axis=1) - values.min(axis=1))
+    spacing = nice_number(max(extent / ticks_per_frame, (high - low) / MAX_TICKS, 1e-12))
+    ticks = np.arange(np.floor(low / spacing), np.ceil(high / spacing) + 1) * spacing
+    return dict(tickmode="array", tickvals=((ticks - origin) / step).tolist(), ticktext=[f"{t:.6g}" for t in ticks])
+
+
+## Play/pause buttons and frame slider, for frames named by their labels:
+def animation_layout(title, labels):
+    return dict(
+        title=title,
+        updatemenus=[{
+            "buttons": [
+                {
+                    "args": [None, {"frame": {"duration": 50, "redraw": True}, "fromcurrent": True}],
+                    "label": "▶ Play",
+                    "method": "animate",
+                },
+                {
+                    "args": [[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate", "transition": {"duration": 0}}],
+                    "label": "❚❚ Pause",
+                    "method": "animate",
+                },
+            ],
+            "direction": "left",
+            "pad": {"r": 10, "t": 87},
+            "showactive": False,
+            "type": "buttons",
+            "x": 0.1,
+            "xanchor": "right",
+            "y": 0,
+            "yanchor": "top",
+        }],
+        sliders=[{
+            "active": 0,
+            "steps": [
+                {"args": [[str(k)], {"frame": {"duration": 0, "redraw": True}, "mode": "immediate"}], "label": str(k), "method": "animate"}
+                for k in labels
+            ],
+        }],
+    )
+
+
+## Figure dict of an animation of (F, n, 3) positions, with one colour per particle and frames named by labels:
+def lightweight_figure(positions, colours, labels, title, quantise=True):
+    positions = np.asarray(positions, dtype=np.float64)
+    layout = animation_layout(title, labels)
+    if quantise:
+        grid, origin, step = quantise_positions(positions)
+        layout["scene"] = {f"{axis}axis": dict(title=dict(text=axis), **axis_ticks(positions[:, :, i], origin[i], step))
+                           for i, axis in enumerate("xyz")}
+        hover = dict(hoverinfo="skip")
+    else:
+        grid, hover = positions.astype(np.float32), {}
+
+    grid = np.ascontiguousarray(grid.transpose(0, 2, 1))  # (F, 3, n), so each frame's x, y and z are contiguous
+    coordinates = [{axis: typed_array(grid[k, i]) for i, axis in enumerate("xyz")} for k in range(len(grid))]
+    trace = dict(type="scatter3d", mode="markers", marker=dict(size=3, opacity=0.7, color=list(colours)),
+                 **coordinates[0], **hover)
+    frames = [dict(name=str(label), data=[dict(type="scatter3d", **xyz)], traces=[0])
+              for label, xyz in zip(labels, coordinates)]
+    return dict(data=[trace], layout=layout, frames=frames)
+
+
+## Save a figure dict as HTML, loading plotly.js from its CDN:
+def write_html(fig, filename):
+    html = pio.to_html(fig, validate=False, include_plotlyjs="cdn")
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(html.replace("\\u002f", "/"))  # "<" stays escaped, so no "</script>" can appear
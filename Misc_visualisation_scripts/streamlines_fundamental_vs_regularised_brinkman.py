@@ -1,6 +1,10 @@
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import cm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Simulation_scripts"))
+from brinkmanlet import brinkmanlet
 
 ## Define model parameters:
 alpha = 1.0
@@ -14,22 +18,6 @@ X, Y = np.meshgrid(x, y)
 r = np.sqrt(X**2 + Y**2)
 r[r == 0] = 1e-10 
 
-## Define fundamental functions:
-def H1_fundamental(r, alpha):
-    return (np.exp(-alpha * r) / (4 * np.pi * r)) * (1 + 1/(alpha*r) + 1/(alpha**2 * r**2)) - 1/(4 * np.pi * alpha**2 * r**3)
-
-def H2_fundamental(r, alpha):
-    return -np.exp(-alpha * r) / (4 * np.pi * r**3) * (1 + 3/(alpha*r) + 3/(alpha**2 * r**2)) + 3/(4 * np.pi * alpha**2 * r**5)
-
-## Define regularised functions:
-def H1_regularised(r, alpha, delta):
-    R_blob = np.sqrt(r**2 + delta**2)
-    return (np.exp(-alpha * R_blob) / (4 * np.pi * R_blob)) * (1 + 1/(alpha*R_blob) + 1/(alpha**2 * R_blob**2)) - 1/(4 * np.pi * alpha**2 * R_blob**3) + delta**2 * H2_regularised(r, alpha, delta)
-
-def H2_regularised(r, alpha, delta):
-    R_blob = np.sqrt(r**2 + delta**2)
-    return -np.exp(-alpha * R_blob) / (4 * np.pi * R_blob**3) * (1 + 3/(alpha*R_blob) + 3/(alpha**2 * R_blob**2)) + 3/(4 * np.pi * alpha**2 * R_blob**5)
-
 ## Calculate values for the velocity field:
 r_hat_x = X / r
 r_hat_y = Y / r
@@ -42,12 +30,10 @@ def velocity_field(H1, H2):
     return u_x, u_y
 
 ## Calculate solutions:
-H1_f = H1_fundamental(r, alpha)
-H2_f = H2_fundamental(r, alpha)
+H1_f, H2_f = brinkmanlet(r, alpha, cutoff=0)  # Fundamental and regularised kernels (see brinkmanlet.py)
 u_fx, u_fy = velocity_field(H1_f, H2_f)
 
-H1_r = H1_regularised(r, alpha, delta)
-H2_r = H2_regularised(r, alpha, delta)
+H1_r, H2_r = brinkmanlet(r, alpha, delta, cutoff=0)
 u_rx, u_ry = velocity_field(H1_r, H2_r)
 
 ## Plot using Brinkman colour scheme: 
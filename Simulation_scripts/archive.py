@@ -0,0 +1,151 @@
+"""
+Self-describing trajectory archives, and a reader for both archives and the older bare outputs.
+
+An archive is a directory {stem}_archive/ (or {stem}_seed{s}_archive/ for ensemble
+members) holding
+
+- positions.npy: frame-major positions, shape (T, N, 3), so frame k is one contiguous
+  N x 3 block and np.load(..., mmap_mode="r")[k] reads only that frame from disk,
+- times.npy: the simulated time of each frame, shape (T,) (the solver's step times, or
+  the output times of a streamed run),
+- metadata.json: the model, its parameters, the member's seed and the stored dtype.
+
+Older outputs are bare (N, 3, T) {stem}_output.npy arrays, with the parameters only in
+the file name and no times. load_trajectory() reads either kind into a Trajectory,
+which has the same attributes for both; for an older output the parameters come from
+the file name and the times are the frame indices (with times_known = False).
+"""
+
+import json
+import os
+import re
+import numpy as np
+
+ARCHIVE_FORMAT = "HW-ProjectIV trajectory archive"
+ARCHIVE_VERSION = 1
+
+# Model, parameter names and file pattern of each kind of older (N, 3, T) output:
+PATTERNS = [
+    ("Magnetic", ("beta", "alpha", "N0", "T"), re.compile(r"Magnetic_([^_]+)_([^_]+)_(\d+)_([^_]+)_output\.npy$")),
+    ("Brinkman", ("alpha", "N0", "T"), re.compile(r"BM_([^_]+)_(\d+)_([^_]+)_output\.npy$")),
+    ("Stickman", ("alpha", "delta", "K", "L", "T"), re.compile(r"Stickman_([^_]+)_([^_]+)_([^_]+)_([^_]+)_([^_]+)_output\.npy$")),
+    ("Stokes", ("N0", "T"), re.compile(r"(\d+)_([^_]+)_output\.npy$")),
+]
+
+# Ensemble member suffix, e.g. BM_5_500_500_seed3_output.npy:
+SEED_SUFFIX = re.compile(r"_seed(\d+)(?=_output\.npy$)")
+
+
+## Identify the model and parameters of an older output file from its name (ignoring any seed suffix):
+def parse_output_name(filename):
+    name = SEED_SUFFIX.sub("", os.path.basename(filename))
+    for model, keys, pattern in PATTERNS:
+        match = pattern.match(name)
+        if match:
+            return model, {k: float(v) for k, v in zip(keys, match.groups())}
+    return None, None
+
+
+## Seed of an older ensemble member output file (None if the name has no seed suffix):
+def parse_output_seed(filename):
+    match = SEED_SUFFIX.search(os.path.basename(filename))
+    return int(match.group(1)) if match else None
+
+
+## Convert NumPy scalars and arrays (and tuples) in parameters to plain JSON values:
+def _json_value(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot store {type(value).__name__} in archive metadata")
+
+
+## Metadata of one ensemble member, from a script's parameter dict (model, parameters and seeds):
+def archive_metadata(parameters, seed, dtype=np.float64):
+    model_parameters = {k: v for k, v in parameters.items() if k not in ("model", "seeds")}
+    return dict(format=ARCHIVE_FORMAT, version=ARCHIVE_VERSION, layout="(T, N, 3)", model=parameters["model"],
+                parameters=model_parameters, seed=seed, dtype=np.dtype(dtype).name)
+
+
+def write_metadata(path, metadata):
+    with open(os.path.join(path, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2, default=_json_value)
+
+
+## Create an archive with NaN positions (frames not yet written) and return its memory-mapped positions:
+def create_archive(path, N, times, metadata, dtype=np.float64):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "times.npy"), np.asarray(times, dtype=float))
+    write_metadata(path, metadata)
+    positions = np.lib.format.open_memmap(os.path.join(path, "positions.npy"), mode="w+", dtype=dtype,
+                                          shape=(len(times), N, 3))
+    positions[:] = np.nan
+    return positions
+
+
+## Save a complete (T, N, 3) trajectory as an archive:
+def save_archive(path, frames, times, metadata, dtype=np.float64):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "positions.npy"), np.ascontiguousarray(frames, dtype=dtype))
+    np.save(os.path.join(path, "times.npy"), np.asarray(times, dtype=float))
+    write_metadata(path, metadata)
+
+
+## Define trajectory read from an archive or an older output:
+class Trajectory:
+
+    def __init__(self, path, frames, times, model, parameters, seed=None, times_known=True, metadata=None):
+        self.path = path
+        self.frames = frames  # (T, N, 3), memory-mapped
+        self.times = times
+        self.model, self.parameters, self.seed = model, parameters, seed
+        self.times_known = times_known
+        self.metadata = metadata if metadata is not None else {}
+
+    ## Positions in the older (N, 3, T) layout (a view, nothing is read until indexed):
+    @property
+    def positions(self):
+        return self.frames.transpose(1, 2, 0)
+
+    @property
+    def shape(self):
+        return self.frames.shape
+
+    ## Index of the frame nearest to simulated time t:
+    def frame_index(self, t):
+        return int(np.abs(self.times - t).argmin())
+
+    ## Positions (N, 3) of the frame nearest to simulated time t:
+    def frame_at(self, t):
+        return self.frames[self.frame_index(t)]
+
+
+## Resolve a path or stem to an archive directory or older output file (archives first):
+def resolve_trajectory(path):
+    for candidate in (path, f"{path}_archive", f"{path}_output.npy"):
+        if os.path.isdir(candidate) and os.path.exists(os.path.join(candidate, "positions.npy")):
+            return candidate
+        if os.path.isfile(candidate) and candidate.endswith(".npy"):
+            return candidate
+    raise FileNotFoundError(f"No archive or output file for {path}")
+
+
+## Load a trajectory (memory-mapped) from an archive, an older output, or a stem such as
+## "npy_output_files/BM_5_500_500":
+def load_trajectory(path, mmap_mode="r"):
+    path = resolve_trajectory(path)
+    if os.path.isdir(path):
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        frames = np.load(os.path.join(path, "positions.npy"), mmap_mode=mmap_mode)
+        times = np.load(os.path.join(path, "times.npy"))
+        return Trajectory(path, frames, times, metadata["model"], metadata["parameters"], metadata["seed"],
+                          metadata=metadata)
+
+    array = np.load(path, mmap_mode=mmap_mode)
+    if array.ndim != 3 or array.shape[1] != 3:
+        raise ValueError(f"{path} is not an (N, 3, T) trajectory")
+    model, parameters = parse_output_name(path)
+    return Trajectory(path, array.transpose(2, 0, 1), np.arange(array.shape[-1], dtype=float), model,
+                      parameters or {}, parse_output_seed(path), times_known=False)
@@ -1,13 +1,48 @@
 import numpy as np
+import sys
 import time
-from scipy.integrate import solve_ivp
+from integrators import solve
+from pairwise_engine import PairwiseEngine
+from brinkmanlet import regularised_brinkman_kernel, brinkmanlet
+from split_kernel import SplitBrinkmanEvaluator
+from treecode import error_report
+from telemetry import Telemetry
+from overrides import apply_overrides
+from ensemble import member_seeds, initial_members, state_shape, save_members, member_filenames, seeded_stem
+from trajectory_writer import TrajectoryWriter, integrate_to_writer
+from archive import archive_metadata
+from checkpoint import Checkpointer
+from spring_network import SpringNetwork, load_body, stickman_connections, body_labels
 
 ## Assign parameters:
 alpha = 1  # Permeability parameter
 delta = 0.1 # Regularisation parameter
-K = 1  # Spring constant
-L = 1  # Rest length of springs
+K = 1  # Spring constant (ignored if the edge file gives per-spring values)
+L = 1  # Rest length of springs (ignored if the edge file gives per-spring values)
+body_name = None  # Prefix of the output file (None: "Stickman", or the node file's name for a loaded body)
+body_positions_file = None  # Optional "x y z" node file for a body other than the stickman
+body_edges_file = None  # Optional "i j" (or "i j K L", per-spring) edge file for that body
+body_perturbation = 0.0  # Amplitude of uniform random perturbations of a loaded body's nodes (must be > 0 for ensembles)
 t_span = (0, 500)  # Time span for simulation
+method = "RK45"  # ODE solver: scipy's "RK45" or "DOP853", or built-in "native_RK45" or "native_DOP853" (integrators.py)
+matrix_free = True  # Set False to use the reference (3,3,N,N) mobility tensor
+tile_size = 256  # Row-block size for the matrix-free mobility operator
+workers = 1  # Threads evaluating pairwise row blocks in parallel (results are bit-for-bit identical for any value)
+single_precision = False  # Set True for float32 pairwise kernels and float32 output files (integration stays float64)
+use_split_kernel = False  # Set True for cell-list near field + tree-code far field (approximate)
+split_tol = 1e-6  # Tolerance on the screened part, sets the near-field cutoff
+theta = 0.3  # Opening angle for the far-field tree code
+telemetry_enabled = False  # Set True to save run statistics to a _telemetry.jsonl sidecar
+ensemble_size = 1  # Number of independent realisations integrated together (each saved to its own file)
+seed = None  # Random seed for the stickman (or loaded body) perturbations (ensemble member b uses seed + b)
+archive_output = False  # Set True to save a self-describing {stem}_archive/ (frame-major positions, times, parameters and seed)
+output_frames = None  # Number of equally spaced frames streamed to disk during the run (None: every solver step, saved at the end)
+checkpoint_every_t = None  # Save a checkpoint every this much simulated time (requires output_frames)
+checkpoint_every_wall = None  # Save a checkpoint every this many seconds of wall time (requires output_frames)
+resume = False  # Set True to continue an interrupted run from its _checkpoint.npz (same parameters)
+
+## Apply parameter overrides from the command line, e.g. "t_span=(0,100) seed=1" (used by sweep.py):
+apply_overrides(globals(), sys.argv[1:])
 progress_intervals = np.linspace(t_span[0], t_span[1], 101)[1:] # Intervals for progress printing
 
 ## Establish initial stickman position:
@@ -38,68 +73,35 @@ stickman_positions = np.zeros((32,3))
 stickman_positions[:,0] = np.concatenate([head_x, body_x, arms_x, legs_x])
 stickman_positions[:,2] = np.concatenate([head_y, body_y, arms_y, legs_y])
 
-# Add small random pertubations to y-coordinates:
-stickman_positions[:,1] = np.random.uniform(-0.1, 0.1, 32)
-
-## Define spring connections between stickman points:
-connections = [(i, i+1) for i in range(31)]
-
-connections.remove((13, 14))
-connections.remove((17, 18))
-connections.remove((21, 22))
-connections.remove((26, 27))
-
-connections.append((0,7))
-connections.append((9,17))
-connections.append((9,18))
-connections.append((13,22))
-connections.append((13,27))
-
-## Define regularised Brinkmanlet interaction terms:
-def H2(r):
-    mask = r > 1e-6 # Avoid r -> infinity error
-    R = np.sqrt(r[mask]**2 + delta**2)
-    result = np.zeros_like(r)
-    exp_term = np.exp(-alpha * R)
-    result[mask] = (-exp_term / (4 * np.pi * R**3)) * (1 + 3/(alpha*R) + 3/((alpha**2) * (R**2))) + 3 / (4 * np.pi * (alpha**2)) * (R**-5)
-    return result
-
-def H1(r):
-    mask = r > 1e-6  # Avoid r -> infinity error
-    R = np.sqrt(r[mask]**2 + delta**2)
-    result = np.zeros_like(r)
-    exp_term = np.exp(-alpha * R)
-    H2_term = H2(r[mask])
-    result[mask] = (exp_term / (4 * np.pi * R)) * (1 + 1/(alpha*R) + 1/((alpha**2) * (R**2))) - 1/(4 * np.pi * (alpha**2) * (R**3)) + (delta**2 * H2_term)
-    return result
-
-
-## Define function to compute resultant spring force:
-def resultant_force(positions, connections, L, K):
-    
-    F_total = np.zeros_like(positions)
+# Add small random pertubations to y-coordinates (redrawn for each ensemble member):
+def perturbed_stickman():
+    positions = stickman_positions.copy()
+    positions[:,1] = np.random.uniform(-0.1, 0.1, 32)
+    return positions
+
+# Add uniform random perturbations to every coordinate of a loaded body (redrawn for each ensemble member):
+def perturbed_body(positions):
+    return positions + np.random.uniform(-body_perturbation, body_perturbation, positions.shape)
+
+## Define spring connections between stickman points (head loop, body, arms and legs; see spring_network.py):
+connections = stickman_connections()
 
-    for i, j in connections:
-        r_ij = positions[i] - positions[j]
-        r_abs = np.linalg.norm(r_ij)
-        if r_abs > 1e-6: 
-            r_hat = r_ij / r_abs
-            F_ij = -K * (r_abs - L) * r_hat  
-            F_total[i] += F_ij
-            F_total[j] -= F_ij
+## Define function to compute resultant spring force (all springs in one vectorised pass):
+def resultant_force(positions, network):
+    
+    F_total = network.forces(positions)
 
-    F_total[:, 2] += -1 # add gravity
+    F_total[..., 2] += -1 # add gravity
 
     return F_total
 
-## Define function to compute mobility matrix:
+## Define function to compute mobility matrix (reference path, used when matrix_free = False):
 def create_mobility_matrix(positions):
 
     r_ij = positions[:, None, :] - positions[None, :, :]
     r_abs = np.linalg.norm(r_ij, axis=2)
 
-    H1_vals = H1(r_abs)
-    H2_vals = H2(r_abs)
+    H1_vals, H2_vals = brinkmanlet(r_abs, alpha, delta)  # Shared kernels (see brinkmanlet.py)
 
     r_x, r_y, r_z = r_ij[..., 0], r_ij[..., 1], r_ij[..., 2]
 
@@ -122,33 +124,92 @@ def deriv_func(t, r):
     
     global progress_index, start_time
 
+    telemetry.rhs_call(t)
+
     if progress_index < len(progress_intervals) and t >= progress_intervals[progress_index]:
         elapsed_time = time.time() - start_time
         print(f"Progress: {int((t/t_span[1]) * 100)}% complete. Time elapsed: {elapsed_time:.2f} seconds")
         progress_index += 1
+        telemetry.checkpoint(t)
 
-    positions = r.reshape(N0, 3)  
-
-    F_all = resultant_force(positions, connections, L, K)
+    positions = r.reshape(state_shape(ensemble_size, N0))
 
-    mobility_matrix = create_mobility_matrix(positions)
+    with telemetry.phase("force"):
+        F_all = resultant_force(positions, network)
 
-    velocities = np.einsum('uhij,ih->iu', mobility_matrix, F_all) 
+    if use_split_kernel:
+        with telemetry.phase("split_kernel"):
+            velocities = split_evaluator.apply_mobility(positions, F_all)
+    elif matrix_free:
+        velocities = engine.apply_mobility(positions, F_all, kernel)
+    else:
+        with telemetry.phase("kernels"):
+            mobility_matrix = create_mobility_matrix(positions)
+        with telemetry.phase("contraction"):
+            velocities = np.einsum('uhij,ih->iu', mobility_matrix, F_all) 
 
     return velocities.flatten()
 
-## Initialise global variables:
-progress_index = 0
-start_time = time.time()
-N0 = stickman_positions.shape[0]
-init_pos_flat = stickman_positions.flatten()
+if ensemble_size > 1 and (use_split_kernel or not matrix_free):
+    raise ValueError("Ensemble mode requires the matrix-free pairwise engine (matrix_free = True, use_split_kernel = False)")
 
-## Solve ODE:
-solution = solve_ivp(deriv_func, t_span, init_pos_flat, method="RK45")
+## Load a body from file, if given, otherwise use the (randomly perturbed) stickman:
+seeds = member_seeds(seed, ensemble_size)
+if body_positions_file is not None:
+    body_positions, network = load_body(body_positions_file, body_edges_file, K, L)
+    if ensemble_size > 1 and body_perturbation <= 0:
+        raise ValueError("Ensemble members of a loaded body would all be identical: set body_perturbation > 0")
+    init_positions = initial_members(lambda: perturbed_body(body_positions), seeds)
+else:
+    network = SpringNetwork(connections, K, L, N=stickman_positions.shape[0])
+    init_positions = initial_members(perturbed_stickman, seeds)
 
-## Reshape output for saving:
-new_positions = solution.y.reshape(N0, 3, len(solution.t))
+## Name the body, and mark K and L as per-spring if the edge file sets them (used in the stem and metadata):
+body_name, K_label, L_label = body_labels(body_name, body_positions_file, body_edges_file, K, L)
 
-## Save to file:
-np.save(f"Stickman_{alpha}_{delta}_{K}_{L}_{t_span[1]}_output.npy", new_positions)
-print(f"Stickman_{alpha}_{delta}_{K}_{L}_{t_span[1]}_output.npy saved" )
+## Initialise global variables:
+progress_index = 0
+start_time = time.time()
+N0 = network.N
+init_pos_flat = init_positions.flatten()
+parameters = dict(model=body_name, N0=N0, alpha=alpha, delta=delta, K=K_label, L=L_label, t_span=t_span, method=method,
+                  body_positions_file=body_positions_file, body_edges_file=body_edges_file, body_perturbation=body_perturbation,
+                  matrix_free=matrix_free,
+                  use_split_kernel=use_split_kernel, split_tol=split_tol, theta=theta,
+                  single_precision=single_precision, seeds=seeds)  # Recorded in the telemetry and archive metadata
+telemetry = Telemetry(telemetry_enabled, parameters=parameters)
+precision = np.float32 if single_precision else np.float64  # Pair kernels and stored trajectories
+engine = PairwiseEngine(N0, tile_size, telemetry=telemetry, batch=ensemble_size if ensemble_size > 1 else None,
+                        workers=workers, dtype=precision)
+split_evaluator = SplitBrinkmanEvaluator(alpha, delta, tol=split_tol, theta=theta, engine=engine)
+kernel = regularised_brinkman_kernel(alpha, delta)
+
+## Report split-kernel accuracy against the direct sum on the initial positions (mobility applied to unit gravity):
+if use_split_kernel:
+    unit_gravity = np.zeros_like(init_positions)
+    unit_gravity[..., 2] = -1
+    report = error_report(split_evaluator.apply_mobility(init_positions, unit_gravity),
+                          engine.apply_mobility(init_positions, unit_gravity, kernel))
+    print(f"Split kernel (cutoff={split_evaluator.r_c:.3f}, theta={theta}) vs direct sum: "
+          f"max error / max velocity {report['max_error_rel_to_max_velocity']:.2e}, RMS relative error {report['rms_rel_error']:.2e}")
+
+if output_frames is None and (checkpoint_every_t is not None or checkpoint_every_wall is not None or resume):
+    raise ValueError("Checkpoint and resume require streamed output (set output_frames)")
+
+## Solve ODE system, streaming frames to disk (with optional checkpoints) if output_frames is set:
+stem = seeded_stem(f"{body_name}_{alpha}_{delta}_{K_label}_{L_label}_{t_span[1]}", seed, ensemble_size)
+metadata = [archive_metadata(parameters, s, precision) for s in seeds] if archive_output else None
+if output_frames is None:
+    solution = solve(deriv_func, t_span, init_pos_flat, method=method)
+    save_members(solution.y, N0, stem, seeds, precision, solution.t, metadata)
+else:
+    checkpointer = Checkpointer(f"{stem}_checkpoint.npz", checkpoint_every_t, checkpoint_every_wall, globals(), ("progress_index",))
+    restart = checkpointer.load() if resume else None
+    writer = TrajectoryWriter(member_filenames(stem, seeds, archive_output), N0,
+                              np.linspace(t_span[0], t_span[1], output_frames), restart, precision, metadata)
+    solution = integrate_to_writer(deriv_func, t_span, init_pos_flat, writer, method=method,
+                                   checkpointer=checkpointer, restart=restart)
+    writer.close()
+engine.close()  # Shut down the pairwise worker threads
+telemetry.finish(solution, method)
+telemetry.write(f"{stem}_telemetry.jsonl")
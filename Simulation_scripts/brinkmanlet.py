@@ -0,0 +1,168 @@
+"""
+Brinkmanlet kernels H1 and H2, shared by the simulation, analysis and plotting scripts.
+
+With x = alpha * R (R = r for the singular Brinkmanlet, R = sqrt(r^2 + delta^2) for a
+regularised one),
+
+    H1 = [exp(-x) (1 + 1/x + 1/x^2) - 1/x^2] / (4 pi R)   (+ delta^2 H2 if regularised)
+    H2 = [3/x^2 - exp(-x) (1 + 3/x + 3/x^2)] / (4 pi R^3)
+
+Both are evaluated together, in place, from one exp(-x) and shared powers of 1/R.
+
+For small x the screened and algebraic parts nearly cancel. Written directly, both
+terms are ~1/x^2 while their difference tends to 1/2, so about -log10(x^2) digits are
+lost (errors of 1e-9 at alpha * R = 1e-3 and 1e-5 at 1e-5, as for close pairs in the
+alpha = 0.01 and 0.1 runs). Below SERIES_X, H1 and H2 are instead summed from their
+Taylor series in x,
+
+    H1 = sum_k (-1)^k (k+1)^2 / (k+2)! x^k / (4 pi R),
+    H2 = sum_k (-1)^(k+1) (k+1)(k-1) / (k+2)! x^k / (4 pi R^3),
+
+whose truncation error with SERIES_TERMS terms is ~1e-16 at SERIES_X. Measured against
+50-digit arithmetic, the error is then below 4e-13 of the Stokeslet scale (1 / (8 pi R)
+for H1, 1 / (8 pi R^3) for H2) at every separation, the largest being that of the direct
+formula just above SERIES_X.
+
+In single precision, pairs with x below SINGLE_PRECISION_NEAR_X are re-evaluated in
+float64, where the direct formula's relative rounding error of about eps / x^2 would
+otherwise be large.
+
+brinkman_kernel and regularised_brinkman_kernel return in-place kernels, as used by the
+PairwiseEngine and FieldEvaluator; brinkmanlet(r, alpha, delta) returns new H1 and H2
+arrays for any array of separations, as used by the reference (3, 3, N, N) mobility
+matrices and the plotting scripts.
+"""
+
+import math
+import numpy as np
+
+# In single precision, pairs with alpha * r below this are re-evaluated in double precision: there the screened
+# and algebraic parts of H1 and H2 cancel, leaving a relative rounding error of about eps / (alpha * r)^2
+SINGLE_PRECISION_NEAR_X = 1.0
+SERIES_X = 0.1  # Below this alpha * R, H1 and H2 are summed from their Taylor series
+SERIES_TERMS = 10  # Terms of the series (truncation error ~1e-16 at SERIES_X)
+
+# Series coefficients of 4 pi R H1 and 4 pi R^3 H2 in x (both tend to 1/2 as x -> 0)
+H1_SERIES = [(-1)**k * (k + 1)**2 / math.factorial(k + 2) for k in range(SERIES_TERMS)]
+H2_SERIES = [(-1)**(k + 1) * (k + 1) * (k - 1) / math.factorial(k + 2) for k in range(SERIES_TERMS)]
+
+
+## Sum a series in x (coefficients lowest order first) into out, by Horner's rule:
+def horner(coefficients, x, out):
+    np.multiply(x, coefficients[-1], out=out)
+    for a in coefficients[-2:0:-1]:
+        out += a
+        out *= x
+    out += coefficients[0]
+    return out
+
+
+## Define in-place Brinkmanlet kernel (fills H1 and H2 for safe r, where inv_r = 1/r):
+def brinkman_kernel(alpha):
+    c = 1 / (4 * np.pi)
+    c_alg = c / (alpha**2)
+    series_r = SERIES_X / alpha
+    series_H1, series_H2 = [a * c for a in H1_SERIES], [a * c for a in H2_SERIES]
+
+    def kernel(r, inv_r, H1_out, H2_out, work):
+        if r.dtype == np.float64:
+            evaluate(r, inv_r, H1_out, H2_out, work)
+            return
+        direct(r, inv_r, H1_out, H2_out, work)
+        near = np.flatnonzero(r.reshape(-1) < SINGLE_PRECISION_NEAR_X / alpha)
+        if near.size:
+            r_near = r.reshape(-1)[near].astype(np.float64)
+            H1_near, H2_near = np.empty_like(r_near), np.empty_like(r_near)
+            evaluate(r_near, 1 / r_near, H1_near, H2_near, tuple(np.empty_like(r_near) for _ in range(3)))
+            H1_out.reshape(-1)[near] = H1_near
+            H2_out.reshape(-1)[near] = H2_near
+
+    # Direct formula where alpha * r >= SERIES_X and series below: whichever covers most pairs is evaluated
+    # over the whole array, and the other only over the remaining pairs
+    def evaluate(r, inv_r, H1_out, H2_out, work):
+        if r.size == 0:
+            return
+        near = r.reshape(-1) < series_r
+        count = np.count_nonzero(near)
+        main, other = (series, direct) if 2 * count > r.size else (direct, series)
+        main(r, inv_r, H1_out, H2_out, work)
+        if 0 < count < r.size:
+            rest = np.flatnonzero(near if main is direct else ~near)
+            r_rest, inv_r_rest = r.reshape(-1)[rest], inv_r.reshape(-1)[rest]
+            H1_rest, H2_rest = np.empty_like(r_rest), np.empty_like(r_rest)
+            other(r_rest, inv_r_rest, H1_rest, H2_rest, tuple(np.empty_like(r_rest) for _ in range(3)))
+            H1_out.reshape(-1)[rest] = H1_rest
+            H2_out.reshape(-1)[rest] = H2_rest
+
+    def series(r, inv_r, H1_out, H2_out, work):
+        x = work[0]
+        np.multiply(r, alpha, out=x)
+        horner(series_H1, x, H1_out)
+        H1_out *= inv_r
+        horner(series_H2, x, H2_out)
+        np.multiply(inv_r, inv_r, out=x)
+        x *= inv_r
+        H2_out *= x
+
+    def direct(r, inv_r, H1_out, H2_out, work):
+        e, s1, s2 = work
+        np.multiply(r, -alpha, out=e)
+        np.exp(e, out=e)
+        e *= c  # exp(-alpha*r) / (4*pi)
+
+        np.multiply(inv_r, 1 / alpha, out=s1)  # 1/(alpha*r)
+        np.multiply(s1, s1, out=H1_out)
+        np.multiply(H1_out, 3, out=H2_out)
+        H1_out += s1
+        H1_out += 1  # 1 + 1/(alpha*r) + 1/(alpha*r)^2
+        np.multiply(s1, 3, out=s2)
+        H2_out += s2
+        H2_out += 1  # 1 + 3/(alpha*r) + 3/(alpha*r)^2
+
+        np.multiply(inv_r, inv_r, out=s1)
+        s1 *= inv_r  # 1/r^3
+
+        H1_out *= e
+        H1_out *= inv_r
+        np.multiply(s1, c_alg, out=s2)
+        H1_out -= s2
+
+        H2_out *= e
+        H2_out *= s1
+        np.negative(H2_out, out=H2_out)
+        s2 *= 3
+        s2 *= inv_r
+        s2 *= inv_r
+        H2_out += s2
+
+    return kernel
+
+
+## Define in-place regularised Brinkmanlet kernel (blob width delta):
+def regularised_brinkman_kernel(alpha, delta):
+    base = brinkman_kernel(alpha)
+
+    def kernel(r, inv_r, H1_out, H2_out, work):
+        # r and inv_r are overwritten with R = sqrt(r^2 + delta^2) and 1/R
+        r *= r
+        r += delta**2
+        np.sqrt(r, out=r)
+        np.divide(1.0, r, out=inv_r)
+        base(r, inv_r, H1_out, H2_out, work)
+        np.multiply(H2_out, delta**2, out=work[0])
+        H1_out += work[0]
+
+    return kernel
+
+
+## H1 and H2 (new arrays) at separations r, regularised if delta > 0, and zero where r <= cutoff:
+def brinkmanlet(r, alpha, delta=0.0, cutoff=1e-6):
+    r = np.array(r, dtype=np.float64)
+    mask = r > cutoff
+    r[~mask] = 1.0  # Safe value for excluded pairs
+    H1, H2 = np.empty_like(r), np.empty_like(r)
+    kernel = regularised_brinkman_kernel(alpha, delta) if delta > 0 else brinkman_kernel(alpha)
+    kernel(r, 1 / r, H1, H2, tuple(np.empty_like(r) for _ in range(3)))
+    H1 *= mask
+    H2 *= mask
+    return H1, H2
@@ -0,0 +1,217 @@
+"""
+Catalogue of simulation outputs, with lazily opened trajectories and cached derived statistics.
+
+Catalogue(directory) indexes the runs in a directory (archives and older _output.npy
+files) by model, parameters and seed, using only the file names and archive metadata.
+A run's trajectory is opened, memory-mapped, the first time it is used.
+
+Derived per-run quantities (outlier masks for given percentiles, centre-of-mass tracks
+and per-frame bounding boxes) are computed once and saved in {directory}/.catalogue_cache/,
+keyed by a SHA-1 digest of the positions file's content, so they are shared by every
+analysis script and are recomputed whenever the file changes. Digests are remembered by
+(path, size, modification time), so a file is only read again for hashing after it changes.
+
+List the runs in a directory (from the repository root):
+
+    python Simulation_scripts/catalogue.py --directory npy_output_files
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+from archive import load_trajectory, parse_output_name, parse_output_seed
+
+HASH_CHUNK = 2**24  # Bytes read at a time when hashing
+STATISTICS_CHUNK = 2**23  # Floats per block of frames when computing per-frame statistics
+
+
+## Define catalogued run (a single trajectory, opened on first use):
+class Run:
+
+    def __init__(self, catalogue, path, model, parameters, seed, archive):
+        self.catalogue, self.path = catalogue, path
+        self.model, self.parameters, self.seed = model, parameters, seed
+        self.archive = archive
+        self._trajectory = None
+
+    ## Output stem, shared by an archive and an older output of the same run:
+    @property
+    def stem(self):
+        name = os.path.basename(self.path)
+        return name[:-len("_archive")] if self.archive else name[:-len("_output.npy")]
+
+    def __repr__(self):
+        seed = "" if self.seed is None else f", seed={self.seed}"
+        return f"Run({self.model}, {self.parameters}{seed}, {os.path.basename(self.path)})"
+
+    @property
+    def trajectory(self):
+        if self._trajectory is None:
+            self._trajectory = load_trajectory(self.path)
+        return self._trajectory
+
+    ## File holding the positions (hashed for the cache key):
+    @property
+    def positions_file(self):
+        return os.path.join(self.path, "positions.npy") if self.archive else self.path
+
+    ## Boolean mask of particles below the given percentiles of displacement (first to last frame)
+    ## and of distance from the final centre of mass, as used to filter outliers before plotting:
+    def outlier_mask(self, velocity_percentile=95, distance_percentile=95):
+        def compute():
+            reshaped = self.trajectory.positions
+            velocities = np.linalg.norm(reshaped[:, :, -1] - reshaped[:, :, 0], axis=1)
+            final_positions = reshaped[:, :, -1]
+            center_of_mass = np.mean(final_positions, axis=0)
+            distances = np.linalg.norm(final_positions - center_of_mass, axis=1)
+            velocity_threshold = np.percentile(velocities, velocity_percentile)
+            distance_threshold = np.percentile(distances, distance_percentile)
+            return (velocities < velocity_threshold) & (distances < distance_threshold)
+        return self.catalogue.cached(self, f"mask_{velocity_percentile:g}_{distance_percentile:g}", compute)
+
+    ## Centre of mass of every frame, shape (T, 3):
+    def centre_of_mass(self):
+        return self.catalogue.cached(self, "centre_of_mass", lambda: self.frame_statistics()[0])
+
+    ## Bounding box (minimum and maximum corner) of every frame, shape (T, 2, 3):
+    def bounding_box(self):
+        return self.catalogue.cached(self, "bounding_box", lambda: self.frame_statistics()[1])
+
+    ## Per-frame centre of mass and bounding box, computed over blocks of frames:
+    def frame_statistics(self):
+        frames = self.trajectory.frames
+        T, N, _ = frames.shape
+        chunk = max(1, STATISTICS_CHUNK // (3 * N))
+        centre, box = np.empty((T, 3)), np.empty((T, 2, 3))
+        for k in range(0, T, chunk):
+            block = np.asarray(frames[k:k + chunk], dtype=np.float64)
+            centre[k:k + chunk] = block.mean(axis=1)
+            box[k:k + chunk, 0], box[k:k + chunk, 1] = block.min(axis=1), block.max(axis=1)
+        return centre, box
+
+
+## Define catalogue of the runs in a directory:
+class Catalogue:
+
+    def __init__(self, directory="npy_output_files", cache_dir=None):
+        self.directory = directory
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(directory, ".catalogue_cache")
+        self.runs = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith("_archive") and os.path.exists(os.path.join(path, "metadata.json")):
+                with open(os.path.join(path, "metadata.json")) as f:
+                    metadata = json.load(f)
+                parameters = {k: tuple(v) if isinstance(v, list) else v for k, v in metadata["parameters"].items()}
+                if "t_span" in parameters:
+                    parameters.setdefault("T", parameters["t_span"][1])  # Duration, as in the older file names
+                self.runs.append(Run(self, path, metadata["model"], parameters, metadata["seed"], True))
+            elif name.endswith("_output.npy"):
+                model, parameters = parse_output_name(name)
+                if model is not None:
+                    self.runs.append(Run(self, path, model, parameters, parse_output_seed(name), False))
+        self._digests = None
+
+    def __iter__(self):
+        return iter(self.runs)
+
+    def __len__(self):
+        return len(self.runs)
+
+    ## Runs matching a model and parameter values (and seed, if given), archives first:
+    def find(self, model=None, seed=None, **parameters):
+        matches = [run for run in self.runs
+                   if (model is None or run.model == model) and (seed is None or run.seed == seed)
+                   and all(k in run.parameters and run.parameters[k] == v for k, v in parameters.items())]
+        return sorted(matches, key=lambda run: not run.archive)
+
+    ## The single run matching a query (an archive is preferred to an older output of the same run):
+    def get(self, model=None, seed=None, **parameters):
+        matches = self.find(model, seed, **parameters)
+        if not matches:
+            raise FileNotFoundError(f"No {model or ''} run in {self.directory} with {parameters}"
+                                    + ("" if seed is None else f", seed {seed}"))
+        stems = sorted({run.stem for run in matches})
+        if len(stems) > 1:
+            raise ValueError(f"Several runs match {parameters} ({', '.join(stems)}); give seed=... or more parameters")
+        return matches[0]
+
+    ## One run per output stem (archives preferred), sorted, matching filters {name: allowed values}
+    ## where name is "model", "seed" or a parameter (e.g. from sweep.parse_grid):
+    def select(self, filters):
+        runs, stems = [], set()
+        for run in self.find():
+            values = {name: run.model if name == "model" else run.seed if name == "seed" else run.parameters.get(name)
+                      for name in filters}
+            if run.stem not in stems and all(values[name] in allowed for name, allowed in filters.items()):
+                runs.append(run)
+                stems.add(run.stem)
+        return sorted(runs, key=lambda run: (run.model, run.stem))
+
+    ## Content digest of a run's positions file (rehashed only if its size or modification time changed):
+    def digest(self, run):
+        index_file = os.path.join(self.cache_dir, "digests.json")
+        if self._digests is None:
+            self._digests = {}
+            if os.path.exists(index_file):
+                with open(index_file) as f:
+                    self._digests = json.load(f)
+        path = os.path.abspath(run.positions_file)
+        stat = os.stat(path)
+        entry = self._digests.get(path)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_CHUNK), b""):
+                sha.update(block)
+        self._digests[path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary = index_file + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._digests, f)
+        os.replace(temporary, index_file)
+        return sha.hexdigest()
+
+    ## Cache file of a derived quantity of a run:
+    def cache_file(self, run, name):
+        return os.path.join(self.cache_dir, f"{self.digest(run)}_{name}.npy")
+
+    ## Save a derived quantity of a run to the cache:
+    def store(self, run, name, value):
+        filename = self.cache_file(run, name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary = filename + ".tmp.npy"
+        np.save(temporary, value)
+        os.replace(temporary, filename)
+
+    ## Load a derived quantity of a run from the cache, computing and saving it if missing:
+    def cached(self, run, name, compute):
+        filename = self.cache_file(run, name)
+        if os.path.exists(filename):
+            return np.load(filename)
+        value = compute()
+        self.store(run, name, value)
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the simulation runs in a directory.")
+    parser.add_argument("--directory", default="npy_output_files")
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.directory)
+    print(f"{'model':<10} {'seed':>6} {'kind':<8} parameters")
+    for run in sorted(catalogue, key=lambda run: (run.model, run.path)):
+        kind = "archive" if run.archive else "npy"
+        seed = "" if run.seed is None else run.seed
+        parameters = ", ".join(f"{k}={v:g}" if isinstance(v, float) else f"{k}={v}" for k, v in run.parameters.items())
+        print(f"{run.model:<10} {seed:>6} {kind:<8} {parameters}")
+    print(f"\n{len(catalogue)} runs in {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Checkpoint and restart for streamed simulation runs.
+
+A checkpoint is one .npz file holding everything needed to continue a run:
+
+- the solver state after the last accepted step (t, y, the FSAL derivative f, the next
+  step size h_abs, the evaluation count, and the running step-size statistics kept for
+  telemetry),
+- model state held in script globals, e.g. the magnetised model's lagged `velocities`
+  and the progress counter,
+- NumPy's global RNG state,
+- the output progress (the output files and the number of frames written so far; the
+  frames themselves are already on disk in the memory-mapped outputs).
+
+Checkpoints are written every `every_t` units of simulated time and/or every `every_wall`
+seconds of wall time, atomically (written to a temporary file, then renamed), and
+deleted once the run finishes. A resumed run takes exactly the same steps as an
+uninterrupted one, so it reaches the same final result bit for bit.
+"""
+
+import os
+import time
+import numpy as np
+
+## Define checkpointer for a run whose model state lives in `namespace` (a script's globals()):
+class Checkpointer:
+
+    def __init__(self, filename, every_t=None, every_wall=None, namespace=None, names=()):
+        self.filename = filename
+        self.every_t, self.every_wall = every_t, every_wall
+        self.namespace, self.names = namespace, tuple(names)
+        self.next_t, self.last_wall = None, time.time()
+
+    ## Start the checkpoint clocks at simulated time t:
+    def start(self, t):
+        self.next_t = None if self.every_t is None else t + self.every_t
+        self.last_wall = time.time()
+
+    ## Check whether a checkpoint is due after a step to time t:
+    def due(self, t):
+        if self.next_t is not None and t >= self.next_t:
+            return True
+        return self.every_wall is not None and time.time() - self.last_wall >= self.every_wall
+
+    ## Save the solver, model, RNG and output state:
+    def save(self, solver, writer, step_stats):
+        writer.flush()
+        _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        state = dict(t=solver.t, y=solver.y, f=solver.f, h_abs=solver.h_abs, nfev=solver.nfev,
+                     step_stats=step_stats.state(), filenames=np.array(writer.filenames),
+                     frames_written=writer.frames_written, rng_keys=keys, rng_pos=pos,
+                     rng_has_gauss=has_gauss, rng_cached_gaussian=cached_gaussian)
+        for name in self.names:
+            state["model_" + name] = np.asarray(self.namespace[name])
+
+        temporary = self.filename + ".tmp.npz"
+        np.savez(temporary, **state)
+        os.replace(temporary, self.filename)
+        self.last_wall = time.time()
+        while self.next_t is not None and self.next_t <= solver.t:
+            self.next_t += self.every_t
+        print(f"Checkpoint saved to {self.filename} at t = {solver.t:.4g}")
+
+    ## Load a checkpoint, if one exists (returns None otherwise):
+    def load(self):
+        if not os.path.exists(self.filename):
+            print(f"No checkpoint {self.filename} found, starting from t = 0")
+            return None
+        with np.load(self.filename) as data:
+            state = {key: data[key] for key in data.files}
+        state["filenames"] = [str(f) for f in state["filenames"]]
+        state["frames_written"] = int(state["frames_written"])
+        print(f"Resuming from {self.filename} at t = {float(state['t']):.4g}")
+        return state
+
+    ## Restore a checkpoint into a freshly created solver, the model globals and the RNG:
+    def restore(self, solver, state):
+        solver.t, solver.y, solver.f = float(state["t"]), state["y"].copy(), state["f"].copy()
+        solver.h_abs, solver.nfev = float(state["h_abs"]), int(state["nfev"])
+        for name in self.names:
+            value = state["model_" + name]
+            self.namespace[name] = value.item() if value.ndim == 0 else value.copy()
+        np.random.set_state(("MT19937", state["rng_keys"], int(state["rng_pos"]),
+                             int(state["rng_has_gauss"]), float(state["rng_cached_gaussian"])))
+
+    ## Remove the checkpoint once the run has finished:
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
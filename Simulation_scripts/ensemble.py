@@ -0,0 +1,63 @@
+"""
+Ensemble mode for the simulation scripts.
+
+B independent realisations (ensemble members) of the same model are stacked along a
+leading batch axis, state shape (B, N, 3), and integrated as one ODE system, so every
+RHS evaluation runs one set of (B, ...) array operations instead of B separate ones.
+Member b draws its initial condition after seeding NumPy's global generator with
+seed + b, and is saved to its own output file. The members share the solver's step
+sizes (and so output times), which are set by the most demanding member.
+With archive output each member gets its own archive, with its seed in the metadata.
+A single run with a given seed is named like an ensemble member ({stem}_seed{s}), so
+runs differing only in their seed do not overwrite each other.
+"""
+
+import numpy as np
+from archive import save_archive
+
+## Define seeds for the ensemble members (a random base seed is drawn if none is given):
+def member_seeds(seed, B):
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % (2**31 - B))
+    return [seed + b for b in range(B)]
+
+
+## Draw initial conditions, one per seed, stacked along a leading batch axis (dropped when B = 1):
+def initial_members(draw, seeds):
+    members = []
+    for s in seeds:
+        np.random.seed(s)
+        members.append(draw())
+    return np.stack(members) if len(seeds) > 1 else members[0]
+
+
+## Shape of the state seen by deriv_func:
+def state_shape(B, N):
+    return (B, N, 3) if B > 1 else (N, 3)
+
+
+## Stem of a run's outputs, checkpoint and telemetry (a single run's given seed is added to the script's stem):
+def seeded_stem(stem, seed, B):
+    return f"{stem}_seed{seed}" if seed is not None and B == 1 else stem
+
+
+## Output file (or archive directory, see archive.py) of each member:
+def member_filenames(stem, seeds, archive=False):
+    suffix = "archive" if archive else "output.npy"
+    if len(seeds) == 1:
+        return [f"{stem}_{suffix}"]
+    return [f"{stem}_seed{s}_{suffix}" for s in seeds]
+
+
+## Save each member's trajectory from a flat solver output of shape (B * N * 3, T), as an (N, 3, T)
+## .npy file, or as an archive with the solver's times if per-member metadata is given:
+def save_members(y, N, stem, seeds, dtype=np.float64, times=None, metadata=None):
+    trajectories = y.reshape(len(seeds), N, 3, y.shape[-1])
+    filenames = member_filenames(stem, seeds, metadata is not None)
+    for b, (filename, trajectory) in enumerate(zip(filenames, trajectories)):
+        if metadata is None:
+            np.save(filename, trajectory.astype(dtype, copy=False))
+        else:
+            save_archive(filename, trajectory.transpose(2, 0, 1), times, metadata[b], dtype)
+        print(f"3D array saved to {filename}")
+    return filenames
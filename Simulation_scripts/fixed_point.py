@@ -0,0 +1,66 @@
+"""
+Fixed-point iteration with Anderson acceleration, for x = G(x).
+
+Used by the magnetised script's implicit velocity mode, where the velocities solve
+v = M(x) . F(x, v): the Lorentz force depends on the velocities it produces. Plain
+iteration, x_{k+1} = G(x_k), converges linearly when G is a contraction. Anderson
+acceleration (Walker and Ni, SIAM J. Numer. Anal. 49, 2011) instead takes the
+combination of the last `depth` + 1 values of G whose residuals G(x) - x have the
+smallest least-squares combination,
+
+    x_{k+1} = G(x_k) - sum_i gamma_i (G(x_{i+1}) - G(x_i)),
+    gamma = argmin || f_k - sum_i gamma_i (f_{i+1} - f_i) ||,   f = G(x) - x,
+
+which needs one evaluation of G per iteration, like plain iteration, and far fewer
+iterations when the residuals are nearly linear in x. With depth = 0 it is plain
+iteration.
+
+The iteration stops when ||G(x) - x|| <= tol ||G(x)|| and returns G(x), so the result
+is always a value of the map (e.g. velocities consistent with the forces that produced
+them, to tol). If it has not converged after max_iter evaluations, or the iterates stop
+being finite (G is not a contraction near the solution), the value of G with the
+smallest residual is returned instead, with that residual. If already the first value
+of G is not finite, there is nothing to fall back on: an array of NaN is returned, with
+residual NaN, so that an adaptive ODE solver evaluating G in its RHS rejects the step
+and retries with a smaller one, instead of continuing from a non-finite value.
+"""
+
+import numpy as np
+
+## Solve x = update(x) from x0 (update returns a new array; `first`, if given, is update(x0)).
+## Returns (x, iterations, relative residual), stopping after max_iter evaluations even if not converged
+## (x is all NaN, with residual NaN, if the first value of update is not finite):
+def solve_fixed_point(update, x0, tol=1e-8, max_iter=30, depth=3, first=None):
+    x, g = x0, first
+    dG, dF = [], []  # Differences of successive values of G and of the residuals
+    g_previous = f_previous = None
+    best, best_residual = None, np.inf
+    for iteration in range(1, max_iter + 1):
+        if g is None:
+            g = update(x)
+        f = g - x
+        f_norm, g_norm = np.linalg.norm(f), np.linalg.norm(g)
+        if not np.isfinite(f_norm):
+            break
+        residual = f_norm / g_norm if g_norm > 0 else f_norm
+        if f_norm <= tol * g_norm:
+            return g, iteration, residual
+        if residual < best_residual:
+            best, best_residual = g, residual
+
+        if depth > 0 and g_previous is not None:
+            dG.append((g - g_previous).reshape(-1))
+            dF.append((f - f_previous).reshape(-1))
+            if len(dG) > depth:
+                dG.pop(0)
+                dF.pop(0)
+        g_previous, f_previous = g, f
+        if dF:
+            gamma = np.linalg.lstsq(np.stack(dF, axis=1), f.reshape(-1), rcond=None)[0]
+            x = g - (np.stack(dG, axis=1) @ gamma).reshape(g.shape)
+        else:
+            x = g
+        g = None
+    if best is None:
+        return np.full_like(g, np.nan), iteration, np.nan
+    return best, iteration, best_residual
@@ -0,0 +1,254 @@
+"""
+Fluid velocity field of a particle cloud or articulated body, evaluated at arbitrary points.
+
+The velocity at a target point x is the sum of the flows of all N particles,
+
+    u(x) = sum_j [H1(r_j) I + H2(r_j) r_j r_j^T] . F_j,   r_j = x - x_j,
+
+with the models' kernels: Stokeslets for the Stokes cloud (with the script's 5 / (8 N0)
+prefactor), Brinkmanlets for the Brinkman and magnetised clouds, and regularised
+Brinkmanlets (blob width delta) for articulated bodies. Passing delta regularises a
+cloud's Brinkmanlets too, which keeps the field finite at the particles.
+
+This is the flow of point forces: each particle's kernel acts on its own force F_j. The
+simulation scripts' mobility instead contracts each pair with the force on the moving
+particle, u_i = sum_j [H1(r_ij) I + H2(r_ij) r_ij r_ij^T] . F_i (kept from the original
+scripts, see pairwise_engine.apply_mobility). Under gravity alone every force is the
+same and the two agree, but an articulated body's spring forces differ from node to
+node, so the field at its nodes is not the velocity the simulation integrated;
+frame_node_velocities gives those, with the scripts' contraction.
+
+The forces F_j are those of the model at the frame: unit gravity on every particle, plus
+the spring forces of an articulated body (rebuilt from K, L and the body's edges). The
+magnetised model's Lorentz force depends on the particle velocities, which are not
+saved, so it is left out unless the forces are passed in.
+
+Grid-by-particle evaluation is G * N pair terms, so a direct NumPy broadcast over
+10^6 points and 2000 particles would need ~50 GB. Here the points are processed in
+chunks whose (chunk, N) work arrays fit in cache (and a memory limit per worker), reusing the same
+buffers for every chunk, with chunks shared among worker threads (NumPy releases the GIL
+in its array loops). Each chunk is evaluated independently, so the result is the same for
+any number of workers. A Grid keeps its target points, so it can be reused for every frame.
+
+Evaluate a frame on a plane through the cloud, saved to an .npz file (from the repository root):
+
+    python Simulation_scripts/flow_field.py npy_output_files/BM_5_500_500 --time 100 --plane xz --points 400
+"""
+
+import argparse
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from archive import load_trajectory
+from brinkmanlet import brinkman_kernel, regularised_brinkman_kernel
+from pairwise_engine import PairwiseEngine, stokes_kernel
+from spring_network import SpringNetwork, load_body, stickman_connections
+
+BUFFERS = 11  # (chunk, N) float64 work arrays per worker
+CACHE_ELEMENTS = 2**16  # Elements per work array for which a chunk's passes stay in cache (about twice as fast as large chunks)
+
+
+## Define grid of target points (axes as arrays, or scalars for a fixed coordinate, e.g. a plane):
+class Grid:
+
+    def __init__(self, x, y, z):
+        self.axes = [np.atleast_1d(np.asarray(a, dtype=float)) for a in (x, y, z)]
+        self.shape = tuple(len(a) for a in self.axes if len(a) > 1)  # Shape of the grid, without fixed axes
+        mesh = np.meshgrid(*self.axes, indexing="ij")
+        self.columns = np.stack([m.reshape(-1) for m in mesh])  # (3, G) contiguous coordinates
+
+    def __len__(self):
+        return self.columns.shape[1]
+
+    @property
+    def points(self):
+        return self.columns.T
+
+    ## Reshape (G, 3) values at the points to the grid's shape, (*shape, 3):
+    def reshape(self, values):
+        return values.reshape(self.shape + (3,))
+
+
+## Define per-worker chunk workspace:
+class FieldWorkspace:
+
+    def __init__(self, chunk, N):
+        self.buffers = np.empty((BUFFERS, chunk, N))
+        self.mask = np.empty((chunk, N), dtype=bool)
+
+
+## Define field evaluator for N particles with an in-place pair kernel (as used by the PairwiseEngine):
+class FieldEvaluator:
+
+    def __init__(self, N, kernel, memory_mb=512, workers=1, cutoff=1e-6):
+        self.N, self.kernel, self.cutoff = N, kernel, cutoff
+        self.workers = max(1, workers)
+        # Target points per chunk: small enough to stay in cache, and within memory_mb per worker
+        self.chunk = max(1, min(CACHE_ELEMENTS // N, int(memory_mb * 2**20) // (BUFFERS * 8 * N)))
+        self.workspaces = [FieldWorkspace(self.chunk, N) for _ in range(self.workers)]
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    ## Shut down the worker threads (also on leaving a `with FieldEvaluator(...)` block):
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ## Velocities u[g0:g1] at the target points columns[:, g0:g1]:
+    def evaluate_chunk(self, ws, columns, sources, forces, components, out, g0, g1):
+        n = g1 - g0
+        dx, dy, dz, r, inv_r, H1, H2, prod, *work = (b[:n] for b in ws.buffers)
+        mask = ws.mask[:n]
+
+        np.subtract(columns[0, g0:g1, None], sources[None, :, 0], out=dx)
+        np.subtract(columns[1, g0:g1, None], sources[None, :, 1], out=dy)
+        np.subtract(columns[2, g0:g1, None], sources[None, :, 2], out=dz)
+        np.multiply(dx, dx, out=r)
+        np.multiply(dy, dy, out=prod)
+        r += prod
+        np.multiply(dz, dz, out=prod)
+        r += prod
+        np.sqrt(r, out=r)
+        np.greater(r, self.cutoff, out=mask)
+        np.copyto(r, 1.0, where=~mask)  # Safe value for points on a particle (excluded)
+        np.divide(1.0, r, out=inv_r)
+
+        self.kernel(r, inv_r, H1, H2, tuple(work))
+        H1 *= mask
+        H2 *= mask
+
+        # u = H1 F + H2 (r . F) r, with (r . F) in prod and H2 (r . F) in H2:
+        u = out[g0:g1]
+        np.matmul(H1, forces, out=u)
+        prod[:] = 0
+        for c, d in enumerate((dx, dy, dz)):
+            if components[c]:  # Skip force components that are zero for every particle (e.g. x and y under gravity)
+                np.multiply(d, forces[:, c], out=work[0])
+                prod += work[0]
+        H2 *= prod
+        for c, d in enumerate((dx, dy, dz)):
+            np.multiply(H2, d, out=prod)
+            u[:, c] += prod.sum(axis=1)
+
+    ## Velocities (G, 3) at target points (a Grid or a (G, 3) array) of sources (N, 3) with forces (N, 3):
+    def velocities(self, targets, sources, forces, out=None):
+        columns = targets.columns if isinstance(targets, Grid) else np.ascontiguousarray(np.asarray(targets, dtype=float).T)
+        sources = np.ascontiguousarray(sources, dtype=np.float64)
+        forces = np.ascontiguousarray(np.broadcast_to(forces, sources.shape), dtype=np.float64)
+        components = forces.any(axis=0)
+        G = columns.shape[1]
+        out = np.empty((G, 3)) if out is None else out
+        chunks = [(g0, min(g0 + self.chunk, G)) for g0 in range(0, G, self.chunk)]
+
+        if self.pool is None:
+            for g0, g1 in chunks:
+                self.evaluate_chunk(self.workspaces[0], columns, sources, forces, components, out, g0, g1)
+            return out
+
+        free = queue.SimpleQueue()
+        for ws in self.workspaces:
+            free.put(ws)
+
+        def task(g0, g1):
+            ws = free.get()
+            try:
+                self.evaluate_chunk(ws, columns, sources, forces, components, out, g0, g1)
+            finally:
+                free.put(ws)
+
+        for future in [self.pool.submit(task, g0, g1) for g0, g1 in chunks]:
+            future.result()
+        return out
+
+
+## Pair kernel of a model (a cloud's Brinkmanlets are regularised if delta is given):
+def model_kernel(model, parameters, delta=None):
+    if model == "Stokes":
+        return stokes_kernel(5 / (8 * parameters["N0"]))
+    if "delta" in parameters:
+        return regularised_brinkman_kernel(parameters["alpha"], parameters["delta"] if delta is None else delta)
+    return brinkman_kernel(parameters["alpha"]) if delta is None else regularised_brinkman_kernel(parameters["alpha"], delta)
+
+
+## Forces (N, 3) on the particles of a frame: unit gravity, plus spring forces for an articulated body:
+def model_forces(model, parameters, positions):
+    forces = np.zeros_like(positions)
+    forces[:, 2] = -1
+    if "K" in parameters:
+        if parameters.get("body_edges_file"):
+            network = load_body(parameters["body_positions_file"], parameters["body_edges_file"],
+                                parameters["K"], parameters["L"])[1]
+        else:
+            network = SpringNetwork(stickman_connections(), parameters["K"], parameters["L"], N=positions.shape[0])
+        forces += network.forces(positions)
+    return forces
+
+
+## Trajectory and positions (N, 3) of a saved run (path or stem), at frame k or the frame nearest time t:
+def load_frame(path, frame=-1, time=None):
+    trajectory = load_trajectory(path)
+    k = trajectory.frame_index(time) if time is not None else frame
+    return trajectory, np.asarray(trajectory.frames[k], dtype=np.float64)
+
+
+## Fluid velocities (G, 3) at target points from a saved run (path or stem), at frame k or the frame nearest time t:
+def frame_velocity_field(path, targets, frame=-1, time=None, delta=None, forces=None, memory_mb=512, workers=1):
+    trajectory, positions = load_frame(path, frame, time)
+    kernel = model_kernel(trajectory.model, trajectory.parameters, delta)
+    if forces is None:
+        forces = model_forces(trajectory.model, trajectory.parameters, positions)
+    with FieldEvaluator(len(positions), kernel, memory_mb, workers) as evaluator:
+        return evaluator.velocities(targets, positions, forces)
+
+
+## Particle velocities (N, 3) of a saved frame as the simulation integrated them (forces on the moving particle, F_i):
+def frame_node_velocities(path, frame=-1, time=None, forces=None):
+    trajectory, positions = load_frame(path, frame, time)
+    kernel = model_kernel(trajectory.model, trajectory.parameters)
+    if forces is None:
+        forces = model_forces(trajectory.model, trajectory.parameters, positions)
+    with PairwiseEngine(len(positions)) as engine:
+        return engine.apply_mobility(positions, forces, kernel).copy()
+
+
+## Grid around a frame's particles: a plane through their centre ("xy", "xz" or "yz") or, if plane is None, a box:
+def frame_grid(positions, points=200, plane="xz", margin=0.5):
+    low, high = np.percentile(positions, [1, 99], axis=0)
+    centre, half = (low + high) / 2, (high - low) / 2 * (1 + margin) + 1e-3
+    axes = [np.linspace(c - h, c + h, points) for c, h in zip(centre, half)]
+    if plane is not None:
+        fixed = "xyz".index(next(a for a in "xyz" if a not in plane))
+        axes[fixed] = centre[fixed]
+    return Grid(*axes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the fluid velocity field of a saved frame on a grid.")
+    parser.add_argument("path", help="Archive, output file or stem, e.g. npy_output_files/BM_5_500_500")
+    parser.add_argument("--frame", type=int, default=-1)
+    parser.add_argument("--time", type=float, default=None, help="Use the frame nearest this simulated time instead")
+    parser.add_argument("--plane", choices=["xy", "xz", "yz", "box"], default="xz", help="Plane through the particles' centre, or a 3D box")
+    parser.add_argument("--points", type=int, default=200, help="Grid points per axis")
+    parser.add_argument("--margin", type=float, default=0.5, help="Grid extent beyond the particles, as a fraction")
+    parser.add_argument("--delta", type=float, default=None, help="Regularise the Brinkmanlets with this blob width")
+    parser.add_argument("--memory-mb", type=float, default=512, help="Memory budget of each worker's work arrays")
+    parser.add_argument("--workers", type=int, default=1, help="Threads evaluating chunks of points")
+    parser.add_argument("--output", default="velocity_field.npz")
+    args = parser.parse_args()
+
+    trajectory = load_trajectory(args.path)
+    k = trajectory.frame_index(args.time) if args.time is not None else args.frame
+    grid = frame_grid(np.asarray(trajectory.frames[k], dtype=np.float64), args.points,
+                      None if args.plane == "box" else args.plane, args.margin)
+    velocities = frame_velocity_field(args.path, grid, k, delta=args.delta, memory_mb=args.memory_mb, workers=args.workers)
+    np.savez(args.output, x=grid.axes[0], y=grid.axes[1], z=grid.axes[2], velocity=grid.reshape(velocities))
+    print(f"Velocity field of frame {k % trajectory.shape[0]} on a {' x '.join(map(str, grid.shape))} grid saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Timing of the ODE solvers on each simulation model: scipy's solve_ivp path against the
+built-in solvers of integrators.py (or any other methods).
+
+Every (model, method) pair is run as its own process, through the same runner as
+sweep.py, with the same seed and time span, in a temporary directory. For each run the
+table gives the process wall time, and the integration wall time, step counts and status
+(0: finished, -1: step size collapsed) from the telemetry summary (see telemetry.py).
+For a built-in solver, it also shows whether the saved trajectory is identical to that
+of the scipy solver of the same name, if that was run too (otherwise, the largest
+difference): they take the same steps, so it should be.
+
+Solver overhead is a few microseconds per RHS evaluation, for scipy's solvers and the
+built-in ones alike, so the RHS dominates every model (about 0.3 ms per evaluation for
+the 32-node stickman); times differ by less than the run-to-run noise.
+
+Run from the repository root:
+
+    python Simulation_scripts/integrator_benchmark.py --models stokes brinkman articulated --N0 100 --t-end 100 --output-frames 51
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import numpy as np
+from archive import load_trajectory
+from overrides import script_parameters
+from sweep import MODELS, SCRIPT_DIR, job_stem, run_job
+
+## Overrides of a benchmark run (the articulated body has a fixed number of nodes):
+def run_overrides(model, method, args):
+    overrides = dict(t_span=(0, args.t_end), seed=args.seed, method=method, telemetry_enabled=True)
+    if model != "articulated":
+        overrides["N0"] = args.N0
+    if args.output_frames is not None:
+        overrides["output_frames"] = args.output_frames
+    return overrides
+
+
+## Run one model with one method in output_dir; returns (process seconds, telemetry summary, frames):
+def benchmark_run(model, method, args, output_dir):
+    script = os.path.join(SCRIPT_DIR, MODELS[model][0])
+    overrides = run_overrides(model, method, args)
+    stem = job_stem(model, {**script_parameters(script), **overrides}, output_dir)
+    status, wall = run_job(dict(script=script, stem=stem, overrides=overrides), output_dir, args.threads)
+    if status != 0:
+        raise RuntimeError(f"{model} with {method} failed, see {os.path.join(output_dir, stem)}.log")
+    with open(os.path.join(output_dir, f"{stem}_telemetry.jsonl")) as f:
+        summary = next(r for r in map(json.loads, f) if r["event"] == "summary")
+    return wall, summary, np.array(load_trajectory(os.path.join(output_dir, stem)).frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time scipy and built-in ODE solvers on the simulation models.")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=sorted(MODELS))
+    parser.add_argument("--methods", nargs="+", default=["RK45", "native_RK45"])
+    parser.add_argument("--N0", type=int, default=100, help="Particles of the clouds")
+    parser.add_argument("--t-end", type=float, default=10, help="Simulated time of each run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output-frames", type=int, default=None, help="Stream this many frames (default: every step)")
+    parser.add_argument("--threads", type=int, default=1, help="BLAS/OpenMP threads per run")
+    args = parser.parse_args()
+
+    print(f"{'model':>11} {'method':>14} {'process s':>10} {'solve s':>8} {'nfev':>6} {'accepted':>9} {'rejected':>9} {'status':>7} {'same as scipy':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for model in args.models:
+            frames = {}
+            for method in args.methods:
+                output_dir = os.path.join(tmp, model, method)
+                os.makedirs(output_dir)
+                wall, summary, frames[method] = benchmark_run(model, method, args, output_dir)
+                reference = frames.get(method.removeprefix("native_")) if method.startswith("native_") else None
+                if reference is None:
+                    same = "-"
+                elif np.array_equal(frames[method], reference, equal_nan=True):  # Frames after a failed step stay NaN
+                    same = "identical"
+                else:
+                    same = f"{np.nanmax(np.abs(frames[method] - reference)):.1e}"
+                print(f"{model:>11} {method:>14} {wall:>10.2f} {summary['wall_time']:>8.2f} {summary['nfev']:>6} "
+                      f"{summary['accepted_steps']:>9} {str(summary['rejected_steps']):>9} {summary['status']:>7} {same:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Built-in embedded Runge-Kutta integrators, selected with method = "native_RK45" or
+"native_DOP853" in the simulation scripts.
+
+They take exactly the steps of scipy's RK45 and DOP853: the same Butcher tableaux
+(read from the scipy classes), initial step selection, RMS error norm, tolerances
+(rtol = 1e-3, atol = 1e-6 by default) and step-size controller (safety 0.9, factors
+between 0.2 and 10), with the arithmetic in the same order, so the trajectories agree
+with solve_ivp bit for bit. Around the steps:
+
+- stages, trial states, error scales and the solution are written into buffers
+  allocated once, instead of ~20 new arrays per step,
+- the derivative at the end of an accepted step is reused as the first stage of the
+  next (FSAL), as in scipy, and the RHS is called directly (no wrapper per call),
+- dense output is only built for steps that pass a requested output time (for
+  DOP853, its three extra stages are only evaluated then).
+
+The remaining overhead, a few NumPy calls per stage, is the same as scipy's, a few
+microseconds per RHS evaluation. Every model's RHS costs far more than that (about 0.3 ms
+for the 32-node stickman), so run times are the same as with scipy's solvers, see
+integrator_benchmark.py. The solvers are a base for integration schemes scipy does not
+offer, and they count rejected steps exactly, which telemetry.py otherwise estimates
+from the RHS count.
+
+The solvers have the attributes and methods used by trajectory_writer.integrate_to_writer
+and checkpoint.py (t, y, f, h_abs, nfev, status, step() and dense_output()), and also
+count rejected steps. solve() integrates with any method, keeping every accepted step
+like solve_ivp without t_eval, and calls step_callback(solver), if given, after each
+accepted step (e.g. to warm-start an iterative RHS from the accepted state).
+"""
+
+from types import SimpleNamespace
+import numpy as np
+from scipy.integrate import DOP853, RK23, RK45, solve_ivp
+
+SAFETY = 0.9  # Step-size controller, as in scipy.integrate
+MIN_FACTOR = 0.2  # Smallest step-size decrease
+MAX_FACTOR = 10  # Largest step-size increase
+
+
+## RMS norm, as used by scipy's error control:
+def rms_norm(x):
+    return np.linalg.norm(x) / x.size ** 0.5
+
+
+## Define embedded explicit Runge-Kutta solver with preallocated stages (Butcher tableau of a scipy solver class):
+class EmbeddedRungeKutta:
+    tableau = RK45
+
+    def __init__(self, fun, t0, y0, t_bound, max_step=np.inf, rtol=1e-3, atol=1e-6, first_step=None):
+        tableau = self.tableau
+        self.A, self.B, self.C, self.E, self.P = tableau.A, tableau.B, tableau.C, tableau.E, tableau.P
+        self.n_stages, self.order = tableau.n_stages, tableau.error_estimator_order
+        self.error_exponent = -1 / (self.order + 1)
+
+        self.fun_raw = fun
+        self.t, self.t_old, self.t_bound = float(t0), None, float(t_bound)
+        self.direction = np.sign(self.t_bound - self.t) if self.t_bound != self.t else 1.0
+        self.y = np.array(y0, dtype=np.float64).reshape(-1)
+        self.n = n = self.y.size
+        self.max_step = max_step
+        self.rtol, self.atol = np.maximum(rtol, 100 * np.finfo(float).eps), atol
+        self.nfev, self.rejected_steps, self.status = 0, 0, "running"
+
+        # Work buffers: solution rotation (y, y_new, y_old), stage state, increment, error scale and error
+        self.y_new, self.y_old = np.empty(n), np.empty(n)
+        self.y_stage, self.dy, self.scale, self.error = np.empty(n), np.empty(n), np.empty(n), np.empty(n)
+        self.allocate_stages(n)
+
+        self.f = np.array(self.fun(self.t, self.y), dtype=np.float64).reshape(-1)
+        self.h_abs = self.initial_step() if first_step is None else float(first_step)
+        self.h_previous = None
+
+    ## Stage and dense-output buffers:
+    def allocate_stages(self, n):
+        self.K = np.empty((self.n_stages + 1, n))
+        self.Q = np.empty((n, self.P.shape[1]))
+
+    def fun(self, t, y):
+        self.nfev += 1
+        return self.fun_raw(t, y)
+
+    ## Initial step size (Hairer, Norsett and Wanner, Sec. II.4, as in scipy):
+    def initial_step(self):
+        t0, y0, f0 = self.t, self.y, self.f
+        interval_length = abs(self.t_bound - t0)
+        if self.n == 0:
+            return np.inf
+        if interval_length == 0.0:
+            return 0.0
+        scale = self.atol + np.abs(y0) * self.rtol
+        d0, d1 = rms_norm(y0 / scale), rms_norm(f0 / scale)
+        h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+        h0 = min(h0, interval_length)
+        f1 = self.fun(t0 + h0 * self.direction, y0 + h0 * self.direction * f0)
+        d2 = rms_norm((f1 - f0) / scale) / h0
+        h1 = max(1e-6, h0 * 1e-3) if d1 <= 1e-15 and d2 <= 1e-15 else (0.01 / max(d1, d2)) ** (1 / (self.order + 1))
+        return min(100 * h0, h1, interval_length, self.max_step)
+
+    ## Fill the stages K and the solution y_new of a step of size h from (t, y), ending with K[-1] = f(t + h, y_new):
+    def stages(self, t, y, h):
+        K, A, C, dy, y_stage, fun = self.K, self.A, self.C, self.dy, self.y_stage, self.fun_raw
+        K[0] = self.f
+        for s in range(1, self.n_stages):
+            np.dot(K[:s].T, A[s, :s], out=dy)
+            dy *= h
+            np.add(y, dy, out=y_stage)
+            K[s] = fun(t + C[s] * h, y_stage)
+        np.dot(K[:-1].T, self.B, out=dy)
+        dy *= h
+        np.add(y, dy, out=self.y_new)
+        K[-1] = fun(t + h, self.y_new)
+        self.nfev += self.n_stages
+
+    ## RMS norm of the embedded error estimate, relative to scale:
+    def error_norm(self, h, scale):
+        np.dot(self.K.T, self.E, out=self.error)
+        self.error *= h
+        self.error /= scale
+        return rms_norm(self.error)
+
+    ## Take one accepted step (retrying with smaller steps while the error is too large):
+    def step(self):
+        if self.n == 0 or self.t == self.t_bound:
+            self.t_old, self.t, self.status = self.t, self.t_bound, "finished"
+            return
+        t, y = self.t, self.y
+        min_step = 10 * np.abs(np.nextafter(t, self.direction * np.inf) - t)
+        if self.h_abs > self.max_step:
+            h_abs = self.max_step
+        elif self.h_abs < min_step:
+            h_abs = min_step
+        else:
+            h_abs = self.h_abs
+
+        rejected = False
+        while True:
+            if h_abs < min_step:
+                self.status = "failed"
+                return
+            t_new = t + h_abs * self.direction
+            if self.direction * (t_new - self.t_bound) > 0:
+                t_new = self.t_bound
+            h = t_new - t
+            h_abs = np.abs(h)
+
+            self.stages(t, y, h)
+            scale = self.scale
+            np.abs(y, out=scale)
+            np.abs(self.y_new, out=self.error)
+            np.maximum(scale, self.error, out=scale)
+            scale *= self.rtol
+            scale += self.atol
+            error_norm = self.error_norm(h, scale)
+
+            if error_norm < 1:
+                factor = MAX_FACTOR if error_norm == 0 else min(MAX_FACTOR, SAFETY * error_norm ** self.error_exponent)
+                h_abs *= min(1, factor) if rejected else factor
+                break
+            h_abs *= max(MIN_FACTOR, SAFETY * error_norm ** self.error_exponent)
+            rejected = True
+            self.rejected_steps += 1
+
+        self.h_previous, self.h_abs = h, h_abs
+        self.t_old, self.t = t, t_new
+        self.y_old, self.y, self.y_new = y, self.y_new, self.y_old
+        np.copyto(self.f, self.K[-1])
+        if self.direction * (self.t - self.t_bound) >= 0:
+            self.status = "finished"
+
+    ## Interpolant over the last step (call it with times in [t_old, t]):
+    def dense_output(self):
+        np.dot(self.K.T, self.P, out=self.Q)
+        return self.interpolate
+
+    def interpolate(self, t):
+        h = self.t - self.t_old
+        x = (t - self.t_old) / h
+        y = h * np.dot(self.Q, np.cumprod(np.full(self.Q.shape[1], x)))
+        y += self.y_old
+        return y
+
+
+## Define Dormand-Prince 8(5,3) solver (error estimated from the 5th and 3rd order embedded pairs):
+class EmbeddedDOP853(EmbeddedRungeKutta):
+    tableau = DOP853
+
+    def allocate_stages(self, n):
+        self.E3, self.E5, self.D = DOP853.E3, DOP853.E5, DOP853.D
+        self.A_EXTRA, self.C_EXTRA = DOP853.A_EXTRA, DOP853.C_EXTRA
+        self.K_extended = np.empty((self.n_stages + 1 + len(self.C_EXTRA), n))  # Extra stages for dense output
+        self.K = self.K_extended[:self.n_stages + 1]
+        self.error3 = np.empty(n)
+        self.F = np.empty((self.D.shape[0] + 3, n))
+
+    def error_norm(self, h, scale):
+        err5, err3 = self.error, self.error3
+        np.dot(self.K.T, self.E5, out=err5)
+        err5 /= scale
+        np.dot(self.K.T, self.E3, out=err3)
+        err3 /= scale
+        err5_norm_2, err3_norm_2 = np.linalg.norm(err5)**2, np.linalg.norm(err3)**2
+        if err5_norm_2 == 0 and err3_norm_2 == 0:
+            return 0.0
+        denom = err5_norm_2 + 0.01 * err3_norm_2
+        return np.abs(h) * err5_norm_2 / np.sqrt(denom * self.n)
+
+    def dense_output(self):
+        K, h, dy = self.K_extended, self.h_previous, self.dy
+        for s, (a, c) in enumerate(zip(self.A_EXTRA, self.C_EXTRA), start=self.n_stages + 1):
+            np.dot(K[:s].T, a[:s], out=dy)
+            dy *= h
+            np.add(self.y_old, dy, out=self.y_stage)
+            K[s] = self.fun(self.t_old + c * h, self.y_stage)
+
+        F, f_old = self.F, K[0]
+        np.subtract(self.y, self.y_old, out=F[0])
+        F[1] = h * f_old - F[0]
+        F[2] = 2 * F[0] - h * (self.f + f_old)
+        F[3:] = h * np.dot(self.D, K)
+        return self.interpolate
+
+    def interpolate(self, t):
+        x = (t - self.t_old) / (self.t - self.t_old)
+        y = np.zeros(self.n)
+        for i, f in enumerate(reversed(self.F)):
+            y += f
+            y *= x if i % 2 == 0 else 1 - x
+        y += self.y_old
+        return y
+
+
+NATIVE_SOLVERS = {"native_RK45": EmbeddedRungeKutta, "native_DOP853": EmbeddedDOP853}
+SOLVERS = {"RK23": RK23, "RK45": RK45, "DOP853": DOP853, **NATIVE_SOLVERS}  # scipy and built-in
+
+
+## Integrate over t_span, keeping every accepted step (as solve_ivp without t_eval), with a built-in or scipy method
+## (scipy's solvers are stepped here, taking the same steps as solve_ivp, when step_callback is given):
+def solve(fun, t_span, y0, method="RK45", step_callback=None, **options):
+    if method not in NATIVE_SOLVERS and step_callback is None:
+        return solve_ivp(fun, t_span, y0, method=method, **options)
+    solver = SOLVERS[method](fun, t_span[0], y0, t_span[1], **options)
+    ts, ys = [solver.t], [solver.y.copy()]
+    while solver.status == "running":
+        solver.step()
+        if solver.status == "failed":
+            break
+        ts.append(solver.t)
+        ys.append(solver.y.copy())
+        if step_callback is not None:
+            step_callback(solver)
+    status = 0 if solver.status == "finished" else -1
+    message = ("The solver successfully reached the end of the integration interval." if status == 0
+               else "Required step size is less than spacing between numbers.")
+    return SimpleNamespace(t=np.array(ts), y=np.stack(ys, axis=-1), nfev=solver.nfev, status=status,
+                           success=status == 0, message=message, rejected_steps=getattr(solver, "rejected_steps", None))
@@ -0,0 +1,87 @@
+"""
+Timing of the Brinkmanlet kernels, evaluated in cache-sized strips (the engine's default,
+see KERNEL_STRIP_ELEMENTS) and over whole (tile, N) blocks at once.
+
+For each alpha (and, with --delta, for the regularised kernel of the articulated body),
+reports the kernel time per pair and the time per RHS evaluation of the Brinkman cloud
+(brinkman_velocities) and of the mobility application (apply_mobility, as in the
+magnetised and articulated-body scripts), on a random cloud of N0 particles. Both
+evaluations give bit-for-bit the same velocities, which is checked on every line.
+
+Run from the repository root:
+
+    python Simulation_scripts/kernel_benchmark.py --N0 2000 --alpha 0.01 0.1 1 5 --delta 0.1
+"""
+
+import argparse
+import time
+import numpy as np
+from pairwise_engine import KERNEL_STRIP_ELEMENTS, PairwiseEngine
+from brinkmanlet import brinkman_kernel, regularised_brinkman_kernel
+
+## Best time per call (seconds) of f over a few repeats:
+def best_time(f, repeats=5, number=3):
+    f()
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+## Kernel time per pair (ns) over the pair distances of one (tile, N) block, in strips of `rows` rows:
+def kernel_time(kernel, r, rows):
+    n, m = r.shape
+    r_strips, inv_r, H1, H2 = np.empty_like(r), np.empty_like(r), np.empty_like(r), np.empty_like(r)
+    work = tuple(np.empty(r.size) for _ in range(3))  # Flat, so each strip uses the start of the buffers
+
+    def run():
+        np.copyto(r_strips, r)  # Regularised kernels overwrite r and inv_r
+        np.divide(1.0, r, out=inv_r)
+        for a in range(0, n, rows):
+            k = min(rows, n - a)
+            strip = slice(a, a + k)
+            kernel(r_strips[strip], inv_r[strip], H1[strip], H2[strip], tuple(w[:k * m].reshape(k, m) for w in work))
+
+    return best_time(run) / r.size * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the Brinkmanlet kernels in strips and over whole blocks.")
+    parser.add_argument("--N0", type=int, default=2000)
+    parser.add_argument("--alpha", type=float, nargs="+", default=[0.01, 0.1, 1, 5])
+    parser.add_argument("--delta", type=float, default=None, help="Also time the regularised kernel with this blob width")
+    parser.add_argument("--tile", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    positions = rng.normal(size=(args.N0, 3)) * args.N0 ** (1 / 3) / 2
+    gravity = np.zeros_like(positions)
+    gravity[:, 2] = -1
+    r = np.linalg.norm(positions[:args.tile, None] - positions[None], axis=-1)
+    r[r < 1e-6] = 1.0
+
+    rows = max(1, KERNEL_STRIP_ELEMENTS // args.N0)  # Rows per strip of the first (widest) block
+    strips = PairwiseEngine(args.N0, args.tile)
+    blocks = PairwiseEngine(args.N0, args.tile, kernel_rows=args.tile)
+    deltas = [None] + ([args.delta] if args.delta is not None else [])
+    print(f"N0 = {args.N0}, tile {args.tile}, strips of {rows} rows; times as strips / whole blocks")
+    print(f"{'alpha':>7} {'delta':>6} {'kernel ns/pair':>16} {'cloud RHS ms':>15} {'mobility RHS ms':>17} {'identical':>9}")
+    for alpha in args.alpha:
+        for delta in deltas:
+            kernel = brinkman_kernel(alpha) if delta is None else regularised_brinkman_kernel(alpha, delta)
+            kernel_ns = [kernel_time(kernel, r, n) for n in (rows, args.tile)]
+            cloud = [best_time(lambda: engine.brinkman_velocities(positions, kernel)) * 1e3 for engine in (strips, blocks)]
+            mobility = [best_time(lambda: engine.apply_mobility(positions, gravity, kernel)) * 1e3 for engine in (strips, blocks)]
+            identical = all(np.array_equal(f(strips), f(blocks)) for f in (
+                lambda e: e.brinkman_velocities(positions, kernel).copy(),
+                lambda e: e.apply_mobility(positions, gravity, kernel).copy()))
+            print(f"{alpha:>7g} {'-' if delta is None else f'{delta:g}':>6} {kernel_ns[0]:>7.1f} / {kernel_ns[1]:<6.1f} "
+                  f"{cloud[0]:>6.1f} / {cloud[1]:<6.1f} {mobility[0]:>7.1f} / {mobility[1]:<7.1f} {str(identical):>9}")
+
+
+if __name__ == "__main__":
+    main()
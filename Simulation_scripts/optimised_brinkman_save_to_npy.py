@@ -1,6 +1,17 @@
 import numpy as np
+import sys
 import time
-from scipy.integrate import solve_ivp
+from integrators import solve
+from pairwise_engine import PairwiseEngine
+from brinkmanlet import brinkman_kernel
+from split_kernel import SplitBrinkmanEvaluator
+from treecode import error_report
+from telemetry import Telemetry
+from overrides import apply_overrides
+from ensemble import member_seeds, initial_members, state_shape, save_members, member_filenames, seeded_stem
+from trajectory_writer import TrajectoryWriter, integrate_to_writer
+from archive import archive_metadata
+from checkpoint import Checkpointer
 
 
 ## Assign parameters:
@@ -8,6 +19,24 @@ N0 = 500  # Number of particles
 R = 1  # Radius of initial sphere
 alpha = 5  # Permeability parameter
 t_span = (0, 500)  # Time span for simulation
+method = "RK45"  # ODE solver: scipy's "RK45" or "DOP853", or built-in "native_RK45" or "native_DOP853" (integrators.py)
+tile_size = 256  # Row-block size for the pairwise engine (peak memory ~ 10 * tile_size * N0 floats)
+workers = 1  # Threads evaluating pairwise row blocks in parallel (results are bit-for-bit identical for any value)
+single_precision = False  # Set True for float32 pairwise kernels and float32 output files (integration stays float64)
+use_split_kernel = False  # Set True for cell-list near field + tree-code far field (approximate)
+split_tol = 1e-6  # Tolerance on the screened part, sets the near-field cutoff
+theta = 0.3  # Opening angle for the far-field tree code
+telemetry_enabled = False  # Set True to save run statistics to a _telemetry.jsonl sidecar
+ensemble_size = 1  # Number of independent realisations integrated together (each saved to its own file)
+seed = None  # Random seed (ensemble member b uses seed + b)
+archive_output = False  # Set True to save a self-describing {stem}_archive/ (frame-major positions, times, parameters and seed)
+output_frames = None  # Number of equally spaced frames streamed to disk during the run (None: every solver step, saved at the end)
+checkpoint_every_t = None  # Save a checkpoint every this much simulated time (requires output_frames)
+checkpoint_every_wall = None  # Save a checkpoint every this many seconds of wall time (requires output_frames)
+resume = False  # Set True to continue an interrupted run from its _checkpoint.npz (same parameters)
+
+## Apply parameter overrides from the command line, e.g. "t_span=(0,100) seed=1" (used by sweep.py):
+apply_overrides(globals(), sys.argv[1:])
 progress_intervals = np.linspace(t_span[0], t_span[1], 101)[1:] # Intervals for progress printing
 
 ## Define initial sphere function:
@@ -19,67 +48,78 @@ def initial_sphere(R, N):
             points.append(point)
     return np.array(points)
 
-## Define vectorised H1 and H2 functions:
-def H1(r):
-    mask = r > 1e-6  # Avoid r -> infinity error
-    result = np.zeros_like(r)
-    exp_term = np.exp(-alpha * r[mask])
-    result[mask] = (exp_term / (4 * np.pi * r[mask])) * (1 + 1/(alpha*r[mask]) + 1/((alpha**2) * (r[mask]**2))) - 1/(4 * np.pi * (alpha**2) * (r[mask]**3))
-    return result
-
-def H2(r):
-    mask = r > 1e-6 # Avoid r -> infinity error
-    result = np.zeros_like(r)
-    exp_term = np.exp(-alpha * r[mask])
-    result[mask] = (-exp_term / (4 * np.pi * r[mask]**3)) * (1 + 3/(alpha*r[mask]) + 3/((alpha**2) * (r[mask]**2))) + 3 / (4 * np.pi * (alpha**2) * (r[mask]**5))
-    return result
-
 ## Vectorised derivative function with progress updates:
 def deriv_func(t, r):
     
     global progress_index, start_time
 
+    telemetry.rhs_call(t)
+
     if progress_index < len(progress_intervals) and t >= progress_intervals[progress_index]:
         elapsed_time = time.time() - start_time
         print(f"Progress: {int((t/t_span[1]) * 100)}% complete. Time elapsed: {elapsed_time:.2f} seconds")
         progress_index += 1
+        telemetry.checkpoint(t)
 
-    positions = r.reshape(N0, 3)  
-    velocities = np.zeros_like(positions)  
+    positions = r.reshape(state_shape(ensemble_size, N0))
 
-    r_ij = positions[:, None, :] - positions[None, :, :] 
-    r_abs = np.linalg.norm(r_ij, axis=2) 
- 
-    H1_vals = H1(r_abs)
-    H2_vals = H2(r_abs)
+    if use_split_kernel:
+        with telemetry.phase("split_kernel"):
+            velocities = split_evaluator.cloud_velocities(positions)
+    else:
+        velocities = engine.brinkman_velocities(positions, kernel)
 
-    vel_x = -r_ij[:, :, 0] * r_ij[:, :, 2] * H2_vals
-    vel_y = -r_ij[:, :, 1] * r_ij[:, :, 2] * H2_vals
-    vel_z = -H1_vals - (r_ij[:, :, 2] ** 2) * H2_vals
+    return velocities.flatten()
 
-    velocities[:, 0] = np.sum(vel_x * (r_abs > 1e-6), axis=1)
-    velocities[:, 1] = np.sum(vel_y * (r_abs > 1e-6), axis=1)
-    velocities[:, 2] = np.sum(vel_z * (r_abs > 1e-6), axis=1)
+if use_split_kernel and ensemble_size > 1:
+    raise ValueError("Ensemble mode requires the direct pairwise engine (use_split_kernel = False)")
 
-    return velocities.flatten()
+## Initialise positions (one draw per ensemble member):
+seeds = member_seeds(seed, ensemble_size)
+init_positions = initial_members(lambda: initial_sphere(R, N0), seeds)
 
-## Initialise positions:
-init_positions = initial_sphere(R, N0)
+## Initialise telemetry and pairwise engine (workspace is allocated once and reused by every RHS call):
+parameters = dict(model="Brinkman", N0=N0, R=R, alpha=alpha, t_span=t_span, method=method, use_split_kernel=use_split_kernel,
+                  split_tol=split_tol, theta=theta, single_precision=single_precision, seeds=seeds)  # Recorded in the telemetry and archive metadata
+telemetry = Telemetry(telemetry_enabled, parameters=parameters)
+precision = np.float32 if single_precision else np.float64  # Pair kernels and stored trajectories
+engine = PairwiseEngine(N0, tile_size, telemetry=telemetry, batch=ensemble_size if ensemble_size > 1 else None,
+                        workers=workers, dtype=precision)
+kernel = brinkman_kernel(alpha)
+split_evaluator = SplitBrinkmanEvaluator(alpha, tol=split_tol, theta=theta, engine=engine)
 
 ## Flatten initial positions for ODE solver:
 init_pos_flat = init_positions.flatten()
 
+## Report split-kernel accuracy against the direct sum on the initial positions:
+if use_split_kernel:
+    report = error_report(split_evaluator.cloud_velocities(init_positions),
+                          engine.brinkman_velocities(init_positions, kernel))
+    print(f"Split kernel (cutoff={split_evaluator.r_c:.3f}, theta={theta}) vs direct sum: "
+          f"max error / max velocity {report['max_error_rel_to_max_velocity']:.2e}, RMS relative error {report['rms_rel_error']:.2e}")
+
 ## Initialise progress tracking:
 progress_index = 0
 start_time = time.time()
 
-## Solve ODE system:
-solution = solve_ivp(deriv_func, t_span, init_pos_flat, method="RK45")
-
-## Reshape output for saving:
-reshaped = solution.y.reshape(N0, 3, len(solution.t))
-
-## Save to file:
-np.save(f"BM_{alpha}_{N0}_{t_span[1]}_output.npy", reshaped)
-print(f"3D array saved to BM_{alpha}_{N0}_{t_span[1]}_output.npy")
+if output_frames is None and (checkpoint_every_t is not None or checkpoint_every_wall is not None or resume):
+    raise ValueError("Checkpoint and resume require streamed output (set output_frames)")
+
+## Solve ODE system, streaming frames to disk (with optional checkpoints) if output_frames is set:
+stem = seeded_stem(f"BM_{alpha}_{N0}_{t_span[1]}", seed, ensemble_size)
+metadata = [archive_metadata(parameters, s, precision) for s in seeds] if archive_output else None
+if output_frames is None:
+    solution = solve(deriv_func, t_span, init_pos_flat, method=method)
+    save_members(solution.y, N0, stem, seeds, precision, solution.t, metadata)
+else:
+    checkpointer = Checkpointer(f"{stem}_checkpoint.npz", checkpoint_every_t, checkpoint_every_wall, globals(), ("progress_index",))
+    restart = checkpointer.load() if resume else None
+    writer = TrajectoryWriter(member_filenames(stem, seeds, archive_output), N0,
+                              np.linspace(t_span[0], t_span[1], output_frames), restart, precision, metadata)
+    solution = integrate_to_writer(deriv_func, t_span, init_pos_flat, writer, method=method,
+                                   checkpointer=checkpointer, restart=restart)
+    writer.close()
+engine.close()  # Shut down the pairwise worker threads
+telemetry.finish(solution, method)
+telemetry.write(f"{stem}_telemetry.jsonl")
 
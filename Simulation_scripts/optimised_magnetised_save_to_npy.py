@@ -1,6 +1,18 @@
 import numpy as np
+import sys
 import time
-from scipy.integrate import solve_ivp
+from integrators import solve
+from pairwise_engine import PairwiseEngine, contract_mobility_sums
+from brinkmanlet import brinkman_kernel, brinkmanlet
+from split_kernel import SplitBrinkmanEvaluator
+from treecode import error_report
+from telemetry import Telemetry
+from overrides import apply_overrides
+from ensemble import member_seeds, initial_members, state_shape, save_members, member_filenames, seeded_stem
+from trajectory_writer import TrajectoryWriter, integrate_to_writer
+from archive import archive_metadata
+from checkpoint import Checkpointer
+from fixed_point import solve_fixed_point
 
 ## Assign parameters:
 N0 = 500  # Number of particles
@@ -8,6 +20,29 @@ R = 1  # Radius of initial sphere
 alpha = 3  # Permeability parameter
 beta = 5 # Magnetic field parameter
 t_span = (0, 300)  # Time span for simulation
+method = "RK45"  # ODE solver: scipy's "RK45" or "DOP853", or built-in "native_RK45" or "native_DOP853" (integrators.py)
+implicit_velocities = False  # Set True to solve v = M(x) F(x, v) at every RHS evaluation (from the last accepted step's v), instead of lagging v from the last evaluation
+velocity_tol = 1e-6  # Relative residual at which the implicit velocity iteration stops
+velocity_max_iter = 30  # Most map evaluations per implicit velocity solve
+anderson_depth = 3  # Previous iterates combined by Anderson acceleration (0: plain fixed-point iteration, see fixed_point.py)
+matrix_free = True  # Set False to use the reference (3,3,N,N) mobility tensor
+tile_size = 256  # Row-block size for the matrix-free mobility operator
+workers = 1  # Threads evaluating pairwise row blocks in parallel (results are bit-for-bit identical for any value)
+single_precision = False  # Set True for float32 pairwise kernels and float32 output files (integration stays float64)
+use_split_kernel = False  # Set True for cell-list near field + tree-code far field (approximate)
+split_tol = 1e-6  # Tolerance on the screened part, sets the near-field cutoff
+theta = 0.3  # Opening angle for the far-field tree code
+telemetry_enabled = False  # Set True to save run statistics to a _telemetry.jsonl sidecar
+ensemble_size = 1  # Number of independent realisations integrated together (each saved to its own file)
+seed = None  # Random seed (ensemble member b uses seed + b)
+archive_output = False  # Set True to save a self-describing {stem}_archive/ (frame-major positions, times, parameters and seed)
+output_frames = None  # Number of equally spaced frames streamed to disk during the run (None: every solver step, saved at the end)
+checkpoint_every_t = None  # Save a checkpoint every this much simulated time (requires output_frames)
+checkpoint_every_wall = None  # Save a checkpoint every this many seconds of wall time (requires output_frames)
+resume = False  # Set True to continue an interrupted run from its _checkpoint.npz (same parameters)
+
+## Apply parameter overrides from the command line, e.g. "t_span=(0,100) seed=1" (used by sweep.py):
+apply_overrides(globals(), sys.argv[1:])
 progress_intervals = np.linspace(t_span[0], t_span[1], 101)[1:] # Intervals for progress printing
 
 ## Define initial sphere function:
@@ -19,23 +54,7 @@ def initial_sphere(R, N):
             points.append(point)
     return np.array(points)
 
-## Define vectorised H1 and H2 functions:
-def H1(r):
-    mask = r > 1e-6  # Avoid r -> infinity error
-    result = np.zeros_like(r)
-    exp_term = np.exp(-alpha * r[mask])
-    result[mask] = (exp_term / (4 * np.pi * r[mask])) * (1 + 1/(alpha*r[mask]) + 1/((alpha**2) * (r[mask]**2))) - 1/(4 * np.pi * (alpha**2) * (r[mask]**3))
-    return result
-
-def H2(r):
-    mask = r > 1e-6 # Avoid r -> infinity error
-    result = np.zeros_like(r)
-    exp_term = np.exp(-alpha * r[mask])
-    result[mask] = (-exp_term / (4 * np.pi * r[mask]**3)) * (1 + 3/(alpha*r[mask]) + 3/((alpha**2) * (r[mask]**2))) + 3 / (4 * np.pi * (alpha**2)) * (r[mask]**-5)
-    return result
-
-
-## Define function to compute resultant magnetic force:
+## Define function to compute resultant magnetic force (reference path, used when matrix_free = False):
 def resultant_force(positions, velocities, beta):
     N0 = positions.shape[0] 
     
@@ -52,24 +71,29 @@ def resultant_force(positions, velocities, beta):
 
     B_totals = np.sum(B_all, axis=1)
 
+    return lorentz_force(velocities, B_totals)
+
+
+## Define function to compute the force from the total magnetic field at each particle:
+def lorentz_force(velocities, B_totals):
+
     B_totals[B_totals > 2] = 2 
     B_totals[B_totals < -2] = -2
 
     F_all = np.cross(velocities, B_totals)
 
-    F_all[:, 2] += -1  # add gravity
+    F_all[..., 2] += -1  # add gravity
 
     return F_all
 
 
-## Define function to compute mobility matrix:
+## Define function to compute mobility matrix (reference path, used when matrix_free = False):
 def create_mobility_matrix(positions):
  
     r_ij = positions[:, None, :] - positions[None, :, :]
     r_abs = np.linalg.norm(r_ij, axis=2)
 
-    H1_vals = H1(r_abs)
-    H2_vals = H2(r_abs)
+    H1_vals, H2_vals = brinkmanlet(r_abs, alpha)  # Shared kernels (see brinkmanlet.py)
 
     r_x, r_y, r_z = r_ij[..., 0], r_ij[..., 1], r_ij[..., 2]
 
@@ -87,46 +111,138 @@ def create_mobility_matrix(positions):
 
     return mobility_matrix
 
+## Solve v = update(v) for the velocities, from a starting guess and its first update (implicit mode):
+def implicit_velocities_from(update, guess, first):
+    global velocity_iterations, velocity_unconverged
+    velocities, iterations, residual = solve_fixed_point(update, guess, velocity_tol, velocity_max_iter, anderson_depth, first)
+    velocity_iterations += iterations
+    velocity_unconverged += not residual <= velocity_tol  # Including non-finite solves (NaN, the step is rejected)
+    if telemetry.enabled:
+        telemetry.note(velocity_iterations=velocity_iterations, velocity_unconverged=velocity_unconverged,
+                       velocity_residual=residual)
+    return velocities
+
 ## Vectorised derivative function with progress updates:
 def deriv_func(t, r):
     
     global progress_index, start_time, previous_pos, previous_t, velocities
 
+    telemetry.rhs_call(t)
+
     if progress_index < len(progress_intervals) and t >= progress_intervals[progress_index]:
         elapsed_time = time.time() - start_time
         print(f"Progress: {int((t/t_span[1]) * 100)}% complete. Time elapsed: {elapsed_time:.2f} seconds")
         progress_index += 1
-
-    positions = r.reshape(N0, 3)  
-
-    F_all = resultant_force(positions, velocities, beta)
-
-    mobility_matrix = create_mobility_matrix(positions)
-
-    velocities = np.einsum('uhij,ih->iu', mobility_matrix, F_all) 
-
-    print(f"velocities: {velocities.min()}, {velocities.max()}")
+        telemetry.checkpoint(t)
+
+    positions = r.reshape(state_shape(ensemble_size, N0))
+
+    # The Lorentz force uses the velocities of the last RHS evaluation (lagged); in implicit mode, the velocities
+    # are iterated to v = M(x) F(x, v) at these positions instead, starting from those of the last accepted step
+    # (the last evaluation may be a stage of a rejected step, or an extra dense-output stage)
+    guess = accepted_velocities if implicit_velocities else velocities
+    if use_split_kernel:
+        def update(v):
+            with telemetry.phase("force"):
+                F_all = resultant_force(positions, v, beta)
+            with telemetry.phase("split_kernel"):
+                return split_evaluator.apply_mobility(positions, F_all)
+        new_velocities = update(guess)
+    elif matrix_free:
+        # Pair geometry is computed once and shared by the magnetic field and the mobility sums; the mobility
+        # sums only depend on the positions, so further iterations only recompute the field
+        sums, field = engine.mobility_sums(positions, kernel, guess)
+
+        def update(v, field=None):
+            field = engine.magnetic_field(positions, v) if field is None else field
+            with telemetry.phase("force"):
+                F_all = lorentz_force(v, (1/(N0**2)) * beta * field)
+            with telemetry.phase("contraction"):
+                return contract_mobility_sums(sums, F_all, np.empty_like(F_all))
+        new_velocities = update(guess, field)
+    else:
+        with telemetry.phase("kernels"):
+            mobility_matrix = create_mobility_matrix(positions)
+
+        def update(v):
+            with telemetry.phase("force"):
+                F_all = resultant_force(positions, v, beta)
+            with telemetry.phase("contraction"):
+                return np.einsum('uhij,ih->iu', mobility_matrix, F_all)
+        new_velocities = update(guess)
+
+    if implicit_velocities:
+        new_velocities = implicit_velocities_from(update, guess, new_velocities)
+    velocities = new_velocities
+
+    if telemetry.enabled:
+        telemetry.note(velocity_min=velocities.min(), velocity_max=velocities.max())
 
     return velocities.flatten()
 
+## Keep the velocities of each accepted step (the solver's derivative there), to warm-start the implicit solves:
+def accept_step(solver):
+    global accepted_velocities
+    accepted_velocities = solver.f.reshape(state_shape(ensemble_size, N0)).copy()
+
 ## Initialise progress tracking:
 progress_index = 0
 start_time = time.time()
 
-## Initialise global variables:
-init_positions = initial_sphere(R, N0)
+if ensemble_size > 1 and (use_split_kernel or not matrix_free):
+    raise ValueError("Ensemble mode requires the matrix-free pairwise engine (matrix_free = True, use_split_kernel = False)")
+
+## Initialise global variables (one initial sphere per ensemble member):
+seeds = member_seeds(seed, ensemble_size)
+init_positions = initial_members(lambda: initial_sphere(R, N0), seeds)
 previous_pos = init_positions.copy()
 previous_t = 0
 init_pos_flat = init_positions.flatten()
-velocities = np.zeros((N0, 3)) 
-
-## Solve ODE system:
-solution = solve_ivp(deriv_func, t_span, init_pos_flat, method="RK45")
-
-## Reshape output for saving:
-new_positions = solution.y.reshape(N0, 3, len(solution.t))
-
-## Save to file:
-np.save(f"Magnetic_{beta}_{alpha}_{N0}_{t_span[1]}_output.npy", new_positions)
-print(f"Magnetic_{beta}_{alpha}_{N0}_{t_span[1]}_output.npy saved" )
+velocities = np.zeros(state_shape(ensemble_size, N0))
+accepted_velocities = velocities.copy()  # Implicit mode: velocities at the last accepted step
+velocity_iterations, velocity_unconverged = 0, 0  # Implicit mode: map evaluations, and solves stopped at velocity_max_iter
+parameters = dict(model="Magnetic", N0=N0, R=R, alpha=alpha, beta=beta, t_span=t_span, method=method,
+                  implicit_velocities=implicit_velocities, velocity_tol=velocity_tol, anderson_depth=anderson_depth,
+                  matrix_free=matrix_free, use_split_kernel=use_split_kernel, split_tol=split_tol, theta=theta,
+                  single_precision=single_precision, seeds=seeds)  # Recorded in the telemetry and archive metadata
+telemetry = Telemetry(telemetry_enabled, parameters=parameters)
+precision = np.float32 if single_precision else np.float64  # Pair kernels and stored trajectories
+engine = PairwiseEngine(N0, tile_size, telemetry=telemetry, batch=ensemble_size if ensemble_size > 1 else None,
+                        workers=workers, dtype=precision)
+split_evaluator = SplitBrinkmanEvaluator(alpha, tol=split_tol, theta=theta, engine=engine)
+kernel = brinkman_kernel(alpha)
+
+## Report split-kernel accuracy against the direct sum on the initial positions (mobility applied to unit gravity):
+if use_split_kernel:
+    unit_gravity = np.zeros_like(init_positions)
+    unit_gravity[..., 2] = -1
+    report = error_report(split_evaluator.apply_mobility(init_positions, unit_gravity),
+                          engine.apply_mobility(init_positions, unit_gravity, kernel))
+    print(f"Split kernel (cutoff={split_evaluator.r_c:.3f}, theta={theta}) vs direct sum: "
+          f"max error / max velocity {report['max_error_rel_to_max_velocity']:.2e}, RMS relative error {report['rms_rel_error']:.2e}")
+
+if output_frames is None and (checkpoint_every_t is not None or checkpoint_every_wall is not None or resume):
+    raise ValueError("Checkpoint and resume require streamed output (set output_frames)")
+
+## Solve ODE system, streaming frames to disk (with optional checkpoints) if output_frames is set:
+stem = seeded_stem(f"Magnetic_{beta}_{alpha}_{N0}_{t_span[1]}", seed, ensemble_size)
+metadata = [archive_metadata(parameters, s, precision) for s in seeds] if archive_output else None
+if output_frames is None:
+    solution = solve(deriv_func, t_span, init_pos_flat, method=method,
+                     step_callback=accept_step if implicit_velocities else None)
+    save_members(solution.y, N0, stem, seeds, precision, solution.t, metadata)
+else:
+    checkpointer = Checkpointer(f"{stem}_checkpoint.npz", checkpoint_every_t, checkpoint_every_wall, globals(),
+                                ("progress_index", "velocities", "accepted_velocities", "velocity_iterations",
+                                 "velocity_unconverged"))
+    restart = checkpointer.load() if resume else None
+    writer = TrajectoryWriter(member_filenames(stem, seeds, archive_output), N0,
+                              np.linspace(t_span[0], t_span[1], output_frames), restart, precision, metadata)
+    solution = integrate_to_writer(deriv_func, t_span, init_pos_flat, writer, method=method,
+                                   checkpointer=checkpointer, restart=restart,
+                                   step_callback=accept_step if implicit_velocities else None)
+    writer.close()
+engine.close()  # Shut down the pairwise worker threads
+telemetry.finish(solution, method)
+telemetry.write(f"{stem}_telemetry.jsonl")
 
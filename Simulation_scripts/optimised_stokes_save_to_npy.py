@@ -1,11 +1,40 @@
 import numpy as np
+import sys
 import time
-from scipy.integrate import solve_ivp
+from integrators import solve
+from pairwise_engine import PairwiseEngine
+from treecode import tree_sum, stokeslet_kernel, error_report, theta_for_tolerance
+from telemetry import Telemetry
+from overrides import apply_overrides
+from ensemble import member_seeds, initial_members, state_shape, save_members, member_filenames, seeded_stem
+from trajectory_writer import TrajectoryWriter, integrate_to_writer
+from archive import archive_metadata
+from checkpoint import Checkpointer
 
 ## Assign parameters:
 N0 = 300  # Number of particles
 R = 1  # Radius of initial sphere
 t_span = (0, 1000)  # Simulation time span
+method = "RK45"  # ODE solver: scipy's "RK45" or "DOP853", or built-in "native_RK45" or "native_DOP853" (integrators.py)
+tile_size = 256  # Row-block size for the pairwise engine (peak memory ~ 10 * tile_size * N0 floats)
+workers = 1  # Threads evaluating pairwise row blocks in parallel (results are bit-for-bit identical for any value)
+single_precision = False  # Set True for float32 pairwise kernels and float32 output files (integration stays float64)
+use_treecode = False  # Set True for Barnes-Hut far-field evaluation (O(N log N), approximate)
+theta = 0.3  # Opening angle for the tree code (smaller is more accurate; max relative error ~0.06 * theta^2)
+tree_tol = None  # Target max relative error of each particle's velocity for the tree code (sets theta when given)
+telemetry_enabled = False  # Set True to save run statistics to a _telemetry.jsonl sidecar
+ensemble_size = 1  # Number of independent realisations integrated together (each saved to its own file)
+seed = None  # Random seed (ensemble member b uses seed + b)
+archive_output = False  # Set True to save a self-describing {stem}_archive/ (frame-major positions, times, parameters and seed)
+output_frames = None  # Number of equally spaced frames streamed to disk during the run (None: every solver step, saved at the end)
+checkpoint_every_t = None  # Save a checkpoint every this much simulated time (requires output_frames)
+checkpoint_every_wall = None  # Save a checkpoint every this many seconds of wall time (requires output_frames)
+resume = False  # Set True to continue an interrupted run from its _checkpoint.npz (same parameters)
+
+## Apply parameter overrides from the command line, e.g. "t_span=(0,100) seed=1" (used by sweep.py):
+apply_overrides(globals(), sys.argv[1:])
+if tree_tol is not None:
+    theta = theta_for_tolerance(tree_tol)
 progress_intervals = np.linspace(t_span[0], t_span[1], 101)[1:] # Intervals for progress printing
 
 ## Define initial sphere function:
@@ -22,49 +51,69 @@ def deriv_func(t, r):
 
     global progress_index, start_time
 
+    telemetry.rhs_call(t)
+
     if progress_index < len(progress_intervals) and t >= progress_intervals[progress_index]:
         elapsed_time = time.time() - start_time
         print(f"Progress: {int((t/t_span[1]) * 100)}% complete. Time elapsed: {elapsed_time:.2f} seconds")
         progress_index += 1
-    r = r.reshape(N0, 3) 
-    velocities = np.zeros_like(r)
-
-    r_i = r[:, np.newaxis, :]  
-    r_j = r[np.newaxis, :, :]
-    
-    r_vec = r_i - r_j  
-    r_abs = np.linalg.norm(r_vec, axis=2)  
-    
-    mask = (r_abs > 1e-6)  # Avoid r -> infinity error
-    r_abs[~mask] = 1  
-
-    r_abs3 = r_abs ** 3
-    sum_i = np.zeros_like(r)
-
-    sum_i[:, 0] = np.sum(mask * (-r_vec[:, :, 0] * r_vec[:, :, 2] / r_abs3), axis=1)
-    sum_i[:, 1] = np.sum(mask * (-r_vec[:, :, 1] * r_vec[:, :, 2] / r_abs3), axis=1)
-    sum_i[:, 2] = np.sum(mask * ((-1 / r_abs) - (r_vec[:, :, 2] ** 2) / r_abs3), axis=1)
-
-    velocities = (5 / (8 * N0)) * sum_i  
+        telemetry.checkpoint(t)
+    positions = r.reshape(state_shape(ensemble_size, N0))
+
+    if use_treecode:
+        with telemetry.phase("tree_code"):
+            velocities = (5 / (8 * N0)) * tree_sum(positions, stokeslet_kernel, 3, theta)
+    else:
+        velocities = engine.stokes_velocities(positions, 5 / (8 * N0))
     return velocities.flatten()
 
-## Initialise positions:
-init_positions = initial_sphere(R, N0)
+if use_treecode and ensemble_size > 1:
+    raise ValueError("Ensemble mode requires the direct pairwise engine (use_treecode = False)")
+
+## Initialise positions (one draw per ensemble member):
+seeds = member_seeds(seed, ensemble_size)
+init_positions = initial_members(lambda: initial_sphere(R, N0), seeds)
+
+## Initialise telemetry and pairwise engine (workspace is allocated once and reused by every RHS call):
+parameters = dict(model="Stokes", N0=N0, R=R, t_span=t_span, method=method, use_treecode=use_treecode, theta=theta, tree_tol=tree_tol,
+                  single_precision=single_precision, seeds=seeds)  # Recorded in the telemetry and archive metadata
+telemetry = Telemetry(telemetry_enabled, parameters=parameters)
+precision = np.float32 if single_precision else np.float64  # Pair kernels and stored trajectories
+engine = PairwiseEngine(N0, tile_size, telemetry=telemetry, batch=ensemble_size if ensemble_size > 1 else None,
+                        workers=workers, dtype=precision)
 
 ## Flatten initial positions for ODE solver:
 init_pos_flat = init_positions.flatten()
 
+## Report tree-code accuracy against the direct sum on the initial positions:
+if use_treecode:
+    report = error_report(tree_sum(init_positions, stokeslet_kernel, 3, theta),
+                          engine.stokes_velocities(init_positions, 1.0))
+    print(f"Tree code (theta={theta:.3g}) vs direct sum: max relative error {report['max_pointwise_rel_error']:.2e}, "
+          f"max error / max velocity {report['max_error_rel_to_max_velocity']:.2e}, "
+          f"RMS relative error {report['rms_rel_error']:.2e}")
+
 ## Initialise progress tracking:
 progress_index = 0
 start_time = time.time()
 
-## Solve ODE system:
-solution = solve_ivp(deriv_func, t_span, init_pos_flat, method="RK45")
-
-## Reshape output for saving:
-reshaped = solution.y.reshape(N0, 3, len(solution.t))
+if output_frames is None and (checkpoint_every_t is not None or checkpoint_every_wall is not None or resume):
+    raise ValueError("Checkpoint and resume require streamed output (set output_frames)")
 
-## Save to .npy file:
-output_filename = f"{N0}_{t_span[1]}_output.npy"
-np.save(output_filename, reshaped)
-print(f"3D array saved to {output_filename}")
+## Solve ODE system, streaming frames to disk (with optional checkpoints) if output_frames is set:
+stem = seeded_stem(f"{N0}_{t_span[1]}", seed, ensemble_size)
+metadata = [archive_metadata(parameters, s, precision) for s in seeds] if archive_output else None
+if output_frames is None:
+    solution = solve(deriv_func, t_span, init_pos_flat, method=method)
+    save_members(solution.y, N0, stem, seeds, precision, solution.t, metadata)
+else:
+    checkpointer = Checkpointer(f"{stem}_checkpoint.npz", checkpoint_every_t, checkpoint_every_wall, globals(), ("progress_index",))
+    restart = checkpointer.load() if resume else None
+    writer = TrajectoryWriter(member_filenames(stem, seeds, archive_output), N0,
+                              np.linspace(t_span[0], t_span[1], output_frames), restart, precision, metadata)
+    solution = integrate_to_writer(deriv_func, t_span, init_pos_flat, writer, method=method,
+                                   checkpointer=checkpointer, restart=restart)
+    writer.close()
+engine.close()  # Shut down the pairwise worker threads
+telemetry.finish(solution, method)
+telemetry.write(f"{stem}_telemetry.jsonl")
@@ -0,0 +1,54 @@
+"""
+Command-line parameter overrides for the simulation scripts.
+
+Each script keeps its parameters as globals at the top of the file. Arguments of the
+form name=value (e.g. `python optimised_magnetised_save_to_npy.py beta=10 N0=1000`)
+replace those globals before the run starts, so a grid of runs (see sweep.py) needs
+no edits to the scripts. Values are parsed as Python literals, falling back to plain
+strings (so body_name=Spiral works without quotes).
+
+Only declared parameters may be overridden: the names assigned a literal value at the
+top level of the script before its apply_overrides call (its parameter block). Any
+other global, such as an imported module or a function, is rejected.
+"""
+
+import ast
+
+## Parse a value as a Python literal, or keep it as a string:
+def parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+## Declared parameters of a script and their default values (top-level literal assignments before apply_overrides):
+def script_parameters(script):
+    with open(script) as f:
+        tree = ast.parse(f.read())
+    parameters = {}
+    for node in tree.body:
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and \
+                getattr(node.value.func, "id", None) == "apply_overrides":
+            break
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                parameters[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    return parameters
+
+
+## Replace script globals with name=value arguments (only the script's declared parameters may be overridden):
+def apply_overrides(namespace, args):
+    declared = script_parameters(namespace["__file__"])
+    overrides = {}
+    for arg in args:
+        name, sep, text = arg.partition("=")
+        if not sep:
+            raise ValueError(f"Expected name=value, got {arg!r}")
+        if name not in declared:
+            raise ValueError(f"Unknown parameter {name!r} (parameters: {', '.join(declared)})")
+        overrides[name] = parse_value(text)
+    namespace.update(overrides)
+    return overrides
@@ -0,0 +1,377 @@
+"""
+Tiled pairwise interaction engine, shared by the simulation scripts.
+
+Pairwise sums over j are evaluated for blocks of `tile` rows i at a time, so only
+(tile, N) workspace arrays are ever held in memory (peak memory O(N * tile) rather
+than O(N^2)). All workspace buffers are allocated once, when the engine is created,
+and reused on every call, so a steady-state RHS evaluation allocates no new arrays.
+
+With symmetric=True (the default), each row block only covers columns j > i. Every
+pair term used here (H1, H2 and products of two components of r_ij) is even in r_ij,
+so each unordered pair is evaluated once and its term added to both particles,
+halving the exponentials and divisions per RHS.
+
+With batch=B, positions carry a leading batch axis (B, N, 3): B independent systems
+(e.g. ensemble members) are advanced through the same array operations, with pairs
+formed only within each system.
+
+With workers=W > 1, row blocks are evaluated concurrently by W threads, each with its
+own workspace (NumPy releases the GIL inside its array loops and BLAS calls). Every
+block keeps its own partial sums, which are added up in a fixed block order, so the
+result is bit-for-bit identical for any number of workers. This costs O(N^2 / tile)
+extra memory for the per-block partial sums. Each worker times its phases (pair_geometry,
+kernels, ...) with its own recorder, and these are added to the engine's telemetry after
+every parallel pass, so phase times are then summed over workers (CPU time, which can
+exceed the wall time of the parallel_blocks phase). The thread pool is shut down by
+close(), or on leaving a `with PairwiseEngine(...) as engine:` block.
+
+With dtype=np.float32, pair geometry and kernels are evaluated in single precision,
+halving the workspace and the memory traffic of the bandwidth-bound element-wise
+passes. Differences r_ij are formed from the float64 positions before rounding, pairs
+close enough for the Brinkmanlet's screened and algebraic parts to cancel are kept in
+float64 (see brinkmanlet.py), and all sums over j (including the magnetic
+field's BLAS products) are taken in float64. Results are returned in float64.
+
+Kernels are evaluated over strips of a block's rows of about KERNEL_STRIP_ELEMENTS pairs
+(kernel_rows sets the rows per strip), so that their ~20 element-wise passes over r,
+H1, H2 and the work arrays stay in cache instead of streaming a whole (tile, N) block
+through memory on every pass. Every kernel operation is element-wise, so the result
+is bit-for-bit that of evaluating the whole block at once.
+"""
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from telemetry import NO_TELEMETRY, Telemetry
+
+KERNEL_STRIP_ELEMENTS = 2**15  # Pairs per kernel strip (fastest measured at N0 = 2000: ~12 ns/pair, against ~17 for whole blocks)
+
+
+## Define in-place Stokeslet kernel (H1 = prefactor / r, H2 = prefactor / r^3), as in stokes_velocities:
+def stokes_kernel(prefactor):
+
+    def kernel(r, inv_r, H1_out, H2_out, work):
+        np.multiply(inv_r, prefactor, out=H1_out)
+        np.multiply(inv_r, inv_r, out=H2_out)
+        H2_out *= H1_out
+
+    return kernel
+
+
+## Apply per-particle mobility row sums (h1, s_xx, s_xy, s_xz, s_yy, s_yz, s_zz) to the forces F_i:
+def contract_mobility_sums(sums, F, out):
+    h1, s_xx, s_xy, s_xz, s_yy, s_yz, s_zz = sums
+    F_x, F_y, F_z = F[..., 0], F[..., 1], F[..., 2]
+    out[..., 0] = (h1 + s_xx) * F_x + s_xy * F_y + s_xz * F_z
+    out[..., 1] = s_xy * F_x + (h1 + s_yy) * F_y + s_yz * F_z
+    out[..., 2] = s_xz * F_x + s_yz * F_y + (h1 + s_zz) * F_z
+    return out
+
+
+## Define per-worker block workspace (flat buffers, viewed as contiguous (n, m) blocks):
+class BlockWorkspace:
+
+    def __init__(self, N, tile, lead, dtype=np.float64):
+        self.N, self.lead = N, lead
+        size = int(np.prod(lead, dtype=np.int64)) * tile * N
+        self.dx, self.dy, self.dz = np.empty(size, dtype), np.empty(size, dtype), np.empty(size, dtype)
+        self.r, self.inv_r = np.empty(size, dtype), np.empty(size, dtype)
+        self.H1, self.H2, self.prod = np.empty(size, dtype), np.empty(size, dtype), np.empty(size, dtype)
+        self.work = (np.empty(size, dtype), np.empty(size, dtype), np.empty(size, dtype))
+        self.mask, self.not_mask = np.empty(size, dtype=bool), np.empty(size, dtype=bool)
+        self.wide = None if dtype == np.float64 else np.empty(size)  # Double-precision copy of the field weights
+
+    def view(self, buf, n, m):
+        shape = self.lead + (n, m)
+        return buf[:int(np.prod(shape))].reshape(shape)
+
+
+## Define storage for one block's partial sums (rows i0:i1 and, by symmetry, columns j0:N), always float64:
+class BlockPartials:
+
+    def __init__(self, n, m, lead, K=7):
+        self.rows, self.cols = np.empty((K,) + lead + (n,)), np.empty((K,) + lead + (m,))
+        self.field_rows, self.field_cols = np.empty(lead + (n, 6)), np.empty(lead + (m, 6))  # Magnetic field sums
+
+
+## Define tiled pairwise engine with preallocated workspace:
+class PairwiseEngine:
+
+    def __init__(self, N, tile=256, cutoff=1e-6, symmetric=True, telemetry=NO_TELEMETRY, batch=None, workers=1,
+                 dtype=np.float64, kernel_rows=None):
+        self.N = N
+        self.dtype = np.dtype(dtype)  # Precision of the pair terms (sums and outputs are always float64)
+        self.lead = () if batch is None else (batch,)  # Leading batch axis of positions, if any
+        self.telemetry = telemetry  # Per-phase timing (pair_geometry, kernels, force, contraction)
+        self.tile = max(1, min(tile, N))
+        self.cutoff = cutoff  # Pairs closer than this are excluded (avoids r -> 0 error)
+        self.symmetric = symmetric  # Evaluate each unordered pair once (upper triangle j > i)
+        self.upper = np.triu(np.ones((self.tile, self.tile), dtype=bool), k=1)
+        self.workers = max(1, workers)  # Threads evaluating row blocks concurrently
+        self.kernel_rows = kernel_rows  # Rows per kernel strip (None: about KERNEL_STRIP_ELEMENTS pairs per strip)
+
+        self.out = np.empty(self.lead + (N, 3))
+        self.sums = np.empty((7,) + self.lead + (N,))  # Row sums of H1 and of the six H2 * r_ij r_ij^T components
+        self.vc, self.field_sum = np.empty(self.lead + (N, 6)), np.empty(self.lead + (N, 6))  # Magnetic field sums
+
+        # One workspace per worker. Serially, the partial sums of each block are added to the totals
+        # as soon as it is done; in parallel, every block keeps its own partial sums and they are
+        # added in block order afterwards, so results are bit-for-bit those of the serial engine.
+        self.workspaces = [BlockWorkspace(N, self.tile, self.lead, dtype) for _ in range(self.workers)]
+        if self.workers == 1:
+            self.pool = None
+            self.partials = [BlockPartials(self.tile, N, self.lead)]
+        else:
+            self.pool = ThreadPoolExecutor(self.workers)
+            self.free = queue.SimpleQueue()
+            for ws in self.workspaces:
+                ws.telemetry = Telemetry(telemetry.enabled)  # Phase times of the worker using this workspace
+                self.free.put(ws)
+            self.partials = [BlockPartials(i1 - i0, (self.N - j0) if symmetric else 0, self.lead)
+                             for i0, i1, j0 in self.blocks()]
+
+    ## Shut down the worker threads (the engine cannot be used afterwards if workers > 1):
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ## Yield blocks (i0, i1, j0): rows i0:i1 against columns j0:N (j0 = i0 when exploiting pair symmetry):
+    def blocks(self):
+        for i0 in range(0, self.N, self.tile):
+            i1 = min(i0 + self.tile, self.N)
+            yield i0, i1, (i0 if self.symmetric else 0)
+
+    ## Fill r_ij, |r_ij|, 1/|r_ij| and the pair mask for the block (returns views into the workspace):
+    def block_geometry(self, ws, positions, i0, i1, j0):
+        n, m = i1 - i0, self.N - j0
+        positions = positions.reshape(self.lead + (self.N, 3))
+        dx, dy, dz = ws.view(ws.dx, n, m), ws.view(ws.dy, n, m), ws.view(ws.dz, n, m)
+        r, inv_r, tmp = ws.view(ws.r, n, m), ws.view(ws.inv_r, n, m), ws.view(ws.prod, n, m)
+        mask, not_mask = ws.view(ws.mask, n, m), ws.view(ws.not_mask, n, m)
+
+        np.subtract(positions[..., i0:i1, None, 0], positions[..., None, j0:, 0], out=dx)
+        np.subtract(positions[..., i0:i1, None, 1], positions[..., None, j0:, 1], out=dy)
+        np.subtract(positions[..., i0:i1, None, 2], positions[..., None, j0:, 2], out=dz)
+
+        np.multiply(dx, dx, out=r)
+        np.multiply(dy, dy, out=tmp)
+        r += tmp
+        np.multiply(dz, dz, out=tmp)
+        r += tmp
+        np.sqrt(r, out=r)
+
+        np.greater(r, self.cutoff, out=mask)
+        if self.symmetric:
+            mask[..., :n] &= self.upper[:n, :n]  # Keep j > i only in the diagonal block
+        np.logical_not(mask, out=not_mask)
+        np.copyto(r, 1.0, where=not_mask)  # Safe value for excluded pairs
+        np.divide(1.0, r, out=inv_r)
+
+        return dx, dy, dz, r, inv_r, mask
+
+    ## Evaluate H1 and H2 for the block, with excluded pairs set to zero (the kernel may overwrite r and inv_r),
+    ## one contiguous strip of kernel_rows rows at a time, reusing the start of the work buffers for every strip:
+    def block_kernel(self, ws, kernel, r, inv_r, mask):
+        n, m = r.shape[-2:]
+        H1, H2 = ws.view(ws.H1, n, m), ws.view(ws.H2, n, m)
+        strip = self.kernel_rows or max(1, KERNEL_STRIP_ELEMENTS // m)
+        for index in np.ndindex(self.lead):
+            for a in range(0, n, strip):
+                rows = index + (slice(a, a + strip),)
+                k = min(strip, n - a)
+                kernel(r[rows], inv_r[rows], H1[rows], H2[rows], tuple(w[:k * m].reshape(k, m) for w in ws.work))
+                H1[rows] *= mask[rows]
+                H2[rows] *= mask[rows]
+        return H1, H2
+
+    ## Sum the pair terms of the block into partial sum k, for particle i and, by symmetry, for particle j:
+    def reduce(self, prod, part, k):
+        n, m = prod.shape[-2:]
+        np.sum(prod, axis=-1, dtype=np.float64, out=part.rows[k][..., :n])
+        if self.symmetric:
+            np.sum(prod, axis=-2, dtype=np.float64, out=part.cols[k][..., :m])
+
+    ## Add a block's partial sums to the destinations (..., N) (and to the field sums, if given):
+    def flush(self, part, dests, field_sum, i0, i1, j0):
+        n, m = i1 - i0, self.N - j0
+        for k, dest in enumerate(dests):
+            dest[..., i0:i1] += part.rows[k][..., :n]
+            if self.symmetric:
+                dest[..., j0:] += part.cols[k][..., :m]
+        if field_sum is not None:
+            field_sum[..., i0:i1, :] += part.field_rows[..., :n, :]
+            if self.symmetric:
+                field_sum[..., j0:, :] += part.field_cols[..., :m, :]
+
+    ## Evaluate block_fn(ws, part, i0, i1, j0, phase) over all blocks and add up the partial sums:
+    def run_blocks(self, block_fn, dests, field_sum=None):
+        if self.pool is None:
+            ws, part, phase = self.workspaces[0], self.partials[0], self.telemetry.phase
+            for i0, i1, j0 in self.blocks():
+                block_fn(ws, part, i0, i1, j0, phase)
+                self.flush(part, dests, field_sum, i0, i1, j0)
+            return
+
+        def task(b, block):
+            ws = self.free.get()
+            try:
+                block_fn(ws, self.partials[b], *block, ws.telemetry.phase)
+            finally:
+                self.free.put(ws)
+
+        blocks = list(self.blocks())
+        with self.telemetry.phase("parallel_blocks"):
+            for future in [self.pool.submit(task, b, block) for b, block in enumerate(blocks)]:
+                future.result()
+        for ws in self.workspaces:
+            self.telemetry.merge_phases(ws.telemetry)
+        with self.telemetry.phase("reduction"):
+            for part, (i0, i1, j0) in zip(self.partials, blocks):
+                self.flush(part, dests, field_sum, i0, i1, j0)
+
+    ## Stokeslet velocities of a cloud falling under unit gravity:
+    def stokes_velocities(self, positions, prefactor):
+        def block_fn(ws, part, i0, i1, j0, phase):
+            with phase("pair_geometry"):
+                dx, dy, dz, r, inv_r, mask = self.block_geometry(ws, positions, i0, i1, j0)
+            prod, inv_r3 = ws.view(ws.prod, *r.shape[-2:]), ws.view(ws.work[0], *r.shape[-2:])
+
+            with phase("kernels"):
+                inv_r *= mask
+                np.multiply(inv_r, inv_r, out=inv_r3)
+                inv_r3 *= inv_r
+
+            with phase("contraction"):
+                np.multiply(dx, dz, out=prod)
+                prod *= inv_r3
+                self.reduce(prod, part, 0)
+                np.multiply(dy, dz, out=prod)
+                prod *= inv_r3
+                self.reduce(prod, part, 1)
+                np.multiply(dz, dz, out=prod)
+                prod *= inv_r3
+                prod += inv_r
+                self.reduce(prod, part, 2)
+
+        out = self.out
+        out[:] = 0
+        self.run_blocks(block_fn, (out[..., 0], out[..., 1], out[..., 2]))
+        out *= -prefactor
+        return out
+
+    ## Brinkmanlet velocities of a cloud falling under unit gravity:
+    def brinkman_velocities(self, positions, kernel):
+        def block_fn(ws, part, i0, i1, j0, phase):
+            with phase("pair_geometry"):
+                dx, dy, dz, r, inv_r, mask = self.block_geometry(ws, positions, i0, i1, j0)
+            with phase("kernels"):
+                H1, H2 = self.block_kernel(ws, kernel, r, inv_r, mask)
+            prod = ws.view(ws.prod, *r.shape[-2:])
+
+            with phase("contraction"):
+                np.multiply(dx, dz, out=prod)
+                prod *= H2
+                self.reduce(prod, part, 0)
+                np.multiply(dy, dz, out=prod)
+                prod *= H2
+                self.reduce(prod, part, 1)
+                np.multiply(dz, dz, out=prod)
+                prod *= H2
+                prod += H1
+                self.reduce(prod, part, 2)
+
+        out = self.out
+        out[:] = 0
+        self.run_blocks(block_fn, (out[..., 0], out[..., 1], out[..., 2]))
+        np.negative(out, out=out)
+        return out
+
+    ## Per-particle sums of H1 and H2 r_ij r_ij^T (and, optionally, the magnetic field sum) in one pass:
+    def mobility_sums(self, positions, kernel, velocities=None, field_cutoff=1e-2):
+        sums = self.sums
+        sums[:] = 0
+        field_sum, centred = self.start_field(positions, velocities)
+
+        def block_fn(ws, part, i0, i1, j0, phase):
+            with phase("pair_geometry"):
+                dx, dy, dz, r, inv_r, mask = self.block_geometry(ws, positions, i0, i1, j0)
+            n, m = r.shape[-2:]
+            prod, H2_r = ws.view(ws.prod, n, m), ws.view(ws.work[0], n, m)
+
+            if velocities is not None:
+                with phase("force"):
+                    self.block_field(ws, part, r, inv_r, mask, i0, i1, j0, field_cutoff)
+            with phase("kernels"):
+                H1, H2 = self.block_kernel(ws, kernel, r, inv_r, mask)
+            with phase("contraction"):
+                self.reduce(H1, part, 0)
+                for a, components in ((dx, ((1, dx), (2, dy), (3, dz))), (dy, ((4, dy), (5, dz))), (dz, ((6, dz),))):
+                    np.multiply(H2, a, out=H2_r)
+                    for k, b in components:
+                        np.multiply(H2_r, b, out=prod)
+                        self.reduce(prod, part, k)
+
+        self.run_blocks(block_fn, sums, field_sum)
+
+        if velocities is None:
+            return sums, None
+        return sums, self.finish_field(centred)
+
+    ## Magnetic field sum alone (as returned by mobility_sums), e.g. for new velocities at the same positions:
+    def magnetic_field(self, positions, velocities, field_cutoff=1e-2):
+        field_sum, centred = self.start_field(positions, velocities)
+
+        def block_fn(ws, part, i0, i1, j0, phase):
+            with phase("pair_geometry"):
+                _, _, _, r, inv_r, mask = self.block_geometry(ws, positions, i0, i1, j0)
+            with phase("force"):
+                self.block_field(ws, part, r, inv_r, mask, i0, i1, j0, field_cutoff)
+
+        self.run_blocks(block_fn, (), field_sum)
+        return self.finish_field(centred)
+
+    # field_i = sum_j W_ij (v_j x r_ij), with W_ij = 1/r_ij^2 for r_ij > field_cutoff, is accumulated from the
+    # pair geometry. Since r_ij = x_i - x_j, this regroups as (W V)_i x x_i - (W C)_i with C_j = v_j x x_j,
+    # i.e. one (n, m) @ (m, 6) BLAS product per block.
+    def start_field(self, positions, velocities):
+        if velocities is None:
+            return None, None
+        centred = positions - positions.mean(axis=-2, keepdims=True)  # Reduces cancellation in the regrouped cross products
+        self.vc[..., :3] = velocities
+        self.vc[..., 3:] = np.cross(velocities, centred)
+        self.field_sum[:] = 0
+        return self.field_sum, centred
+
+    def block_field(self, ws, part, r, inv_r, mask, i0, i1, j0, field_cutoff):
+        n, m = r.shape[-2:]
+        vc, prod = self.vc, ws.view(ws.prod, n, m)
+        field_mask = ws.view(ws.not_mask, n, m)
+        np.greater(r, field_cutoff, out=field_mask)
+        field_mask &= mask
+        np.multiply(inv_r, inv_r, out=prod)
+        prod *= field_mask
+        weights = prod
+        if ws.wide is not None:
+            # The regrouped field cancels strongly, so its products are always taken in float64
+            weights = ws.view(ws.wide, n, m)
+            np.copyto(weights, prod)
+        np.matmul(weights, vc[..., j0:, :], out=part.field_rows[..., :n, :])
+        if self.symmetric:
+            np.matmul(np.swapaxes(weights, -1, -2), vc[..., i0:i1, :], out=part.field_cols[..., :m, :])
+
+    def finish_field(self, centred):
+        return np.cross(self.field_sum[..., :3], centred) - self.field_sum[..., 3:]
+
+    ## Matrix-free mobility application (same contraction as np.einsum('uhij,ih->iu', mobility_matrix, F)):
+    def apply_mobility(self, positions, F, kernel):
+        # u_i = sum_j [H1(r_ij) I + H2(r_ij) r_ij r_ij^T] . F_i, without building the (3,3,N,N) tensor:
+        # per block, only the sums of H1 and of the six components of H2 r_ij r_ij^T are formed.
+        sums, _ = self.mobility_sums(positions, kernel)
+        with self.telemetry.phase("contraction"):
+            return contract_mobility_sums(sums, F, self.out)
@@ -0,0 +1,109 @@
+"""
+Accuracy report for the single-precision mode (single_precision = True in the scripts).
+
+For frames (first, middle, last) of the saved outputs in npy_output_files/, the float32
+pairwise engine is compared with the float64 reference at the same positions:
+
+- Stokes / Brinkman: cloud velocities under unit gravity,
+- magnetised: mobility applied to unit gravity, and the magnetic field sum (with the
+  float64 gravity velocities as particle velocities),
+- articulated body: regularised mobility applied to unit gravity.
+
+The relative errors are those of treecode.error_report (largest error / largest velocity,
+and RMS). Storage error is the largest change in a position when the frame is stored as
+float32, relative to the cloud's extent.
+
+These are per-evaluation errors. The cloud dynamics amplify any perturbation, rounding
+included, so particle positions late in a long float32 run drift away from the float64
+run's (as they already do between float64 runs with different tile sizes); compare
+statistics, such as the spread analysis, rather than individual particles.
+
+Run from the repository root:
+
+    python Simulation_scripts/precision_report.py --csv precision_report.csv
+"""
+
+import argparse
+import glob
+import os
+import numpy as np
+from pairwise_engine import PairwiseEngine, contract_mobility_sums
+from brinkmanlet import brinkman_kernel, regularised_brinkman_kernel
+from treecode import error_report
+from archive import parse_output_name
+
+## Quantities compared for one frame, as {label: (N, 3) array}, from an engine of the given precision:
+def frame_quantities(model, parameters, positions, dtype):
+    N = positions.shape[0]
+    engine = PairwiseEngine(N, dtype=dtype)
+    gravity = np.zeros_like(positions)
+    gravity[:, 2] = -1
+
+    if model == "Stokes":
+        return {"velocity": engine.stokes_velocities(positions, 5 / (8 * N)).copy()}
+    if model == "Brinkman":
+        return {"velocity": engine.brinkman_velocities(positions, brinkman_kernel(parameters["alpha"])).copy()}
+    if "delta" in parameters:  # Articulated body (named after its body, e.g. "Stickman")
+        kernel = regularised_brinkman_kernel(parameters["alpha"], parameters["delta"])
+        return {"velocity": engine.apply_mobility(positions, gravity, kernel).copy()}
+
+    kernel = brinkman_kernel(parameters["alpha"])
+    reference = PairwiseEngine(N).apply_mobility(positions, gravity, kernel).copy()
+    sums, field = engine.mobility_sums(positions, kernel, reference)
+    return {"velocity": contract_mobility_sums(sums, gravity, np.empty_like(gravity)), "field": field.copy()}
+
+
+## Bytes held by a pairwise engine workspace:
+def workspace_bytes(ws):
+    arrays = [a for a in vars(ws).values() if isinstance(a, np.ndarray)] + list(ws.work)
+    return sum(a.nbytes for a in arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare float32 and float64 pairwise kernels on saved outputs.")
+    parser.add_argument("--directory", default="npy_output_files")
+    parser.add_argument("--max-particles", type=int, default=2000, help="Skip outputs with more particles")
+    parser.add_argument("--csv", default=None, help="Also save the report to this CSV file")
+    args = parser.parse_args()
+
+    rows = []
+    for filename in sorted(glob.glob(os.path.join(args.directory, "*_output.npy"))):
+        model, parameters = parse_output_name(filename)
+        try:
+            trajectory = np.load(filename, mmap_mode="r")
+        except ValueError:
+            continue  # Placeholder files
+        if model is None or trajectory.ndim != 3 or not 1 < trajectory.shape[0] <= args.max_particles:
+            continue
+
+        T = trajectory.shape[-1]
+        for frame in sorted({0, T // 2, T - 1}):
+            positions = np.array(trajectory[:, :, frame], dtype=np.float64)
+            extent = np.abs(positions - positions.mean(axis=0)).max()
+            storage_error = np.abs(positions.astype(np.float32) - positions).max() / extent
+            single = frame_quantities(model, parameters, positions, np.float32)
+            double = frame_quantities(model, parameters, positions, np.float64)
+            for label in double:
+                report = error_report(single[label], double[label])
+                rows.append((os.path.basename(filename), frame, label, report["max_error_rel_to_max_velocity"],
+                             report["rms_rel_error"], storage_error))
+
+    print(f"{'file':<40} {'frame':>5} {'quantity':<9} {'max err/max':>11} {'rms rel err':>11} {'storage err':>11}")
+    for name, frame, label, max_err, rms_err, storage_error in rows:
+        print(f"{name:<40} {frame:>5} {label:<9} {max_err:>11.2e} {rms_err:>11.2e} {storage_error:>11.2e}")
+    errors = np.array([row[3] for row in rows])
+    print(f"\n{len(rows)} comparisons: median max error / max value {np.median(errors):.2e}, worst {errors.max():.2e}")
+
+    bytes64, bytes32 = (workspace_bytes(PairwiseEngine(2000, dtype=dtype).workspaces[0]) for dtype in (np.float64, np.float32))
+    print(f"Pairwise workspace at N0 = 2000 (tile 256): {bytes64 / 2**20:.1f} MiB in float64, {bytes32 / 2**20:.1f} MiB in float32")
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write("file,frame,quantity,max_error_rel_to_max_velocity,rms_rel_error,storage_rel_error\n")
+            for row in rows:
+                f.write(",".join(str(v) for v in row) + "\n")
+        print(f"Report saved to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
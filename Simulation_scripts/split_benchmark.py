@@ -0,0 +1,81 @@
+"""
+Timing and accuracy of the split-kernel Brinkmanlet evaluator (split_kernel.py) against
+the direct pairwise engine, to find the cloud size at which the split starts to win.
+
+For each alpha and N0, a uniform sphere of N0 particles and radius R is drawn, and the
+mobility is applied to unit gravity (as in the magnetised and articulated-body
+scripts) by PairwiseEngine.apply_mobility and by SplitBrinkmanEvaluator.apply_mobility.
+The table gives the best time of each, the body's extent in cutoffs (below
+MIN_EXTENT_CUTOFFS the evaluator sums directly, marked "direct"), and the errors of the
+split against the direct sum, as in treecode.error_report: largest error / largest
+velocity, and RMS. (Per-particle relative errors are not shown: particles with no
+neighbour within the cutoff barely move, so theirs can be large.)
+
+Run from the repository root:
+
+    python Simulation_scripts/split_benchmark.py --alpha 50 100 --N0 2000 5000 10000 20000
+"""
+
+import argparse
+import time
+import warnings
+import numpy as np
+from pairwise_engine import PairwiseEngine
+from brinkmanlet import brinkman_kernel
+from split_kernel import MIN_EXTENT_CUTOFFS, SplitBrinkmanEvaluator
+from treecode import error_report
+
+## Best time (seconds) of f over a few calls:
+def best_time(f, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+## Uniform sphere of N points and radius R:
+def uniform_sphere(N, R, rng):
+    directions = rng.normal(size=(N, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return R * directions * rng.uniform(size=(N, 1)) ** (1 / 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the split-kernel evaluator against the direct pairwise engine.")
+    parser.add_argument("--N0", type=int, nargs="+", default=[2000, 5000, 10000, 20000])
+    parser.add_argument("--alpha", type=float, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--R", type=float, default=1, help="Radius of the sphere (as in the simulation scripts)")
+    parser.add_argument("--split-tol", type=float, default=1e-6, help="Tolerance on the screened part")
+    parser.add_argument("--theta", type=float, default=0.3, help="Opening angle of the far-field tree code")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Uniform sphere of radius {args.R}, split_tol {args.split_tol:g}, theta {args.theta:g}")
+    print(f"{'alpha':>7} {'cutoff':>7} {'N0':>7} {'cutoffs across':>15} {'direct s':>9} {'split s':>9} {'speedup':>8} "
+          f"{'max err/max':>12} {'rms err':>9}")
+    for alpha in args.alpha:
+        kernel = brinkman_kernel(alpha)
+        for N0 in args.N0:
+            positions = uniform_sphere(N0, args.R, rng)
+            gravity = np.zeros_like(positions)
+            gravity[:, 2] = -1
+            engine = PairwiseEngine(N0)
+            split = SplitBrinkmanEvaluator(alpha, tol=args.split_tol, theta=args.theta, engine=PairwiseEngine(N0))
+            across = np.ptp(positions, axis=0).max() / split.r_c
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # The fallback is marked in the table instead
+                direct_time = best_time(lambda: engine.apply_mobility(positions, gravity, kernel), args.repeats)
+                split_time = best_time(lambda: split.apply_mobility(positions, gravity), args.repeats)
+                report = error_report(split.apply_mobility(positions, gravity), engine.apply_mobility(positions, gravity, kernel))
+            label = f"{across:.1f}" + (" (direct)" if across < MIN_EXTENT_CUTOFFS else "")
+            print(f"{alpha:>7g} {split.r_c:>7.3f} {N0:>7} {label:>15} {direct_time:>9.2f} {split_time:>9.2f} "
+                  f"{direct_time / split_time:>7.2f}x {report['max_error_rel_to_max_velocity']:>12.1e} {report['rms_rel_error']:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
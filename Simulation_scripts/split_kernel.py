@@ -0,0 +1,182 @@
+"""
+Split-kernel Brinkmanlet evaluator.
+
+H1 and H2 are split into a screened part, proportional to exp(-alpha*R), and an
+algebraic remainder, -1/(4 pi alpha^2 R^3) and 3/(4 pi alpha^2 R^5) (with
+R = sqrt(r^2 + delta^2), and delta = 0 for the singular Brinkmanlet). The cutoff
+r_c = x_c / alpha is where the screened-to-algebraic ratio exp(-x) (x^2 + 3x + 3) / 3
+(x = alpha*r) falls below the tolerance `tol`:
+
+- Pairs closer than r_c are summed exactly, with the full kernel. At short range the
+  two parts nearly cancel, so they are never approximated separately there. Particles
+  are sorted into cells of side r_c, and each run of rows of one (x, y) column of cells
+  is evaluated as one dense block against its 9 neighbouring columns (over one cell
+  beyond its z range), with the same in-place kernels as the pairwise engine.
+- Pairs at least r_c apart only see the algebraic part, which is summed with the
+  Barnes-Hut tree code (nodes straddling the cutoff are opened).
+
+Bodies fewer than MIN_EXTENT_CUTOFFS cutoffs across have (nearly) every pair in the near
+field, so the split would only add overhead: they are summed exactly with a direct
+PairwiseEngine (the script's, if given as `engine`) instead, with a warning.
+
+The split only pays off for large, strongly screened clouds. Measured with
+split_benchmark.py on a uniform sphere of radius 1 (split_tol = 1e-6, theta = 0.3, one
+thread), the split is slower than the direct engine below about N0 = 8000, and 1.3x
+faster at N0 = 10^4 and 2-2.5x at N0 = 20000, for alpha = 100-200 (cutoffs 0.19-0.09);
+at alpha = 50 (cutoff 0.38) it is still 0.9x at N0 = 20000, and below alpha = 40 the
+cloud is under 4 cutoffs across and is summed directly. Most of the time is then spent
+in the far-field tree.
+
+Far-field error: the near field is exact, so all the error comes from the monopole
+approximation of the algebraic part, c grad grad (1/r) with c = 1/(4 pi alpha^2), whose
+terms fall off as 1/r^3 (the nearest accepted node is at least r_c away). Measured
+against the direct sum, the largest error is 0.6-5e-4 of the largest velocity, and the
+RMS error 0.5-2.2e-3 of the RMS velocity, at theta = 0.3 (for alpha = 50-200 and
+N0 = 2000-20000; RMS ~2.6e-3 at theta = 0.5 and ~5e-3 at 0.7). Particles with no neighbour within r_c barely move, so
+their own relative error can be large. The scripts print this comparison at start-up.
+
+Both paths return the seven per-particle row sums (h1, s_xx, s_xy, s_xz, s_yy, s_yz,
+s_zz) of H1 and H2 * r_ij r_ij^T, which are then applied to the forces exactly as
+in PairwiseEngine.apply_mobility.
+"""
+
+import numpy as np
+import warnings
+from scipy.optimize import brentq
+from pairwise_engine import PairwiseEngine, contract_mobility_sums
+from brinkmanlet import brinkman_kernel, regularised_brinkman_kernel
+from treecode import Octree, concat_ranges
+
+MIN_EXTENT_CUTOFFS = 4  # Bodies fewer than this many cutoffs across are summed directly with the pairwise engine
+
+## Define screened cutoff from alpha and tolerance:
+def screened_cutoff(alpha, tol):
+    ratio = lambda x: np.exp(-x) * (x**2 + 3*x + 3) / 3 - tol
+    return brentq(ratio, 0.0, 1000.0) / alpha
+
+
+## Define row-sum components of a pair term (H1, H2 * r r^T) for separations d:
+def _tensor_components(d, H1_vals, H2_vals):
+    vals = np.empty((d.shape[0], 7))
+    vals[:, 0] = H1_vals
+    vals[:, 1] = H2_vals * d[:, 0] * d[:, 0]
+    vals[:, 2] = H2_vals * d[:, 0] * d[:, 1]
+    vals[:, 3] = H2_vals * d[:, 0] * d[:, 2]
+    vals[:, 4] = H2_vals * d[:, 1] * d[:, 1]
+    vals[:, 5] = H2_vals * d[:, 1] * d[:, 2]
+    vals[:, 6] = H2_vals * d[:, 2] * d[:, 2]
+    return vals
+
+
+## Define near-field blocks over cell-sorted particles (cell index (cx, cy, cz), sorted by cell id):
+# Each block is a run of at most block_rows rows of one (cx, cy) column of cells; its columns are the
+# runs of the 9 neighbouring (cx, cy) columns from one cell below its z range to one cell above, each of
+# which is contiguous in the sorted order. Returns the row ranges (a, b) and column ranges (start, end), (blocks, 9).
+def near_field_blocks(cells, dims, block_rows):
+    N = cells.shape[0]
+    sorted_id = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    column = cells[:, 0] * dims[1] + cells[:, 1]
+    boundaries = np.flatnonzero(column[1:] != column[:-1]) + 1
+    col_start = np.concatenate([[0], boundaries])
+    col_end = np.concatenate([boundaries, [N]])
+
+    runs = -(-(col_end - col_start) // block_rows)
+    a = np.repeat(col_start, runs) + block_rows * concat_ranges(np.zeros_like(runs), runs)
+    b = np.minimum(a + block_rows, np.repeat(col_end, runs))
+
+    cx, cy = cells[a, 0], cells[a, 1]
+    z_lo = np.maximum(cells[a, 2] - 1, 0)
+    z_hi = np.minimum(cells[b - 1, 2] + 1, dims[2] - 1)
+    starts, ends = np.zeros((len(a), 9), dtype=np.int64), np.zeros((len(a), 9), dtype=np.int64)
+    for k, (i, j) in enumerate(np.ndindex(3, 3)):
+        nx, ny = cx + i - 1, cy + j - 1
+        inside = (nx >= 0) & (nx < dims[0]) & (ny >= 0) & (ny < dims[1])
+        base = (nx * dims[1] + ny) * dims[2]
+        starts[:, k] = np.searchsorted(sorted_id, base + z_lo, side="left")
+        ends[:, k] = np.where(inside, np.searchsorted(sorted_id, base + z_hi, side="right"), starts[:, k])
+    return a, b, starts, ends
+
+
+## Define split-kernel evaluator:
+class SplitBrinkmanEvaluator:
+
+    def __init__(self, alpha, delta=0.0, tol=1e-6, theta=0.3, leaf_size=16, block_rows=32, cutoff=1e-6, engine=None):
+        self.alpha, self.delta = alpha, delta
+        self.tol, self.theta, self.leaf_size, self.block_rows = tol, theta, leaf_size, block_rows
+        self.cutoff = cutoff  # Pairs closer than this are excluded (avoids r -> 0 error)
+        self.r_c = screened_cutoff(alpha, tol)
+        self.kernel = regularised_brinkman_kernel(alpha, delta) if delta > 0 else brinkman_kernel(alpha)
+        self.engine = engine  # Direct pairwise engine for bodies too small to split (created when first needed)
+
+    ## Algebraic parts of H1 and H2 (with regularisation, if delta > 0):
+    def algebraic(self, r):
+        alpha, delta = self.alpha, self.delta
+        R2 = r**2 + delta**2
+        inv_R3 = R2**-1.5
+        H2_vals = 3 / (4 * np.pi * alpha**2) * inv_R3 / R2
+        H1_vals = -1 / (4 * np.pi * alpha**2) * inv_R3 + delta**2 * H2_vals
+        return H1_vals, H2_vals
+
+    def _algebraic_kernel(self, d, r):
+        return _tensor_components(d, *self.algebraic(r))
+
+    ## Row sums (7, n) of the full kernel over one near-field block, for pairs closer than r_c:
+    def _block_sums(self, rows, cols):
+        dx, dy, dz = (rows[:, None, c] - cols[None, :, c] for c in range(3))
+        r = np.sqrt(dx * dx + dy * dy + dz * dz)
+        mask = (r > self.cutoff) & (r < self.r_c)
+        r[~mask] = 1.0  # Safe value for excluded pairs
+        H1, H2 = np.empty_like(r), np.empty_like(r)
+        self.kernel(r, 1 / r, H1, H2, (np.empty_like(r), np.empty_like(r), np.empty_like(r)))
+        H1 *= mask
+        H2 *= mask
+
+        sums = np.empty((7, rows.shape[0]))
+        sums[0] = H1.sum(axis=1)
+        k = 1
+        for a, others in ((dx, (dx, dy, dz)), (dy, (dy, dz)), (dz, (dz,))):
+            H2_a = H2 * a
+            for b in others:
+                sums[k] = np.einsum("ij,ij->i", H2_a, b)
+                k += 1
+        return sums
+
+    ## Per-particle row sums (7, N) of H1 and H2 * r_ij r_ij^T:
+    def sums(self, positions):
+        N = positions.shape[0]
+        lo = positions.min(axis=0)
+        extent = (positions.max(axis=0) - lo).max()
+        if extent < MIN_EXTENT_CUTOFFS * self.r_c:
+            # Nearly every pair is in the near field, so the split would only add overhead
+            warnings.warn(f"Body is {extent / self.r_c:.1f} cutoffs across (fewer than {MIN_EXTENT_CUTOFFS}): "
+                          "summing directly with the pairwise engine instead of splitting the kernel")
+            if self.engine is None or self.engine.N != N:
+                self.engine = PairwiseEngine(N)
+            return self.engine.mobility_sums(positions, self.kernel)[0].copy()
+
+        # Near field: full kernel over dense blocks of neighbouring cells, in cell-sorted order
+        cells = np.floor((positions - lo) / self.r_c).astype(np.int64)
+        dims = cells.max(axis=0) + 1
+        order = np.argsort((cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2], kind="stable")
+        sorted_positions = positions[order]
+        near = np.empty((7, N))
+        for a, b, starts, ends in zip(*near_field_blocks(cells[order], dims, self.block_rows)):
+            cols = sorted_positions[concat_ranges(starts, ends - starts)]
+            near[:, a:b] = self._block_sums(sorted_positions[a:b], cols)
+        sums = np.empty((7, N))
+        sums[:, order] = near
+
+        # Far field: algebraic part over pairs beyond the cutoff, with the tree code
+        tree = Octree(positions, self.leaf_size)
+        sums += tree.evaluate(positions, self._algebraic_kernel, 7, self.theta, r_min=self.r_c).T
+        return sums
+
+    ## Mobility application (same contraction as PairwiseEngine.apply_mobility):
+    def apply_mobility(self, positions, F):
+        return contract_mobility_sums(self.sums(positions), F, np.empty_like(F))
+
+    ## Velocities of a cloud falling under unit gravity:
+    def cloud_velocities(self, positions):
+        gravity = np.zeros_like(positions)
+        gravity[:, 2] = -1
+        return self.apply_mobility(positions, gravity)
@@ -0,0 +1,84 @@
+"""
+Vectorised spring networks for articulated bodies.
+
+Connectivity is stored as edge-index arrays (i, j) together with a sparse (N, E)
+incidence matrix D, with D[i, e] = +1 and D[j, e] = -1 for spring e = (i, j). All
+spring forces are computed in one vectorised pass, F_e = -K_e (|r_e| - L_e) r_e / |r_e|
+with r_e = x_i - x_j, and scattered to the nodes as D @ F_e. K and L may be scalars
+or per-spring arrays. Positions may carry a leading batch axis, (B, N, 3), for ensembles.
+"""
+
+import os
+import numpy as np
+from scipy import sparse
+
+PER_SPRING = "per-spring"  # K and L as recorded in output stems and metadata when the edge file sets them per spring
+
+## Define spring network:
+class SpringNetwork:
+
+    def __init__(self, edges, K, L, N=None, cutoff=1e-6):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.i, self.j = edges[:, 0], edges[:, 1]
+        self.N = int(edges.max()) + 1 if N is None else N
+        self.K = np.broadcast_to(np.asarray(K, dtype=float), self.i.shape).copy()
+        self.L = np.broadcast_to(np.asarray(L, dtype=float), self.i.shape).copy()
+        self.cutoff = cutoff  # Springs shorter than this exert no force (avoids r -> 0 error)
+
+        E = len(self.i)
+        rows = np.concatenate([self.i, self.j])
+        cols = np.concatenate([np.arange(E), np.arange(E)])
+        vals = np.concatenate([np.ones(E), -np.ones(E)])
+        self.incidence = sparse.csr_matrix((vals, (rows, cols)), shape=(self.N, E))
+
+    ## Total spring force on each node:
+    def forces(self, positions):
+        r_e = positions[..., self.i, :] - positions[..., self.j, :]
+        r_abs = np.sqrt(np.einsum('...i,...i->...', r_e, r_e))
+        mask = r_abs > self.cutoff
+        K, L = np.broadcast_to(self.K, r_abs.shape)[mask], np.broadcast_to(self.L, r_abs.shape)[mask]
+        coeff = np.zeros_like(r_abs)
+        coeff[mask] = -K * (r_abs[mask] - L) / r_abs[mask]
+        F_e = coeff[..., None] * r_e
+        if F_e.ndim == 2:
+            return self.incidence @ F_e
+
+        # Batched: scatter all members at once, as an (E, B * 3) right-hand side
+        B = F_e.shape[0]
+        F = self.incidence @ np.moveaxis(F_e, 0, 1).reshape(len(self.i), B * 3)
+        return np.moveaxis(F.reshape(self.N, B, 3), 1, 0)
+
+
+## Spring connections of the 32-point stickman of articulated_body_save_to_npy.py:
+def stickman_connections():
+    connections = [(i, i+1) for i in range(31)]
+    for edge in [(13, 14), (17, 18), (21, 22), (26, 27)]:
+        connections.remove(edge)
+    return connections + [(0, 7), (9, 17), (9, 18), (13, 22), (13, 27)]
+
+
+## Load a body from text files: node positions ("x y z" per line) and edges ("i j" or "i j K L" per line):
+def load_body(positions_file, edges_file, K, L):
+    if edges_file is None:
+        raise ValueError(f"A body loaded from {positions_file} needs its springs: set body_edges_file")
+    positions = np.loadtxt(positions_file, ndmin=2)
+    table = np.loadtxt(edges_file, ndmin=2)
+    edges = table[:, :2].astype(np.int64)
+    if table.shape[1] >= 4:
+        K, L = table[:, 2], table[:, 3]  # Per-spring constants and rest lengths
+    return positions, SpringNetwork(edges, K, L, N=positions.shape[0])
+
+
+## Whether an edge file sets K and L per spring ("i j K L" lines):
+def per_spring_edges(edges_file):
+    return edges_file is not None and np.loadtxt(edges_file, ndmin=2).shape[1] >= 4
+
+
+## Name, K and L of a body as written in its output stem and metadata (a loaded body is named after its
+## node file unless body_name is given, and K and L are PER_SPRING when the edge file sets them):
+def body_labels(body_name, positions_file, edges_file, K, L):
+    if body_name is None:
+        body_name = "Stickman" if positions_file is None else os.path.splitext(os.path.basename(positions_file))[0]
+    if per_spring_edges(edges_file):
+        K, L = PER_SPRING, PER_SPRING
+    return body_name, K, L
@@ -0,0 +1,209 @@
+"""
+Parameter-sweep runner for the simulation scripts.
+
+Runs one of the four simulation scripts over the Cartesian product of a parameter grid,
+e.g.
+
+    python sweep.py magnetised beta=1,5,10 alpha=3,5 N0=500 --workers 4 --threads 2
+
+Each grid point runs as its own Python process (with name=value overrides, see
+overrides.py) in the output directory, with the BLAS/OpenMP thread count pinned through
+the environment before NumPy loads. Points whose output files already exist, and are
+complete, are skipped, so an interrupted sweep resumes where it stopped (runs that left
+a checkpoint continue from it). Remaining points are started in order of decreasing
+estimated cost (ensemble_size * N^2 * simulated time, with N the script's N0, or the
+articulated body's node count), so the longest runs never start
+last and leave the other workers idle. Each run's output is logged to {stem}.log next
+to its .npy file.
+
+Stems are the scripts' own: the MODELS template, plus _seed{seed} for a single run with a
+given seed (see ensemble.seeded_stem). A grid varying any other parameter that is not in
+the template (e.g. R or method) would give several runs the same stem, and so the same
+output, checkpoint and log files, and is refused.
+"""
+
+import argparse
+import ast
+import glob
+import itertools
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from overrides import parse_value, script_parameters
+from ensemble import seeded_stem
+from archive import load_trajectory
+from spring_network import SpringNetwork, body_labels, stickman_connections
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Script and output stem (as saved by the script) for each model:
+MODELS = {
+    "stokes": ("optimised_stokes_save_to_npy.py", "{N0}_{t_span[1]}"),
+    "brinkman": ("optimised_brinkman_save_to_npy.py", "BM_{alpha}_{N0}_{t_span[1]}"),
+    "magnetised": ("optimised_magnetised_save_to_npy.py", "Magnetic_{beta}_{alpha}_{N0}_{t_span[1]}"),
+    "articulated": ("articulated_body_save_to_npy.py", "{body_name}_{alpha}_{delta}_{K}_{L}_{t_span[1]}"),
+}
+
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                    "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+## Output stem of a grid point, as the script names it (an articulated body's name, K and L as in
+## spring_network.body_labels, and a single run's seed as in ensemble.seeded_stem; relative body files
+## are read from base_dir, where the script runs):
+def job_stem(model, parameters, base_dir="."):
+    if model == "articulated":
+        positions_file, edges_file = (parameters[name] and os.path.join(base_dir, parameters[name])
+                                      for name in ("body_positions_file", "body_edges_file"))
+        body_name, K, L = body_labels(parameters["body_name"], positions_file, edges_file, parameters["K"], parameters["L"])
+        parameters = {**parameters, "body_name": body_name, "K": K, "L": L}
+    return seeded_stem(MODELS[model][1].format(**parameters), parameters.get("seed"), parameters.get("ensemble_size", 1))
+
+
+## Parse "name=v1,v2,..." grid arguments (values are Python literals, e.g. t_span=(0,100),(0,500)):
+def parse_grid(args):
+    grid = {}
+    for arg in args:
+        name, sep, text = arg.partition("=")
+        if not sep:
+            raise ValueError(f"Expected name=v1,v2,..., got {arg!r}")
+        try:
+            values = ast.literal_eval(f"[{text}]")
+        except (ValueError, SyntaxError):
+            values = [parse_value(v) for v in text.split(",")]
+        grid[name] = values
+    return grid
+
+
+## Suffix of a grid point's output files (.npy files or archive directories):
+def output_suffix(parameters):
+    return "archive" if parameters.get("archive_output") else "output.npy"
+
+
+## Expected output files of a grid point:
+def output_files(stem, parameters):
+    B, seed = parameters.get("ensemble_size", 1), parameters.get("seed")
+    if B == 1:
+        return [f"{stem}_{output_suffix(parameters)}"]
+    if seed is None:
+        return None  # Seeds are drawn at run time, see completed()
+    return [f"{stem}_seed{seed + b}_{output_suffix(parameters)}" for b in range(B)]
+
+
+## Check whether an output file or archive is complete (streamed outputs hold NaN frames until they are written):
+def complete_file(path):
+    if not os.path.exists(path):
+        return False
+    try:
+        trajectory = load_trajectory(path)
+    except (ValueError, OSError):
+        return False
+    return trajectory.shape[0] > 0 and not np.isnan(trajectory.frames[-1]).any()
+
+
+## Check whether a grid point has already been run:
+def completed(output_dir, stem, parameters):
+    files = output_files(stem, parameters)
+    if files is None:
+        paths = glob.glob(os.path.join(output_dir, glob.escape(stem) + "_seed*_" + output_suffix(parameters)))
+        return sum(complete_file(path) for path in paths) >= parameters["ensemble_size"]
+    return all(complete_file(os.path.join(output_dir, f)) for f in files)
+
+
+## Number of particles of a grid point (an articulated body's nodes, from its node file or the stickman):
+def job_particles(model, parameters, base_dir="."):
+    if model != "articulated":
+        return parameters["N0"]
+    if parameters["body_positions_file"] is None:
+        return SpringNetwork(stickman_connections(), 1, 1).N
+    return np.loadtxt(os.path.join(base_dir, parameters["body_positions_file"]), ndmin=2).shape[0]
+
+
+## Relative cost of a grid point (pairwise work per RHS times simulated time), for N particles:
+def estimated_cost(parameters, N):
+    t0, t1 = parameters["t_span"]
+    return parameters.get("ensemble_size", 1) * N**2 * (t1 - t0)
+
+
+## Build the jobs for a grid, skipping completed points, longest first:
+def build_jobs(model, grid, output_dir):
+    script = os.path.join(SCRIPT_DIR, MODELS[model][0])
+    defaults = script_parameters(script)
+    unknown = set(grid) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {model}: {sorted(unknown)}")
+
+    jobs, skipped, points = [], [], {}
+    for values in itertools.product(*grid.values()):
+        overrides = dict(zip(grid, values))
+        parameters = {**defaults, **overrides}
+        stem = job_stem(model, parameters, output_dir)
+        if stem in points:
+            raise ValueError(f"Grid points {points[stem]} and {overrides} would both be saved as {stem}: "
+                             f"only vary parameters in the output name ({MODELS[model][1]}), or seed with ensemble_size = 1")
+        points[stem] = dict(overrides)
+        if os.path.exists(os.path.join(output_dir, f"{stem}_checkpoint.npz")):
+            overrides["resume"] = True  # Continue an interrupted run from its checkpoint
+        job = dict(script=script, stem=stem, overrides=overrides,
+                   cost=estimated_cost(parameters, job_particles(model, parameters, output_dir)))
+        (skipped if completed(output_dir, stem, parameters) else jobs).append(job)
+    jobs.sort(key=lambda job: job["cost"], reverse=True)
+    return jobs, skipped
+
+
+## Run one grid point in its own process with pinned thread counts:
+def run_job(job, output_dir, threads):
+    env = dict(os.environ, **{name: str(threads) for name in THREAD_VARIABLES})
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [SCRIPT_DIR, env.get("PYTHONPATH")]))
+    args = [sys.executable, job["script"]] + [f"{k}={v!r}" for k, v in job["overrides"].items()]
+    start = time.time()
+    with open(os.path.join(output_dir, f"{job['stem']}.log"), "w") as log:
+        status = subprocess.run(args, cwd=output_dir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    return status, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a simulation script over a parameter grid.")
+    parser.add_argument("model", choices=sorted(MODELS))
+    parser.add_argument("grid", nargs="+", help="name=v1,v2,... (Python literals)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Concurrent runs")
+    parser.add_argument("--threads", type=int, default=None, help="BLAS/OpenMP threads per run (default: cores / workers)")
+    parser.add_argument("--output-dir", default=".", help="Directory for .npy outputs and logs")
+    parser.add_argument("--dry-run", action="store_true", help="List the jobs without running them")
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    output_dir = os.path.abspath(args.output_dir)
+    if not args.dry_run:
+        os.makedirs(output_dir, exist_ok=True)
+    jobs, skipped = build_jobs(args.model, parse_grid(args.grid), output_dir)
+
+    print(f"{len(jobs)} runs to do, {len(skipped)} already complete "
+          f"({args.workers} workers x {threads} threads)")
+    for job in skipped:
+        print(f"  skip {job['stem']}")
+    if args.dry_run:
+        for job in jobs:
+            print(f"  run  {job['stem']}  (cost {job['cost']:.3g})")
+        return
+
+    failed = []
+    with ThreadPoolExecutor(args.workers) as pool:
+        futures = {pool.submit(run_job, job, output_dir, threads): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            status, elapsed = future.result()
+            print(f"  {'done' if status == 0 else 'FAILED'} {job['stem']} in {elapsed:.1f} s")
+            if status != 0:
+                failed.append(job["stem"])
+
+    if failed:
+        print(f"{len(failed)} runs failed (see their .log files): {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Run telemetry for the simulation scripts.
+
+Records RHS evaluations, time spent in each phase of the RHS (pair geometry, H1/H2
+kernels, force, contraction), wall time per simulated time unit between progress
+checkpoints, and a summary of the solver's accepted/rejected steps and step sizes.
+Records are written as one JSON object per line to a `_telemetry.jsonl` sidecar next
+to the `.npy` output.
+
+When disabled, `phase()` returns a shared null context and every other hook returns
+immediately, so the overhead is one attribute check per call.
+"""
+
+import json
+import time
+from contextlib import nullcontext
+import numpy as np
+
+_NULL_PHASE = nullcontext()
+
+# RHS evaluations per attempted step of the scipy explicit RK methods (stages, plus the FSAL
+# evaluation at the new point), and per initialisation (f(t0, y0) plus one for the initial step size):
+EVALS_PER_STEP = {"RK23": 3, "RK45": 6, "DOP853": 12}
+EVALS_AT_START = 2
+
+
+## Define timed phase context manager:
+class _Phase:
+    __slots__ = ("telemetry", "name", "start")
+
+    def __init__(self, telemetry, name):
+        self.telemetry, self.name = telemetry, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        times = self.telemetry.phase_times
+        times[self.name] = times.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+## Define running step-size statistics (constant memory, however many steps are taken), with the
+## number of rejected steps when the integrator counts them (trajectory_writer.integrate_to_writer):
+class StepStats:
+
+    def __init__(self, t0, count=0, t_last=None, h_min=np.inf, h_max=0.0, rejected=None):
+        self.t0, self.count = t0, count
+        self.t_last = t0 if t_last is None else t_last
+        self.h_min, self.h_max = h_min, h_max
+        self.rejected = rejected
+
+    ## Record an accepted step to time t:
+    def add(self, t):
+        h = t - self.t_last
+        self.count += 1
+        self.h_min, self.h_max = min(self.h_min, h), max(self.h_max, h)
+        self.t_last = t
+
+    ## Statistics of the steps between successive times:
+    @classmethod
+    def from_times(cls, times):
+        stats = cls(float(times[0]))
+        for t in times[1:]:
+            stats.add(float(t))
+        return stats
+
+    ## State as a float array (for checkpoints, rejected steps NaN if not counted), and back:
+    def state(self):
+        rejected = np.nan if self.rejected is None else self.rejected
+        return np.array([self.t0, self.count, self.t_last, self.h_min, self.h_max, rejected])
+
+    @classmethod
+    def from_state(cls, state):
+        t0, count, t_last, h_min, h_max, rejected = (float(v) for v in state)
+        return cls(t0, int(count), t_last, h_min, h_max, None if np.isnan(rejected) else int(rejected))
+
+
+## Define telemetry recorder:
+class Telemetry:
+
+    def __init__(self, enabled=False, parameters=None):
+        self.enabled = enabled
+        self.parameters = parameters or {}
+        self.phase_times = {}
+        self.notes = {}
+        self.records = []
+        self.nfev = 0
+        self.start = time.perf_counter()
+        self.last_t, self.last_wall = None, 0.0
+
+    ## Time a phase of the RHS:
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    ## Add another recorder's phase times (e.g. a worker thread's) to these, and reset them:
+    def merge_phases(self, other):
+        for name, seconds in other.phase_times.items():
+            self.phase_times[name] = self.phase_times.get(name, 0.0) + seconds
+        other.phase_times.clear()
+
+    ## Count an RHS evaluation:
+    def rhs_call(self, t):
+        if self.enabled:
+            self.nfev += 1
+            if self.last_t is None:
+                self.last_t = t
+
+    ## Keep the latest value of model diagnostics (included in the next record):
+    def note(self, **values):
+        if self.enabled:
+            self.notes.update({k: float(v) for k, v in values.items()})
+
+    ## Record progress at simulated time t:
+    def checkpoint(self, t):
+        if not self.enabled:
+            return
+        wall = time.perf_counter() - self.start
+        dt = t - (self.last_t if self.last_t is not None else t)
+        self.records.append({
+            "event": "progress",
+            "t": float(t),
+            "wall_time": wall,
+            "nfev": self.nfev,
+            "wall_time_per_time_unit": (wall - self.last_wall) / dt if dt > 0 else None,
+            "phase_times": dict(self.phase_times),
+            **self.notes,
+        })
+        self.last_t, self.last_wall = t, wall
+
+    ## Summarise the solver run from a solve_ivp result (or a streamed run's, with step_stats):
+    def finish(self, solution, method="RK45"):
+        if not self.enabled:
+            return
+        wall = time.perf_counter() - self.start
+        steps = getattr(solution, "step_stats", None) or StepStats.from_times(solution.t)
+        accepted = steps.count
+        summary = {
+            "event": "summary",
+            "parameters": self.parameters,
+            "method": method,
+            "status": int(solution.status),
+            "nfev": int(solution.nfev),
+            "accepted_steps": accepted,
+            "rejected_steps": None,
+            "step_size_min": float(steps.h_min) if accepted else None,
+            "step_size_mean": (steps.t_last - steps.t0) / accepted if accepted else None,
+            "step_size_max": float(steps.h_max) if accepted else None,
+            "wall_time": wall,
+            "wall_time_per_time_unit": wall / (steps.t_last - steps.t0) if accepted else None,
+            "phase_times": dict(self.phase_times),
+        }
+        if getattr(solution, "rejected_steps", None) is not None:
+            summary["rejected_steps"] = int(solution.rejected_steps)  # Counted by the built-in solvers and streamed runs
+        elif method in EVALS_PER_STEP:
+            attempted = (solution.nfev - EVALS_AT_START) // EVALS_PER_STEP[method]
+            summary["rejected_steps"] = attempted - accepted
+        self.records.append(summary)
+
+    ## Write records as JSON lines:
+    def write(self, filename):
+        if not self.enabled:
+            return
+        with open(filename, "w") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+        print(f"Telemetry saved to {filename}")
+
+
+## Disabled recorder, used when no telemetry is passed in:
+NO_TELEMETRY = Telemetry(enabled=False)
@@ -0,0 +1,124 @@
+"""
+Streaming trajectory output for the simulation scripts.
+
+Instead of keeping every solver step in memory (solve_ivp's solution.y) and saving at
+the end, frames at chosen output times are written, as the integration proceeds, into
+a preallocated memory-mapped .npy file of shape (N, 3, T), the same layout as before.
+Memory use is flat in the run length, and a partial trajectory can be read while the
+job is still running with np.load(filename, mmap_mode="r"): frames not yet written
+are NaN. Frames may be stored as float32 (dtype=np.float32), halving the file size;
+the integration itself stays in float64. Given per-member metadata, frames are written
+to archives instead (see archive.py), frame-major, so each frame is one contiguous
+write and the output times are stored with them.
+
+Frames are interpolated with the solver's dense output, exactly as solve_ivp does for
+t_eval, so they agree with solve_ivp(..., t_eval=times) to rounding. Runs can be
+checkpointed and resumed, see checkpoint.py. Only running statistics of the step sizes
+are kept for the telemetry (telemetry.StepStats), not the step times. Rejected steps are
+counted as they happen: by the built-in solvers, and for scipy's from the RHS evaluations
+of each step() call (a fixed number per attempt; scipy's DOP853 dense output takes three
+more, which the telemetry's estimate from the total count cannot tell apart).
+"""
+
+import os
+from types import SimpleNamespace
+import numpy as np
+from archive import create_archive
+from integrators import SOLVERS
+from telemetry import EVALS_PER_STEP, StepStats
+
+
+## Define memory-mapped trajectory writer (one (N, 3, T) file, or archive if metadata is given, per ensemble member):
+class TrajectoryWriter:
+
+    def __init__(self, filenames, N, times, restart=None, dtype=np.float64, metadata=None):
+        self.N = N
+        self.times = np.asarray(times, dtype=float)
+        self.arrays, self.frames = [], []  # Memory maps, and (T, N, 3) views of them
+        T = len(self.times)
+        if restart is None:
+            self.filenames, self.frames_written = filenames, 0
+            for b, filename in enumerate(filenames):
+                if metadata is not None:
+                    array = create_archive(filename, N, self.times, metadata[b], dtype)
+                else:
+                    array = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=(N, 3, T))
+                    array[:] = np.nan  # Marks frames not yet written
+                self.arrays.append(array)
+                self.frames.append(array if metadata is not None else array.transpose(2, 0, 1))
+        else:
+            # Reopen the outputs of an interrupted run (see checkpoint.py)
+            self.filenames, self.frames_written = restart["filenames"], restart["frames_written"]
+            for filename in self.filenames:
+                archive = os.path.isdir(filename)
+                array = np.lib.format.open_memmap(os.path.join(filename, "positions.npy") if archive else filename, mode="r+")
+                expected = (T, N, 3) if archive else (N, 3, T)
+                if array.shape != expected:
+                    raise ValueError(f"{filename} has shape {array.shape}, expected {expected}")
+                self.arrays.append(array)
+                self.frames.append(array if archive else array.transpose(2, 0, 1))
+
+    ## Write frame k from a flat state vector:
+    def write(self, k, y):
+        for frames, frame in zip(self.frames, y.reshape(len(self.frames), self.N, 3)):
+            frames[k] = frame
+        self.frames_written = k + 1
+
+    def flush(self):
+        for array in self.arrays:
+            array.flush()
+
+    def close(self):
+        for array, filename in zip(self.arrays, self.filenames):
+            array.flush()
+            print(f"3D array saved to {filename} ({self.frames_written} of {len(self.times)} frames)")
+        self.arrays, self.frames = [], []
+
+
+## Integrate with an explicit RK solver (scipy or built-in), writing frames at writer.times as the steps pass them
+## (with periodic checkpoints, continuing from `restart` if given, see checkpoint.py, and calling step_callback(solver),
+## if given, after each accepted step):
+def integrate_to_writer(fun, t_span, y0, writer, method="RK45", checkpointer=None, restart=None, step_callback=None, **options):
+    if restart is None:
+        solver = SOLVERS[method](fun, t_span[0], y0, t_span[1], **options)
+        step_stats = StepStats(solver.t, rejected=0)  # Step-size summary for the telemetry
+    else:
+        first_step = min(float(restart["h_abs"]), t_span[1] - float(restart["t"]))
+        solver = SOLVERS[method](fun, float(restart["t"]), restart["y"], t_span[1], first_step=first_step, **options)
+        checkpointer.restore(solver, restart)
+        step_stats = StepStats.from_state(restart["step_stats"])
+    times, k = writer.times, writer.frames_written
+    if checkpointer is not None:
+        checkpointer.start(solver.t)
+
+    while k < len(times) and times[k] <= solver.t:
+        writer.write(k, solver.y)
+        k += 1
+
+    while solver.status == "running":
+        nfev, rejected = solver.nfev, getattr(solver, "rejected_steps", None)
+        solver.step()
+        if solver.status == "failed":
+            break
+        step_stats.add(solver.t)
+        if rejected is not None:
+            step_stats.rejected += solver.rejected_steps - rejected
+        else:
+            step_stats.rejected += (solver.nfev - nfev) // EVALS_PER_STEP[method] - 1  # Attempts, less the accepted one
+        if step_callback is not None:
+            step_callback(solver)
+        if k < len(times) and times[k] <= solver.t:
+            interpolant = solver.dense_output()
+            while k < len(times) and times[k] <= solver.t:
+                writer.write(k, interpolant(times[k]))
+                k += 1
+        if checkpointer is not None and solver.status == "running" and checkpointer.due(solver.t):
+            checkpointer.save(solver, writer, step_stats)
+
+    status = 0 if solver.status == "finished" else -1
+    if checkpointer is not None and status == 0:
+        checkpointer.remove()
+    # t holds only the first and last times: the step times themselves are not kept
+    return SimpleNamespace(t=np.array([step_stats.t0, solver.t]), step_stats=step_stats, nfev=solver.nfev, status=status,
+                           success=status == 0, message=f"Solver {solver.status}",
+                           rejected_steps=step_stats.rejected)
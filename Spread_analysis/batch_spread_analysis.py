@@ -0,0 +1,127 @@
+"""
+Batch spread analysis of every run (or a filtered set of runs) in an output directory.
+
+Run from the repository root, e.g.
+
+    python Spread_analysis/batch_spread_analysis.py model=Brinkman N0=2000 --workers 4
+
+Each selected run has its outliers filtered out (see catalogue.py) and is analysed exactly
+as by spread_analysis_save_to_csv.py, in parallel worker processes. All results go into one
+long-format table, with one row per run and height and the run's parameters as columns:
+
+    model,file,seed,alpha,beta,delta,K,L,N0,T,z,x_width,y_width,n_particles
+
+The R *_spread_analysis.R scripts can select runs from it with
+read.csv("spread_widths.csv") %>% filter(model == "Brinkman", alpha == 5). With
+--per-run-csv, each run's table is also saved under the single-run script's file name
+(e.g. BM_5_2000_500_particle_widths.csv), so the R scripts can read it unchanged.
+
+Each run's result is cached in the directory's .catalogue_cache/, keyed by the file's
+content and the analysis options. Rerunning after adding a simulation only analyses the
+new run.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Simulation_scripts"))
+from archive import load_trajectory
+from catalogue import Catalogue
+from sweep import parse_grid
+from spread_widths import widths_vs_height
+
+PARAMETER_COLUMNS = ["alpha", "beta", "delta", "K", "L", "N0", "T"]
+COLUMNS = ["z", "x_width", "y_width", "n_particles"]
+
+
+## Number of frames analysed: those up to the run's duration T (older outputs store no times,
+## so their first T frames are used, as in spread_analysis_save_to_csv.py):
+def analysed_frames(run):
+    trajectory, T = run.trajectory, run.parameters["T"]
+    return int(np.searchsorted(trajectory.times, T, side="right")) if trajectory.times_known else int(T)
+
+
+## Spread analysis of one run (in a worker process), as an array of rows (z, x_width, y_width, n_particles):
+def analyse(path, mask, n_frames, n_slices):
+    filtered_positions = load_trajectory(path).positions[mask, :, :n_frames]
+    return np.array(widths_vs_height(filtered_positions, n_slices), dtype=float).reshape(-1, len(COLUMNS))
+
+
+## Name of a run's table as saved by spread_analysis_save_to_csv.py:
+def per_run_filename(run):
+    return f"{'Stokes_' if run.model == 'Stokes' else ''}{run.stem}_particle_widths.csv"
+
+
+## Table of one run's results, with its model, stem, seed and parameters as columns:
+def run_table(run, rows):
+    table = pd.DataFrame(rows, columns=COLUMNS)
+    table["n_particles"] = table["n_particles"].astype(int)
+    identifiers = dict(model=run.model, file=run.stem, seed=run.seed,
+                       **{name: run.parameters.get(name) for name in PARAMETER_COLUMNS})
+    for position, (name, value) in enumerate(identifiers.items()):
+        table.insert(position, name, value)
+    table["seed"] = table["seed"].astype("Int64")  # Integer seeds (empty if none), also when runs with and without are combined
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread analysis of many runs, saved to one long-format table.")
+    parser.add_argument("filters", nargs="*", help="name=v1,v2,... for model, seed or a parameter, e.g. model=Brinkman alpha=1,5")
+    parser.add_argument("--directory", default="npy_output_files")
+    parser.add_argument("--output", default="spread_widths.csv", help="Combined long-format table")
+    parser.add_argument("--n-slices", type=int, default=300)
+    parser.add_argument("--velocity-percentile", type=float, default=95, help="Outlier filter on displacement")
+    parser.add_argument("--distance-percentile", type=float, default=95, help="Outlier filter on final distance")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--per-run-csv", action="store_true", help="Also save each run's table as spread_analysis_save_to_csv.py does")
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.directory)
+    runs = catalogue.select(parse_grid(args.filters))  # One run per stem, archives preferred
+
+    # Outlier masks (cached by the catalogue) and cached results; the rest are analysed below:
+    results, jobs = {}, {}
+    for run in list(runs):
+        try:
+            mask = run.outlier_mask(args.velocity_percentile, args.distance_percentile)
+            n_frames = analysed_frames(run)
+        except ValueError as error:
+            print(f"  skip {run.stem}: {error}")  # Placeholder or unreadable files
+            runs.remove(run)
+            continue
+        name = f"spread_{args.n_slices}_{args.velocity_percentile:g}_{args.distance_percentile:g}_{n_frames}"
+        if os.path.exists(catalogue.cache_file(run, name)):
+            results[run.stem] = np.load(catalogue.cache_file(run, name))
+        else:
+            jobs[run.stem] = (run, name, mask, n_frames)
+    print(f"{len(runs)} runs selected, {len(results)} cached, {len(jobs)} to analyse ({args.workers} workers)")
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = {pool.submit(analyse, run.path, mask, n_frames, args.n_slices): stem
+                   for stem, (run, name, mask, n_frames) in jobs.items()}
+        for future in as_completed(futures):
+            stem = futures[future]
+            run, name = jobs[stem][:2]
+            try:
+                results[stem] = future.result()
+            except (IndexError, ValueError) as error:
+                print(f"  FAILED {stem}: {error}")  # e.g. single-frame outputs of failed runs
+                runs.remove(run)
+                continue
+            catalogue.store(run, name, results[stem])
+            print(f"  done {stem}")
+
+    tables = [run_table(run, results[run.stem]) for run in runs]
+    if args.per_run_csv:
+        for run, table in zip(runs, tables):
+            table[COLUMNS].to_csv(per_run_filename(run), index=False)
+    if tables:
+        pd.concat(tables, ignore_index=True).to_csv(args.output, index=False)
+        print(f"Saved {len(tables)} runs to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
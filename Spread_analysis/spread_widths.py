@@ -0,0 +1,84 @@
+"""
+Spread analysis of a falling cloud: the x and y widths of the cloud as a function of height.
+
+For each of n_slices heights z (between the 1st and 99th percentiles of all heights), the
+x and y positions of every particle at the first frame where it is below z are collected
+and trimmed to their 5th-95th percentiles; the widths are the ranges of the trimmed values.
+Used by spread_analysis_save_to_csv.py (one run) and batch_spread_analysis.py (many runs).
+"""
+
+import numpy as np
+
+## Define first-crossing search: the first frame at which each particle is below each z-level,
+## shape (N, levels), or T where it never is:
+def first_crossing_indices(z_trajectories, z_levels):
+    # A particle is first below z when its running minimum height first drops below z. The running
+    # minimum never increases, even when the trajectory does, so one binary search per particle
+    # finds its first crossing of every level. Unwritten (NaN) frames never count as below.
+    running_min = np.minimum.accumulate(np.where(np.isnan(z_trajectories), np.inf, z_trajectories), axis=1)
+    return np.stack([np.searchsorted(-m, -z_levels, side="right") for m in running_min])
+
+## Define row percentiles: the q-th percentile of the first `counts` values of each row of a
+## row-sorted (or suitably partitioned) array, with np.percentile's linear interpolation in the
+## same arithmetic, so the results are identical to np.percentile on each row's values:
+def row_percentiles(sorted_values, counts, q):
+    virtual = (counts - 1) * (q / 100)
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    rows = np.arange(len(sorted_values))
+    below = sorted_values[rows, previous.astype(np.intp)]
+    above = sorted_values[rows, np.minimum(previous.astype(np.intp) + 1, counts - 1)]
+    difference = above - below
+    result = below + difference * gamma.astype(sorted_values.dtype)
+    upper = gamma >= 0.5
+    result[upper] = (above - difference * (1 - gamma).astype(sorted_values.dtype))[upper]
+    return result
+
+## Define trimmed widths: for each row, the max - min and number of its values between the row's
+## 5th and 95th percentiles (NaN entries are ignored):
+def trimmed_widths(values):
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    sorted_values = np.sort(values, axis=1)  # NaN sorts last
+    low = row_percentiles(sorted_values, counts, 5)[:, None]
+    high = row_percentiles(sorted_values, counts, 95)[:, None]
+    inside = (values >= low) & (values <= high)
+    widths = np.where(inside, values, -np.inf).max(axis=1) - np.where(inside, values, np.inf).min(axis=1)
+    return widths, inside.sum(axis=1)
+
+## Define spread analysis: x and y widths of the cloud at n_slices heights, from each particle's
+## position where it first passes below each height (rows of z, x_width, y_width, n_particles):
+def widths_vs_height(filtered_positions, n_slices=200, z_min=None, z_max=None):
+    N, _, T = filtered_positions.shape
+    all_z = filtered_positions[:, 2, :].flatten()  # A copy, partitioned in place below
+
+    # 1st and 99th percentiles of all heights from a single partition (NaN if any height is NaN, as np.percentile):
+    n = all_z.size
+    ranks = [int(np.floor((n - 1) * (q / 100))) for q in (1, 99)]
+    all_z.partition(sorted({0, n - 1, *ranks, *(min(k + 1, n - 1) for k in ranks)}))
+    if np.isnan(all_z[-1]):
+        z_percentiles = np.full(2, np.nan, dtype=all_z.dtype)
+    else:
+        z_percentiles = [row_percentiles(all_z[None], np.array([n]), q)[0] for q in (1, 99)]
+    if z_min is None:
+        z_min = z_percentiles[0]
+    if z_max is None:
+        z_max = z_percentiles[1]
+
+    z_levels = np.linspace(z_min, z_max, n_slices)
+
+    # Positions of each particle where it first passes below each level, shape (levels, N),
+    # NaN for particles that never do:
+    crossing = first_crossing_indices(filtered_positions[:, 2, :], z_levels).T
+    crossed = crossing < T
+    particles = np.arange(N)
+    x_vals = filtered_positions[particles, 0, np.minimum(crossing, T - 1)]
+    y_vals = filtered_positions[particles, 1, np.minimum(crossing, T - 1)]
+    x_vals[~crossed] = np.nan
+    y_vals[~crossed] = np.nan
+
+    # Levels crossed by at least 5 particles, trimmed to the 5th-95th percentiles in x and y:
+    levels = np.flatnonzero(crossed.sum(axis=1) >= 5)
+    x_width, n_x = trimmed_widths(x_vals[levels])
+    y_width, n_y = trimmed_widths(y_vals[levels])
+    kept = (n_x >= 5) & (n_y >= 5)
+    return list(zip(z_levels[levels][kept], x_width[kept], y_width[kept], n_x[kept]))